@@ -1,11 +1,21 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, UploadFile, File, HTTPException, Query, Response
+from fastapi.responses import FileResponse, StreamingResponse
+import asyncio
+import functools
+import hashlib
+import json
+import logging
 import os
 import tempfile
-import logging
-from app.services.document_analyzer import DocumentAnalyzer
-from app.services.report_generator import ReportGenerator, REPORTS_DIR
-from app.models.schemas import AnalysisResponse, Summary, AIMetadata
+from datetime import datetime
+from typing import Any, AsyncIterator, BinaryIO, Callable, Dict, Optional, Tuple
+from app.services.document_analyzer import DocumentAnalyzer, DocumentSource
+from app.services.report_generator import ReportGenerator, render_report_async, report_exists, schedule_render
+from app.services.task_executor import analysis_executor, ExecutorBusyError, ExecutorTimeoutError
+from app.services.result_cache import document_result_cache
+from app.services.pixel_forensics import PIXEL_ANALYSIS_ENABLED, PIXEL_FORENSICS_AVAILABLE
+from app.services.job_manager import job_manager, Job, JOB_DONE, JOB_FAILED
+from app.models.schemas import AnalysisResponse, Summary, AIMetadata, JobStatus, JobProgress
 
 logger = logging.getLogger(__name__)
 
@@ -13,6 +23,20 @@ router = APIRouter()
 
 # Максимальный размер файла: 100MB
 MAX_FILE_SIZE = 100 * 1024 * 1024
+MAX_FILE_SIZE_DETAIL = "Файл слишком большой (максимум 100MB)"
+# Загрузка читается частями этого размера: в памяти не больше одной части
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# DOCX/PPTX — ZIP-архивы, начинаются с заголовка локального файла
+ZIP_SIGNATURE = b"PK\x03\x04"
+# Копия загрузки для фоновой задачи держится в памяти до этого размера, дальше — во временном файле
+JOB_SPOOL_MAX_MEMORY = 4 * 1024 * 1024
+# Через сколько секунд клиенту стоит повторить запрос, если пул анализа заполнен
+BUSY_RETRY_AFTER = 10
+# Параметр запроса: анализ пикселей изображений (не задан — настройка сервера PIXEL_ANALYSIS)
+PIXEL_ANALYSIS_QUERY = Query(
+    None,
+    description="Анализ пикселей изображений (шум, симметрия, блочность JPEG, спектр); false — только метаданные",
+)
 
 @router.get("/health")
 async def health_check():
@@ -28,23 +52,233 @@ async def list_routes():
             "GET /api/health",
             "GET /api/routes",
             "POST /api/analyze/document",
+            "POST /api/analyze/document/stream",
+            "POST /api/jobs",
+            "GET /api/jobs/{job_id}",
+            "GET /api/jobs/{job_id}/result",
+            "GET /api/jobs/{job_id}/report",
             "GET /api/reports/{filename}",
         ]
     }
 
 
+async def _ingest_upload(file: UploadFile, copy_to: Optional[BinaryIO] = None) -> Tuple[str, int]:
+    """
+    Потоковое чтение загруженного файла частями: проверка размера, сигнатуры ZIP и SHA-256.
+    При copy_to части сразу дописываются в этот файл (загрузка переживает запрос).
+
+    Returns:
+        (sha256, размер в байтах); файл после чтения перемотан в начало
+    """
+    sha256 = hashlib.sha256()
+    size = 0
+    await file.seek(0)
+    while True:
+        chunk = await file.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        if size == 0 and not chunk.startswith(ZIP_SIGNATURE):
+            raise HTTPException(status_code=400, detail="Файл не является корректным документом DOCX/PPTX")
+        size += len(chunk)
+        if size > MAX_FILE_SIZE:
+            raise HTTPException(status_code=413, detail=MAX_FILE_SIZE_DETAIL)
+        sha256.update(chunk)
+        if copy_to is not None:
+            copy_to.write(chunk)
+    if size == 0:
+        raise HTTPException(status_code=400, detail="Файл пуст")
+    await file.seek(0)
+    return sha256.hexdigest(), size
+
+
+def _remove_spool(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError as e:
+        logger.warning("Временный файл загрузки не удален: %s", e)
+
+
+async def _spool_to_path(file: UploadFile, suffix: str) -> str:
+    """
+    Копия загрузки в именованный временный файл (частями, не целиком в памяти).
+    Путь можно передать в процесс пула; удаляет файл вызывающий.
+    """
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as spool:
+        try:
+            await file.seek(0)
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                spool.write(chunk)
+        except BaseException:
+            spool.close()
+            os.remove(spool.name)
+            raise
+    await file.seek(0)
+    return spool.name
+
+
+def _analyze_and_render(
+    source: DocumentSource,
+    file_name: str,
+    file_size: int,
+    job: Optional[Job] = None,
+    pixel_analysis: Optional[bool] = None,
+    document_id: Optional[str] = None,
+) -> Tuple[Dict[str, Any], str]:
+    """
+    Блокирующая часть анализа: DocumentAnalyzer + сохранение данных отчёта
+    (PDF рендерится позже — при первом запросе отчёта или в фоне).
+    Выполняется в пуле analysis_executor (функция уровня модуля — подходит и для пула процессов)
+    или в пуле фоновых задач; job получает этап и прогресс анализа изображений.
+    pixel_analysis=False отключает анализ пикселей (None — настройка сервера);
+    document_id (SHA-256 загрузки) — под этим идентификатором изображения документа
+    попадают в индекс почти одинаковых изображений.
+
+    Returns:
+        (report_data, имя PDF-отчёта)
+    """
+    doc_analyzer = DocumentAnalyzer(pixel_analysis=pixel_analysis)
+    if job is not None:
+        job.set_stage("analyzing")
+        doc_result = doc_analyzer.analyze_document(
+            source,
+            progress=job.set_progress,
+            on_document=lambda document: job.notify("document", document),
+            on_image=lambda index, image: job.notify("image", {"index": index, **image}),
+            document_id=document_id,
+        )
+    else:
+        doc_result = doc_analyzer.analyze_document(source, document_id=document_id)
+
+    doc_type = doc_result.get("document_type", "word")
+    doc_label = "PowerPoint" if doc_type == "powerpoint" else "Word"
+    document_metadata = doc_result.get("document_metadata", {})
+    embedded_images = doc_result.get("embedded_images", [])
+    images_count = doc_result["images_count"]
+    if images_count == 0:
+        report_data = {
+            "file_type": "document",
+            "summary": {
+                "location": None,
+                "date_time": None,
+                "source": f"{doc_label} документ (изображений не найдено)",
+                "ai_probability": 0,
+                "confidence": "low",
+            },
+            "metadata": {
+                "document_type": doc_type,
+                "document_metadata": document_metadata,
+                "embedded_images": embedded_images,
+                "images": [],
+                "images_count": 0,
+                "images_with_ai_count": 0,
+            },
+            "ai_indicators": {
+                "software_detected": [],
+                "heuristics": {},
+                "anomalies": [],
+                "evidence_from_metadata": [],
+            },
+            "file_info": {
+                "name": file_name,
+                "size": file_size,
+                "size_formatted": f"{file_size / 1024:.2f} KB",
+            },
+            "generated_at": datetime.now().isoformat(),
+        }
+    else:
+        agg = doc_result["aggregated"]
+        source_text = f"{doc_label} документ: изображений {images_count}, с признаками ИИ — {doc_result['images_with_ai_count']}"
+        seen_documents = doc_result["seen_before"]["documents"]
+        if seen_documents:
+            source_text += f"; изображения уже встречались в других документах: {seen_documents}"
+        report_data = {
+            "file_type": "document",
+            "summary": {
+                "location": None,
+                "date_time": None,
+                "source": source_text,
+                "ai_probability": agg["ai_probability"],
+                "confidence": agg["confidence"],
+            },
+            "metadata": {
+                "document_type": doc_type,
+                "document_metadata": document_metadata,
+                "embedded_images": embedded_images,
+                "images": doc_result["images"],
+                "images_count": images_count,
+                "images_with_ai_count": doc_result["images_with_ai_count"],
+                "seen_before": doc_result["seen_before"],
+            },
+            "ai_indicators": {
+                "software_detected": agg["software_detected"],
+                "heuristics": {},
+                "anomalies": agg["anomalies"],
+                "evidence_from_metadata": agg["evidence_from_metadata"],
+            },
+            "file_info": {
+                "name": file_name,
+                "size": file_size,
+                "size_formatted": f"{file_size / (1024*1024):.2f} MB" if file_size >= 1024 * 1024 else f"{file_size / 1024:.2f} KB",
+            },
+        }
+        report_data["generated_at"] = datetime.now().isoformat()
+
+    report_filename = ReportGenerator().save_report_data(report_data)
+    return report_data, report_filename
+
+
+def _build_response(report_data: Dict[str, Any], report_filename: str) -> AnalysisResponse:
+    return AnalysisResponse(
+        file_type="document",
+        summary=Summary(**report_data["summary"]),
+        metadata=report_data["metadata"],
+        ai_indicators=AIMetadata(
+            software_detected=report_data["ai_indicators"]["software_detected"],
+            heuristics=report_data["ai_indicators"].get("heuristics", {}),
+            anomalies=report_data["ai_indicators"].get("anomalies", []),
+            evidence_from_metadata=report_data["ai_indicators"].get("evidence_from_metadata") or [],
+        ),
+        report_url=f"/api/reports/{report_filename}",
+    )
+
+
+def _document_cache_key(digest: str, pixel_analysis: Optional[bool]) -> str:
+    """Ключ кэша документов: ответы с анализом пикселей и без него хранятся отдельно"""
+    if pixel_analysis is None:
+        pixel_analysis = PIXEL_ANALYSIS_ENABLED
+    return digest if pixel_analysis and PIXEL_FORENSICS_AVAILABLE else f"{digest}:metadata-only"
+
+
+def _cached_document(digest: str) -> Optional[Tuple[Dict[str, Any], str]]:
+    """Ответ из кэша документов, если отчёт (PDF или его данные) ещё на месте"""
+    cached = document_result_cache.get(digest)
+    if cached is None:
+        return None
+    if report_exists(cached[1]):
+        logger.info("Документ уже анализировался (sha256=%s), ответ из кэша", digest[:12])
+        return cached
+    document_result_cache.invalidate(digest)
+    return None
+
+
 @router.post("/analyze/document", response_model=AnalysisResponse)
 @router.post("/analyze/document/", response_model=AnalysisResponse)
-async def analyze_document(file: UploadFile = File(...)):
+async def analyze_document(
+    response: Response,
+    file: UploadFile = File(...),
+    pixel_analysis: Optional[bool] = PIXEL_ANALYSIS_QUERY,
+):
     """
     Анализ офисного документа DOCX/PPTX: извлечение метаданных и проверка встроенных изображений.
+
+    Повторно загруженный документ (тот же SHA-256) отдаётся из кэша без анализа;
+    заголовок X-Cache: HIT/MISS показывает, откуда взят ответ.
     """
-    temp_file = None
+    spool_path: Optional[str] = None
     try:
-        content = await file.read()
-        if len(content) > MAX_FILE_SIZE:
-            raise HTTPException(status_code=413, detail="Файл слишком большой (максимум 100MB)")
-
         fn = (file.filename or "").lower()
         if not (fn.endswith(".docx") or fn.endswith(".pptx")):
             raise HTTPException(
@@ -52,136 +286,300 @@ async def analyze_document(file: UploadFile = File(...)):
                 detail="Поддерживаются только форматы DOCX и PPTX",
             )
 
+        digest, file_size = await _ingest_upload(file)
+        cache_key = _document_cache_key(digest, pixel_analysis)
+        cached = _cached_document(cache_key)
+        if cached is not None:
+            response.headers["X-Cache"] = "HIT"
+            return AnalysisResponse(**cached[0])
+
         suffix = ".pptx" if fn.endswith(".pptx") else ".docx"
-        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-            tmp.write(content)
-            temp_file = tmp.name
-
-        doc_analyzer = DocumentAnalyzer()
-        doc_result = doc_analyzer.analyze_document(temp_file)
-
-        doc_type = doc_result.get("document_type", "word")
-        doc_label = "PowerPoint" if doc_type == "powerpoint" else "Word"
-        document_metadata = doc_result.get("document_metadata", {})
-        embedded_images = doc_result.get("embedded_images", [])
-        images_count = doc_result["images_count"]
-        if images_count == 0:
-            summary = Summary(
-                location=None,
-                date_time=None,
-                source=f"{doc_label} документ (изображений не найдено)",
-                ai_probability=0,
-                confidence="low",
-            )
-            report_data = {
-                "file_type": "document",
-                "summary": {
-                    "location": None,
-                    "date_time": None,
-                    "source": f"{doc_label} документ (изображений не найдено)",
-                    "ai_probability": 0,
-                    "confidence": "low",
-                },
-                "metadata": {
-                    "document_type": doc_type,
-                    "document_metadata": document_metadata,
-                    "embedded_images": embedded_images,
-                    "images": [],
-                    "images_count": 0,
-                    "images_with_ai_count": 0,
-                },
-                "ai_indicators": {
-                    "software_detected": [],
-                    "heuristics": {},
-                    "anomalies": [],
-                    "evidence_from_metadata": [],
-                },
-                "file_info": {
-                    "name": file.filename or f"document{suffix}",
-                    "size": len(content),
-                    "size_formatted": f"{len(content) / 1024:.2f} KB",
-                },
-                "generated_at": __import__("datetime").datetime.now().isoformat(),
-            }
-            report_gen = ReportGenerator()
-            report_path = report_gen.generate_pdf_report(report_data, temp_file)
-        else:
-            agg = doc_result["aggregated"]
-            summary = Summary(
-                location=None,
-                date_time=None,
-                source=f"{doc_label} документ: изображений {images_count}, с признаками ИИ — {doc_result['images_with_ai_count']}",
-                ai_probability=agg["ai_probability"],
-                confidence=agg["confidence"],
-            )
-            report_gen = ReportGenerator()
-            report_data = {
-                "file_type": "document",
-                "summary": {
-                    "location": None,
-                    "date_time": None,
-                    "source": f"{doc_label} документ: изображений {images_count}, с признаками ИИ — {doc_result['images_with_ai_count']}",
-                    "ai_probability": agg["ai_probability"],
-                    "confidence": agg["confidence"],
-                },
-                "metadata": {
-                    "document_type": doc_type,
-                    "document_metadata": document_metadata,
-                    "embedded_images": embedded_images,
-                    "images": doc_result["images"],
-                    "images_count": images_count,
-                    "images_with_ai_count": doc_result["images_with_ai_count"],
-                },
-                "ai_indicators": {
-                    "software_detected": agg["software_detected"],
-                    "heuristics": {},
-                    "anomalies": agg["anomalies"],
-                    "evidence_from_metadata": agg["evidence_from_metadata"],
-                },
-                "file_info": {
-                    "name": file.filename or f"document{suffix}",
-                    "size": len(content),
-                    "size_formatted": f"{len(content) / (1024*1024):.2f} MB" if len(content) >= 1024 * 1024 else f"{len(content) / 1024:.2f} KB",
-                },
-            }
-            report_data["generated_at"] = __import__("datetime").datetime.now().isoformat()
-            report_gen = ReportGenerator()
-            report_path = report_gen.generate_pdf_report(report_data, temp_file)
-
-        report_filename = os.path.basename(report_path)
-        if not os.path.exists(report_path):
-            logger.error("PDF отчёт не создан: %s", report_path)
-            raise HTTPException(status_code=500, detail="Не удалось создать PDF-отчёт")
-
-        return AnalysisResponse(
-            file_type="document",
-            summary=summary,
-            metadata=report_data["metadata"],
-            ai_indicators=AIMetadata(
-                software_detected=report_data["ai_indicators"]["software_detected"],
-                heuristics=report_data["ai_indicators"].get("heuristics", {}),
-                anomalies=report_data["ai_indicators"].get("anomalies", []),
-                evidence_from_metadata=report_data["ai_indicators"].get("evidence_from_metadata") or [],
-            ),
-            report_url=f"/api/reports/{report_filename}",
+        # Загрузка не больше одной части передается байтами, большая уже лежит во временном
+        # файле на диске и отображается анализатором в память;
+        # в пул процессов файловый объект не передать — туда уходит путь к копии загрузки
+        source: DocumentSource = file.file
+        if file_size <= UPLOAD_CHUNK_SIZE:
+            source = await file.read()
+        elif analysis_executor.kind == "process":
+            spool_path = source = await _spool_to_path(file, suffix)
+        # Анализ выполняется в ограниченном пуле, event loop остаётся свободным
+        report_data, report_filename = await analysis_executor.run(
+            _analyze_and_render, source, file.filename or f"document{suffix}", file_size, None, pixel_analysis, digest
         )
+        schedule_render(report_filename)
+
+        result = _build_response(report_data, report_filename)
+        document_result_cache.put(cache_key, result.model_dump(), report_filename)
+        response.headers["X-Cache"] = "MISS"
+        return result
+    except HTTPException:
+        raise
+    except ExecutorBusyError as e:
+        logger.warning("Анализ отклонён: %s (в работе и в очереди: %d)", e, analysis_executor.accepted)
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(BUSY_RETRY_AFTER)})
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error("Ошибка анализа документа: %s", e, exc_info=True)
         raise HTTPException(status_code=500, detail=f"Ошибка анализа документа: {str(e)}")
     finally:
-        if temp_file and os.path.exists(temp_file):
-            os.unlink(temp_file)
+        if spool_path is not None:
+            _remove_spool(spool_path)
+
+
+def _run_document_job(
+    job: Optional[Job],
+    source: DocumentSource,
+    file_name: str,
+    file_size: int,
+    pixel_analysis: Optional[bool],
+    digest: str,
+) -> Tuple[Dict[str, Any], str]:
+    """Фоновая задача в пуле анализа: анализ документа и данные отчёта"""
+    if not isinstance(source, str) and file_size <= JOB_SPOOL_MAX_MEMORY:
+        # Копия загрузки еще в памяти: анализатор получает байты, а не файл без дескриптора
+        source.seek(0)
+        source = source.read()
+    return _analyze_and_render(source, file_name, file_size, job, pixel_analysis, digest)
+
+
+def _finish_document_job(cache_key: str, analyzed: Tuple[Dict[str, Any], str]) -> Tuple[Dict[str, Any], str]:
+    """Завершение фоновой задачи в процессе API: рендеринг PDF и запись в кэш документов"""
+    report_data, report_filename = analyzed
+    schedule_render(report_filename)
+    result = _build_response(report_data, report_filename).model_dump()
+    document_result_cache.put(cache_key, result, report_filename)
+    return result, report_filename
+
+
+def _job_status(job: Job) -> JobStatus:
+    def iso(timestamp: Optional[float]) -> Optional[str]:
+        return datetime.fromtimestamp(timestamp).isoformat() if timestamp is not None else None
+
+    base_url = f"/api/jobs/{job.id}"
+    return JobStatus(
+        job_id=job.id,
+        status=job.status,
+        file_name=job.file_name,
+        progress=JobProgress(stage=job.stage, images_done=job.images_done, images_total=job.images_total),
+        created_at=iso(job.created_at),
+        started_at=iso(job.started_at),
+        finished_at=iso(job.finished_at),
+        error=job.error,
+        status_url=base_url,
+        result_url=f"{base_url}/result" if job.status == JOB_DONE else None,
+        report_url=f"/api/reports/{job.report_filename}" if job.report_filename else None,
+    )
+
+
+def _get_job(job_id: str) -> Job:
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    return job
+
+
+def _finished_job(job_id: str) -> Job:
+    job = _get_job(job_id)
+    if job.status == JOB_FAILED:
+        raise HTTPException(status_code=job.error_status, detail=job.error)
+    if job.status != JOB_DONE:
+        raise HTTPException(status_code=409, detail="Задача ещё выполняется")
+    return job
+
+
+async def _start_job(
+    file: UploadFile,
+    listener: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+    pixel_analysis: Optional[bool] = None,
+) -> Job:
+    """
+    Проверка загрузки и постановка фоновой задачи анализа.
+    Документ из кэша документов дает сразу завершенную задачу.
+    """
+    fn = (file.filename or "").lower()
+    if not (fn.endswith(".docx") or fn.endswith(".pptx")):
+        raise HTTPException(status_code=400, detail="Поддерживаются только форматы DOCX и PPTX")
+    file_name = file.filename or ("document.pptx" if fn.endswith(".pptx") else "document.docx")
+
+    # UploadFile закрывается после ответа, поэтому задача получает собственную копию загрузки;
+    # в пул процессов файловый объект не передать — копия пишется в именованный файл
+    to_path = job_manager.executor.kind == "process"
+    if to_path:
+        spool = tempfile.NamedTemporaryFile(suffix=os.path.splitext(fn)[1], delete=False)
+    else:
+        spool = tempfile.SpooledTemporaryFile(max_size=JOB_SPOOL_MAX_MEMORY)
+    try:
+        digest, file_size = await _ingest_upload(file, copy_to=spool)
+    except BaseException:
+        spool.close()
+        if to_path:
+            _remove_spool(spool.name)
+        raise
+
+    source: DocumentSource = spool
+    release: Callable[[], None] = spool.close
+    if to_path:
+        spool.close()
+        source = spool.name
+        release = functools.partial(_remove_spool, spool.name)
+
+    job = job_manager.create(file_name)
+    if listener is not None:
+        job.subscribe(listener)
+    cache_key = _document_cache_key(digest, pixel_analysis)
+    cached = _cached_document(cache_key)
+    if cached is not None:
+        release()
+        job_manager.complete(job, *cached)
+        return job
+    try:
+        job_manager.submit(
+            job, _run_document_job, source, file_name, file_size, pixel_analysis, digest,
+            finalize=functools.partial(_finish_document_job, cache_key),
+            on_finish=release,
+        )
+    except ExecutorBusyError as e:
+        release()
+        logger.warning("Задача отклонена: %s (в работе и в очереди: %d)", e, analysis_executor.accepted)
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(BUSY_RETRY_AFTER)})
+    return job
+
+
+@router.post("/jobs", response_model=JobStatus, status_code=202)
+@router.post("/jobs/", response_model=JobStatus, status_code=202)
+async def create_job(
+    response: Response,
+    file: UploadFile = File(...),
+    pixel_analysis: Optional[bool] = PIXEL_ANALYSIS_QUERY,
+):
+    """
+    Асинхронный анализ документа: задача ставится в очередь, ответ возвращается сразу.
+    Статус и прогресс — GET /api/jobs/{job_id}, результат — GET /api/jobs/{job_id}/result.
+    """
+    job = await _start_job(file, pixel_analysis=pixel_analysis)
+    response.headers["Location"] = f"/api/jobs/{job.id}"
+    return _job_status(job)
+
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+@router.post("/analyze/document/stream")
+async def analyze_document_stream(
+    file: UploadFile = File(...),
+    pixel_analysis: Optional[bool] = PIXEL_ANALYSIS_QUERY,
+):
+    """
+    Потоковый анализ документа (text/event-stream). События по порядку:
+    - job: идентификатор фоновой задачи (результат доступен и через /api/jobs/{job_id});
+    - document: тип и метаданные документа, список встроенных изображений;
+    - image: результат одного изображения (index — позиция в embedded_images), по мере готовности;
+    - result: итог (summary, ai_indicators) и report_url;
+    - error: анализ не удался (status, detail).
+    Отключение клиента не прерывает задачу. В пуле процессов (ANALYSIS_EXECUTOR=process)
+    прогресса нет: события document и image приходят вместе с итогом.
+    """
+    loop = asyncio.get_running_loop()
+    events: "asyncio.Queue[Tuple[str, Dict[str, Any]]]" = asyncio.Queue()
+
+    def listener(event: str, payload: Dict[str, Any]) -> None:
+        loop.call_soon_threadsafe(events.put_nowait, (event, payload))
+
+    job = await _start_job(file, listener, pixel_analysis)
+
+    async def stream() -> AsyncIterator[str]:
+        document_sent = False
+        try:
+            yield _sse("job", {"job_id": job.id, "status_url": f"/api/jobs/{job.id}"})
+            while True:
+                event, payload = await events.get()
+                if event == "document":
+                    document_sent = True
+                    yield _sse(event, payload)
+                elif event == "image":
+                    yield _sse(event, payload)
+                elif event == JOB_DONE:
+                    result = job.result
+                    if not document_sent:
+                        # Ответ из кэша документов: события document/image восстанавливаются из него
+                        metadata = result["metadata"]
+                        yield _sse("document", {
+                            "document_type": metadata.get("document_type"),
+                            "document_metadata": metadata.get("document_metadata"),
+                            "embedded_images": metadata.get("embedded_images", []),
+                            "images_count": metadata.get("images_count", 0),
+                        })
+                        for index, image in enumerate(metadata.get("images", [])):
+                            yield _sse("image", {"index": index, **image})
+                    yield _sse("result", {
+                        "summary": result["summary"],
+                        "ai_indicators": result["ai_indicators"],
+                        "images_count": result["metadata"].get("images_count", 0),
+                        "images_with_ai_count": result["metadata"].get("images_with_ai_count", 0),
+                        "report_url": result["report_url"],
+                        "result_url": f"/api/jobs/{job.id}/result",
+                    })
+                    return
+                elif event == JOB_FAILED:
+                    yield _sse("error", {"status": job.error_status, "detail": job.error})
+                    return
+        finally:
+            job.unsubscribe(listener)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/jobs/{job_id}", response_model=JobStatus)
+async def get_job(job_id: str):
+    """Статус и прогресс задачи"""
+    return _job_status(_get_job(job_id))
+
+
+@router.get("/jobs/{job_id}/result", response_model=AnalysisResponse)
+async def get_job_result(job_id: str):
+    """Результат завершённой задачи (409, пока задача выполняется)"""
+    return AnalysisResponse(**_finished_job(job_id).result)
+
+
+@router.get("/jobs/{job_id}/report")
+async def get_job_report(job_id: str):
+    """PDF-отчёт завершённой задачи"""
+    return await get_report(_finished_job(job_id).report_filename)
 
 
 @router.get("/reports/{report_filename}")
 async def get_report(report_filename: str):
-    """Получение PDF отчета"""
-    report_path = os.path.join(REPORTS_DIR, report_filename)
-    
-    if not os.path.exists(report_path):
-        logger.warning("Отчёт не найден: %s (каталог: %s)", report_path, REPORTS_DIR)
+    """
+    Получение PDF отчета. PDF рендерится по сохранённым данным при первом запросе
+    (в пуле рендеринга report_executor), повторные запросы отдаются с диска.
+    """
+    report_path = None
+    if report_exists(report_filename):
+        try:
+            report_path = await render_report_async(report_filename)
+        except ExecutorBusyError as e:
+            logger.warning("Рендеринг отчёта отклонён: %s", e)
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(BUSY_RETRY_AFTER)})
+        except ExecutorTimeoutError as e:
+            raise HTTPException(status_code=504, detail=f"Не удалось построить PDF-отчёт: {e}")
+        except Exception as e:
+            # Пул рендеринга остановлен (зависший отчет, упавший процесс) или рендеринг не удался:
+            # данные отчета сохранены, повторный запрос отрисует его заново
+            logger.error("Ошибка рендеринга отчёта %s: %s", report_filename, e, exc_info=True)
+            raise HTTPException(
+                status_code=503,
+                detail="Не удалось построить PDF-отчёт, повторите запрос позже",
+                headers={"Retry-After": str(BUSY_RETRY_AFTER)},
+            )
+
+    if report_path is None:
+        logger.warning("Отчёт не найден: %s", report_filename)
         raise HTTPException(status_code=404, detail="Отчет не найден")
     
     return FileResponse(
@@ -0,0 +1,48 @@
+"""
+Ограничение размера тела запроса на уровне ASGI.
+
+Проверка идёт до разбора multipart: запрос с заголовком Content-Length больше
+лимита отклоняется сразу, без чтения тела, а при потоковой передаче (chunked)
+чтение прерывается, как только получено больше лимита.
+"""
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+
+class UploadSizeLimitMiddleware:
+    """Ответ 413 для запросов, тело которых больше max_body_size байт."""
+
+    def __init__(self, app, max_body_size: int, detail: str = "Файл слишком большой"):
+        self.app = app
+        self.max_body_size = max_body_size
+        self.detail = detail
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None:
+            try:
+                declared = int(content_length)
+            except ValueError:
+                declared = 0
+            if declared > self.max_body_size:
+                response = JSONResponse({"detail": self.detail}, status_code=413, headers={"Connection": "close"})
+                await response(scope, receive, send)
+                return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_size:
+                    # Исключение поднимается внутри разбора тела и превращается в ответ 413
+                    raise HTTPException(status_code=413, detail=self.detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
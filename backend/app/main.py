@@ -1,7 +1,12 @@
 from fastapi import FastAPI, APIRouter
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import Response
-from app.api.routes import router
+from app.api.routes import router, MAX_FILE_SIZE, MAX_FILE_SIZE_DETAIL
+from app.api.upload_limit import UploadSizeLimitMiddleware
+from app.services.image_analyzer import ImageAnalyzer
+from app.services.task_executor import analysis_executor
+from app.services.report_generator import report_executor
+from app.services.report_store import get_report_store
 import logging
 
 logger = logging.getLogger(__name__)
@@ -10,19 +15,30 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 
+# Запас на границы и заголовки частей multipart сверх MAX_FILE_SIZE
+MULTIPART_OVERHEAD = 64 * 1024
+
 app = FastAPI(
     title="Анализ метаданных офисных документов",
     description="Проверка метаданных DOCX/PPTX: автор, даты, встроенные изображения и их метаданные",
     version="1.0.0"
 )
 
-# CORS настройки для frontend
+# Слишком большие загрузки отклоняются до разбора multipart (запас — на заголовки частей формы)
+app.add_middleware(
+    UploadSizeLimitMiddleware,
+    max_body_size=MAX_FILE_SIZE + MULTIPART_OVERHEAD,
+    detail=MAX_FILE_SIZE_DETAIL,
+)
+
+# CORS настройки для frontend (добавляется последним — ответ 413 тоже получает CORS-заголовки)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Cache"],
 )
 
 # Сначала корневые пути (без /api), чтобы GET /routes не давал 404 от расширений браузера
@@ -43,6 +59,11 @@ async def routes_list():
             "GET /api/health",
             "GET /api/routes",
             "POST /api/analyze/document",
+            "POST /api/analyze/document/stream",
+            "POST /api/jobs",
+            "GET /api/jobs/{job_id}",
+            "GET /api/jobs/{job_id}/result",
+            "GET /api/jobs/{job_id}/report",
             "GET /api/reports/{filename}",
         ]
     }
@@ -54,3 +75,17 @@ app.include_router(router, prefix="/api")
 @app.on_event("startup")
 async def startup_log():
     logger.info("API готов: GET /routes и GET /api/routes доступны")
+
+
+@app.on_event("startup")
+async def start_report_janitor():
+    # Уборщик работает в каждом процессе uvicorn: индекс в SQLite не дает им удалить лишнее
+    get_report_store().start_janitor()
+
+
+@app.on_event("shutdown")
+async def shutdown_workers():
+    analysis_executor.shutdown()
+    report_executor.shutdown()
+    get_report_store().stop_janitor()
+    ImageAnalyzer.shutdown_exiftool_pool()
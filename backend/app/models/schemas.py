@@ -20,3 +20,21 @@ class AnalysisResponse(BaseModel):
     metadata: Dict[str, Any]
     ai_indicators: AIMetadata
     report_url: str
+
+class JobProgress(BaseModel):
+    stage: str  # "queued", "analyzing", "done"
+    images_done: int = 0
+    images_total: Optional[int] = None
+
+class JobStatus(BaseModel):
+    job_id: str
+    status: str  # "queued", "running", "done", "failed"
+    file_name: Optional[str] = None
+    progress: JobProgress
+    created_at: str
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+    error: Optional[str] = None
+    status_url: str
+    result_url: Optional[str] = None  # Появляется после завершения задачи
+    report_url: Optional[str] = None
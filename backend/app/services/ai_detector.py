@@ -1,62 +1,72 @@
-from typing import Dict, Any, List
-import math
+from typing import Dict, Any, List, Optional
+
+from app.services.ai_keywords import AI_SOFTWARE_KEYWORDS
+from app.services.rule_engine import CompiledRuleset, get_ruleset
+from app.services.pixel_forensics import ImageSource, analyze_pixels
+
+# Признаки изображения, по которым выполняются правила detect (app/rules/ai_heuristics.json)
+IMAGE_FEATURES = (
+    "heuristics_enabled",
+    "has_image_characteristics",
+    "has_exif",
+    "metadata_removed",
+    "contradictions",
+    "is_square",
+    "is_standard_ai_size",
+    "supports_exif",
+    "has_gps",
+    "has_camera_info",
+    "has_shooting_params",
+    "suspicious_features",
+    "iso",
+    "has_datetime",
+    "missing_count",
+    "file_format_label",
+    "is_jpeg",
+    # Пиксельные признаки (metadata["pixel_analysis"]); None, если анализ пикселей не выполнялся
+    "pixel_noise_level",
+    "pixel_noise_variation",
+    "pixel_symmetry",
+    "pixel_blockiness",
+    "pixel_spectral_peaks",
+)
+# Признаки итога детекции, по которым выполняются шаги score
+SCORE_FEATURES = (
+    "has_evidence",
+    "evidence_count",
+    "evidence_ai_source",
+    "has_software",
+    "supports_exif",
+    "anomaly_count",
+)
+
+
+def get_detector_ruleset() -> CompiledRuleset:
+    """Набор правил детектора (AI_RULESET_PATH или встроенный), компилируется один раз на процесс"""
+    return get_ruleset(IMAGE_FEATURES, SCORE_FEATURES)
+
+
+# Версия правил детектора: объявленная версия набора правил + хеш его содержимого,
+# по ней инвалидируются закэшированные результаты
+RULESET_VERSION = get_detector_ruleset().version
 
 class AIDetector:
     """Эвристический детектор признаков ИИ-модификаций"""
     
     def __init__(self):
-        self.ai_software_list = [
-            "stable diffusion",
-            "midjourney",
-            "dall-e",
-            "dalle",
-            "dall·e",
-            "comfyui",
-            "comfy ui",
-            "automatic1111",
-            "automatic 1111",
-            "novelai",
-            "novel ai",
-            "leonardo",
-            "runway",
-            "sora",
-            "pika",
-            "generated",
-            "ai generated",
-            "artificial intelligence",
-            "ai art",
-            "neural network",
-            "deep learning",
-            "gan",
-            "vae",
-            "diffusion",
-            "latent diffusion",
-            "openai",
-            "open ai",
-            "stability ai",
-            "stabilityai",
-            "dreamstudio",
-            "dream studio",
-            "lexica",
-            "nightcafe",
-            "night cafe",
-            "artbreeder",
-            "art breeder",
-            "thispersondoesnotexist",
-            "this person does not exist",
-            "generated by",
-            "created with ai",
-            "ai tool",
-            "machine learning"
-        ]
+        # Тот же словарь, что и у ImageAnalyzer (app.services.ai_keywords)
+        self.ai_software_list = AI_SOFTWARE_KEYWORDS
+        self.ruleset = get_detector_ruleset()
     
-    def detect_ai_signs(self, metadata: Dict[str, Any], file_type: str = "image") -> Dict[str, Any]:
+    def detect_ai_signs(self, metadata: Dict[str, Any], file_type: str = "image", score: bool = True) -> Dict[str, Any]:
         """
         Обнаружение признаков ИИ-вмешательства
         
         Args:
             metadata: Метаданные файла
             file_type: Тип файла ("image" или "video")
+            score: False — без итоговой вероятности и достоверности; для многих
+                изображений их считает score_ai_signs одним проходом
             
         Returns:
             Словарь с обнаруженными признаками и вероятностью
@@ -74,6 +84,9 @@ class AIDetector:
         elif file_type == "video":
             result = self._detect_video_ai_signs(metadata)
         
+        if not score:
+            return result
+
         # Сохраняем ссылку на metadata для использования в calculate_ai_probability
         result["_metadata_ref"] = metadata
         
@@ -85,6 +98,18 @@ class AIDetector:
         result.pop("_metadata_ref", None)
         
         return result
+
+    def score_ai_signs(self, results: List[Dict[str, Any]], metadata_list: List[Dict[str, Any]]) -> None:
+        """
+        Итоговая вероятность и достоверность для результатов detect_ai_signs(score=False)
+        многих изображений: шаги score выполняются один раз по столбцам признаков.
+        """
+        for result, metadata in zip(results, metadata_list):
+            result["_metadata_ref"] = metadata
+        for result, metadata, probability in zip(results, metadata_list, self.calculate_ai_probabilities(results)):
+            result["ai_probability"] = probability
+            result["confidence"] = self.generate_confidence_score(result, metadata)
+            result.pop("_metadata_ref", None)
     
     def _build_c2pa_evidence(self, metadata: Dict[str, Any]) -> List[str]:
         """
@@ -225,81 +250,10 @@ class AIDetector:
             if s not in result["software_detected"]:
                 result["software_detected"].append(s)
         
-        heuristics = {}
-        
         # 2. Эвристики — только если нет сильных C2PA-фактов (чтобы не дублировать и не завышать по эвристике)
-        integrity = metadata.get("metadata_integrity", {})
-        image_chars = metadata.get("image_characteristics", {}) or {}
-        supports_exif = image_chars.get("supports_exif", True)
-        
-        if not has_c2pa or not result["evidence_from_metadata"]:
-            if integrity.get("metadata_removed"):
-                heuristics["missing_metadata"] = True
-                result["anomalies"].append("Метаданные удалены или отсутствуют")
-            contradictions = integrity.get("contradictions", [])
-            if contradictions:
-                heuristics["metadata_contradictions"] = True
-                result["anomalies"].extend(contradictions)
-        
-        if image_chars and (not has_c2pa or not result["evidence_from_metadata"]):
-            if image_chars.get("is_square"):
-                heuristics["square_image"] = True
-                result["anomalies"].append("Квадратное изображение (типично для ИИ-генераторов)")
-            if image_chars.get("is_standard_ai_size"):
-                heuristics["standard_ai_size"] = True
-                result["anomalies"].append("Стандартный размер для ИИ-генератора")
-            if supports_exif:
-                if not image_chars.get("has_gps"):
-                    heuristics["no_gps"] = True
-                if not image_chars.get("has_camera_info"):
-                    heuristics["no_camera_info"] = True
-                if not image_chars.get("has_shooting_params"):
-                    heuristics["no_shooting_params"] = True
-            for feature in image_chars.get("suspicious_features", []):
-                if not any(feature.lower() in a.lower() or a.lower() in feature.lower() for a in result["anomalies"]):
-                    result["anomalies"].append(feature)
-        
-        if exif and (not has_c2pa or not result["evidence_from_metadata"]):
-            if "iso" in exif:
-                try:
-                    iso = int(str(exif["iso"]))
-                    if iso < 50:
-                        heuristics["unusual_iso"] = True
-                        result["anomalies"].append(f"Необычно низкий ISO: {iso}")
-                except (ValueError, TypeError):
-                    pass
-            if supports_exif and "date_time" not in exif:
-                heuristics["no_datetime"] = True
-                result["anomalies"].append("Отсутствует дата и время съемки")
-        
-        if image_chars and (not has_c2pa or not result["evidence_from_metadata"]):
-            if not supports_exif:
-                if image_chars.get("is_square") and image_chars.get("is_standard_ai_size"):
-                    heuristics["multiple_ai_indicators"] = True
-                    result["anomalies"].append("PNG с признаками ИИ-генерации (квадратное, стандартный размер)")
-            else:
-                missing_count = sum([
-                    not image_chars.get("has_gps"),
-                    not image_chars.get("has_camera_info"),
-                    not image_chars.get("has_shooting_params")
-                ])
-                if missing_count >= 2:
-                    fmt = (image_chars.get("file_format") or "изображения").upper()
-                    if image_chars.get("is_square"):
-                        heuristics["multiple_ai_indicators"] = True
-                        result["anomalies"].append(f"Множественные признаки ИИ: квадратное {fmt} без метаданных")
-                    elif missing_count == 3:
-                        heuristics["multiple_ai_indicators"] = True
-                        result["anomalies"].append("Полное отсутствие EXIF (GPS, камера, параметры съемки)" + (" — подозрительно для JPEG" if fmt in ("JPEG", "JPG") else ""))
-        
-        existing_lower = [a.lower() for a in result["anomalies"]]
-        if supports_exif and (not has_c2pa or not result["evidence_from_metadata"]):
-            if heuristics.get("no_gps") and not any("gps" in a or "координат" in a for a in existing_lower):
-                result["anomalies"].append("Отсутствуют GPS координаты")
-            if heuristics.get("no_camera_info") and not any("камера" in a for a in existing_lower):
-                result["anomalies"].append("Отсутствует информация о камере")
-            if heuristics.get("no_shooting_params") and not any("параметр" in a or "выдержка" in a for a in existing_lower):
-                result["anomalies"].append("Отсутствуют параметры съемки (ISO, выдержка и т.д.)")
+        features = self._image_features(metadata, has_c2pa, bool(result["evidence_from_metadata"]))
+        heuristics, anomalies = self.ruleset.detect(features)
+        result["anomalies"].extend(anomalies)
         
         seen = set()
         unique_anomalies = []
@@ -356,104 +310,78 @@ class AIDetector:
         Расчёт вероятности ИИ-вмешательства (0–100%).
         Приоритет: факты из C2PA/метаданных → эвристики.
         """
+        return self.ruleset.score(self._score_features(indicators))
+    
+    def calculate_ai_probabilities(self, indicators_list: List[Dict[str, Any]]) -> List[int]:
+        """Пакетный расчёт вероятности для многих изображений (одна проверка условия на весь столбец)"""
+        return self.ruleset.score_many([self._score_features(indicators) for indicators in indicators_list])
+    
+    @staticmethod
+    def _image_features(metadata: Dict[str, Any], has_c2pa: bool, has_evidence: bool) -> Dict[str, Any]:
+        """Нормализованный вектор признаков изображения для правил detect"""
+        exif = metadata.get("exif", {}) or {}
+        integrity = metadata.get("metadata_integrity", {})
+        image_chars = metadata.get("image_characteristics", {}) or {}
+        iso: Optional[int] = None
+        if "iso" in exif:
+            try:
+                iso = int(str(exif["iso"]))
+            except (ValueError, TypeError):
+                pass
+        file_format_label = (image_chars.get("file_format") or "изображения").upper()
+        pixels = metadata.get("pixel_analysis") or {}
+        return {
+            "heuristics_enabled": not has_c2pa or not has_evidence,
+            "has_image_characteristics": bool(image_chars),
+            "has_exif": bool(exif),
+            "metadata_removed": bool(integrity.get("metadata_removed")),
+            "contradictions": integrity.get("contradictions", []),
+            "is_square": bool(image_chars.get("is_square")),
+            "is_standard_ai_size": bool(image_chars.get("is_standard_ai_size")),
+            "supports_exif": image_chars.get("supports_exif", True),
+            "has_gps": bool(image_chars.get("has_gps")),
+            "has_camera_info": bool(image_chars.get("has_camera_info")),
+            "has_shooting_params": bool(image_chars.get("has_shooting_params")),
+            "suspicious_features": image_chars.get("suspicious_features", []),
+            "iso": iso,
+            "has_datetime": "date_time" in exif,
+            "missing_count": sum([
+                not image_chars.get("has_gps"),
+                not image_chars.get("has_camera_info"),
+                not image_chars.get("has_shooting_params")
+            ]),
+            "file_format_label": file_format_label,
+            "is_jpeg": file_format_label in ("JPEG", "JPG"),
+            "pixel_noise_level": pixels.get("noise_level"),
+            "pixel_noise_variation": pixels.get("noise_variation"),
+            "pixel_symmetry": pixels.get("symmetry_score"),
+            "pixel_blockiness": pixels.get("jpeg_blockiness"),
+            "pixel_spectral_peaks": pixels.get("spectral_peaks"),
+        }
+    
+    @staticmethod
+    def _score_features(indicators: Dict[str, Any]) -> Dict[str, Any]:
+        """Признаки итога детекции (факты C2PA, найденный софт, эвристики) для шагов score"""
         evidence = indicators.get("evidence_from_metadata", [])
         software_detected = indicators.get("software_detected", [])
-        
-        # Факты из C2PA/Content Credentials — основа вывода, без интерпретаций
-        if evidence:
-            c2pa_software = any("C2PA" in str(s) for s in software_detected)
-            if c2pa_software or any("алгоритм" in e.lower() or "algorithmic" in e.lower() or "agent" in e.lower() for e in evidence):
-                return min(100, 95 + (5 if len(evidence) >= 3 else 0))  # 95–100%
-            return 90  # C2PA есть, но без явного указания ИИ — всё равно высоко
-        
-        # Эвристики — когда нет C2PA-фактов
-        probability = 0
-        if software_detected:
-            probability += 70
         metadata_ref = indicators.get("_metadata_ref", {})
-        image_chars = metadata_ref.get("image_characteristics", {})
-        supports_exif = image_chars.get("supports_exif", True)
-        heuristics = indicators.get("heuristics", {})
-        
-        # Проверяем, есть ли сильные признаки помимо отсутствия метаданных
-        has_strong_indicators = (
-            heuristics.get("square_image") or 
-            heuristics.get("standard_ai_size") or
-            heuristics.get("metadata_contradictions")
-        )
-        
-        # Если multiple_ai_indicators основан только на отсутствии метаданных (без других признаков),
-        # снижаем его вес и не суммируем отдельные "отсутствие X"
-        multiple_from_missing_only = (
-            heuristics.get("multiple_ai_indicators") and 
-            not has_strong_indicators
-        )
-        
-        heuristic_weights = {
-            # Сильные индикаторы (высокий вес)
-            "standard_ai_size": 25,
-            "square_image": 20,
-            "metadata_contradictions": 25,
-            
-            # multiple_ai_indicators: высокий вес только если есть другие признаки
-            "multiple_ai_indicators": 30 if has_strong_indicators else 20,
-            
-            # Отсутствие метаданных: средний вес, но не суммируем если уже учтено в multiple_ai_indicators
-            "missing_metadata": 15 if supports_exif and not multiple_from_missing_only else 0,
-            
-            # Отдельные "отсутствие X": не суммируем если уже учтено в multiple_ai_indicators
-            "no_gps": 10 if supports_exif and not multiple_from_missing_only else 0,
-            "no_camera_info": 10 if supports_exif and not multiple_from_missing_only else 0,
-            "no_shooting_params": 10 if supports_exif and not multiple_from_missing_only else 0,
-            "no_datetime": 8 if supports_exif else 0,
-            
-            # Другие индикаторы
-            "unusual_iso": 10,
-            "encoding_anomalies": 15,
-            "frame_rate_inconsistency": 10,
-            "gop_anomalies": 10,
+        image_chars = metadata_ref.get("image_characteristics", {}) or {}
+        features = {
+            name: bool(value) for name, value in indicators.get("heuristics", {}).items()
         }
-        
-        for h, w in heuristic_weights.items():
-            if heuristics.get(h) and w > 0:
-                probability += w
-        
-        # Аномалии добавляют вероятность, но с ограничением для случая "только отсутствие метаданных"
-        anomaly_count = len(indicators.get("anomalies", []))
-        if multiple_from_missing_only:
-            # Если только отсутствие метаданных, ограничиваем бонус от аномалий
-            if anomaly_count >= 3:
-                probability += 10
-            elif anomaly_count >= 2:
-                probability += 5
-        else:
-            # Обычный бонус от аномалий
-            if anomaly_count >= 5:
-                probability += 25
-            elif anomaly_count >= 3:
-                probability += 15
-            elif anomaly_count >= 2:
-                probability += 8
-            elif anomaly_count >= 1:
-                probability += 3
-        
-        # Бонус за комбинацию сильных признаков
-        if supports_exif and heuristics.get("square_image") and heuristics.get("no_gps") and heuristics.get("no_camera_info"):
-            probability += 10
-        
-        # Минимальная вероятность для изображений без метаданных (только для JPEG)
-        if supports_exif and heuristics.get("missing_metadata") and anomaly_count >= 2 and not has_strong_indicators:
-            probability = max(probability, 25)  # Снижено с 30 до 25
-        
-        # Ограничение: если только отсутствие метаданных без других признаков, максимум 50%
-        if multiple_from_missing_only and not has_strong_indicators and not software_detected:
-            probability = min(probability, 50)
-        
-        # Без явных доказательств (C2PA, софт в метаданных) — только эвристики: не выше 45%
-        if not evidence and not software_detected:
-            probability = min(probability, 45)
-        
-        return min(probability, 100)
+        features.update({
+            "has_evidence": bool(evidence),
+            "evidence_count": len(evidence),
+            # Явное указание на ИИ в фактах C2PA: софт-агент или алгоритмический источник
+            "evidence_ai_source": bool(evidence) and (
+                any("C2PA" in str(s) for s in software_detected)
+                or any("алгоритм" in e.lower() or "algorithmic" in e.lower() or "agent" in e.lower() for e in evidence)
+            ),
+            "has_software": bool(software_detected),
+            "supports_exif": image_chars.get("supports_exif", True),
+            "anomaly_count": len(indicators.get("anomalies", [])),
+        })
+        return features
     
     def generate_confidence_score(
         self,
@@ -477,25 +405,17 @@ class AIDetector:
     
     def analyze_image_characteristics(
         self, 
-        image_path: str, 
-        metadata: Dict[str, Any]
+        image: ImageSource, 
+        metadata: Optional[Dict[str, Any]] = None
     ) -> Dict[str, Any]:
         """
-        Анализ характеристик изображения (качество, шум, симметрия)
-        
-        Примечание: Это требует дополнительных библиотек для анализа изображений
-        (например, OpenCV, scikit-image). Пока возвращаем базовую структуру.
-        """
-        characteristics = {
-            "quality_score": None,
-            "noise_level": None,
-            "symmetry_score": None,
-            "suspicious_patterns": []
-        }
+        Анализ пикселей изображения (шум, симметрия, блочность JPEG, пики спектра).
         
-        # TODO: Реализовать анализ изображения с помощью OpenCV/scikit-image
-        # - Анализ шума (AI-изображения часто имеют характерный шум)
-        # - Проверка симметрии (AI часто создает слишком симметричные изображения)
-        # - Анализ артефактов генерации
+        Результат кладется в metadata["pixel_analysis"] и используется правилами
+        detect (признаки pixel_*). Без NumPy возвращает {"skipped": "numpy_unavailable"}.
         
-        return characteristics
+        Args:
+            image: путь к файлу или содержимое изображения
+            metadata: метаданные изображения (не используются, для совместимости)
+        """
+        return analyze_pixels(image)
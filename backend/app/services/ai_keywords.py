@@ -0,0 +1,130 @@
+"""
+Общий словарь упоминаний ИИ-инструментов и скомпилированный поиск по нему.
+
+Все ключевые слова объединены в одно регулярное выражение, построенное по
+префиксному дереву (общие начала слов проверяются один раз), — текст
+просматривается за один проход вместо проверки каждого слова через `in`.
+Совпадение засчитывается только по границам слов: "gan" не находится в
+"organization", "sora" — в "sorange".
+"""
+import re
+from functools import lru_cache
+from typing import Dict, Iterable, List, Tuple
+
+AI_SOFTWARE_KEYWORDS: Tuple[str, ...] = (
+    "stable diffusion",
+    "midjourney",
+    "dall-e",
+    "dalle",
+    "dall·e",
+    "comfyui",
+    "comfy ui",
+    "automatic1111",
+    "automatic 1111",
+    "novelai",
+    "novel ai",
+    "leonardo",
+    "runway",
+    "sora",
+    "pika",
+    "generated",
+    "ai generated",
+    "artificial intelligence",
+    "ai art",
+    "neural network",
+    "deep learning",
+    "gan",
+    "vae",
+    "diffusion",
+    "latent diffusion",
+    "openai",
+    "open ai",
+    "stability ai",
+    "stabilityai",
+    "dreamstudio",
+    "dream studio",
+    "lexica",
+    "nightcafe",
+    "night cafe",
+    "artbreeder",
+    "art breeder",
+    "thispersondoesnotexist",
+    "this person does not exist",
+    "generated by",
+    "created with ai",
+    "ai tool",
+    "machine learning",
+)
+
+
+def _trie_pattern(words: Iterable[str]) -> str:
+    """Регулярное выражение-альтернатива для набора слов, сгруппированное по общим префиксам"""
+    trie: Dict[str, dict] = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node: Dict[str, dict]) -> str:
+        # Более длинные продолжения идут первыми: "generated by" проверяется раньше "generated"
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        group = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if "" in node:
+            return "(?:" + group + ")?"
+        return group
+
+    return build(trie)
+
+
+class KeywordMatcher:
+    """Поиск всех ключевых слов из словаря в тексте по границам слов."""
+
+    def __init__(self, keywords: Iterable[str]):
+        self.keywords = tuple(dict.fromkeys(keyword.lower() for keyword in keywords))
+        first_chars = "".join(sorted({keyword[0] for keyword in self.keywords}))
+        # Просмотр вперед: находятся и пересекающиеся вхождения ("stable diffusion" и "diffusion");
+        # класс первых символов быстро отсекает позиции, с которых не начинается ни одно слово
+        self._pattern = re.compile(
+            r"(?<!\w)(?=[" + re.escape(first_chars) + r"])(?=(" + _trie_pattern(self.keywords) + r")(?!\w))"
+        )
+        # Слова, которые являются началом другого слова до границы ("generated" в "generated by"):
+        # с одной позиции регулярное выражение возвращает только самое длинное совпадение
+        self._implied: Dict[str, List[str]] = {
+            keyword: [
+                other for other in self.keywords
+                if other != keyword and keyword.startswith(other) and not keyword[len(other)].isalnum()
+            ]
+            for keyword in self.keywords
+        }
+
+    def find(self, text: str) -> List[str]:
+        """Найденные ключевые слова (в нижнем регистре) в порядке первого вхождения, без повторов"""
+        found: Dict[str, None] = {}
+        for match in self._pattern.finditer(text.lower()):
+            keyword = match.group(1)
+            found.setdefault(keyword, None)
+            for implied in self._implied.get(keyword, ()):
+                found.setdefault(implied, None)
+        return list(found)
+
+    def scan(self, fields: Iterable[Tuple[str, str]]) -> List[Dict[str, str]]:
+        """
+        Поиск по набору полей.
+
+        Returns:
+            Список совпадений {"keyword": слово, "field": имя поля}
+        """
+        return [
+            {"keyword": keyword, "field": field}
+            for field, text in fields
+            for keyword in self.find(text)
+        ]
+
+
+@lru_cache(maxsize=None)
+def get_ai_keyword_matcher() -> KeywordMatcher:
+    """Общий для процесса поиск по AI_SOFTWARE_KEYWORDS (компилируется один раз)"""
+    return KeywordMatcher(AI_SOFTWARE_KEYWORDS)
@@ -0,0 +1,354 @@
+"""
+Потоковое чтение очень больших PNG и TIFF горизонтальными полосами.
+
+Полоса — несколько строк во всю ширину изображения; размер полосы в
+декодированном виде ограничен PIXEL_STREAM_BAND_MB, так что пиковая память
+не зависит от размеров изображения (20000×20000 читается так же, как 2000×2000).
+
+- PNG (без чересстрочности, 8 бит на канал): IDAT распаковывается
+  потоково (zlib), строки полосы вместе с предыдущей, уже восстановленной
+  строкой (фильтр None) декодируются штатным декодером PIL — фильтры
+  Up/Average/Paeth ссылаются на предыдущую строку.
+- TIFF (полосы или тайлы, любое сжатие, которое понимает PIL): для каждой
+  полосы собирается маленький TIFF из нужных strip/tile исходного файла и
+  тегов декодирования; несжатые strip делятся на части по строкам.
+
+Остальные форматы и варианты (чересстрочный PNG, 16 бит, TIFF с раздельными
+плоскостями, сжатый strip больше предела) потоково не читаются —
+open_band_reader возвращает None.
+"""
+import io
+import os
+import struct
+import zlib
+from typing import IO, Iterator, List, Optional, Tuple, Union
+
+from PIL import Image, TiffImagePlugin
+
+# Предел одной полосы в декодированном виде (пиковая память — несколько таких полос)
+PIXEL_STREAM_BAND_BYTES = max(1, int(os.environ.get("PIXEL_STREAM_BAND_MB", "8"))) * 1024 * 1024
+
+# Тип цвета IHDR -> (режим PIL, байт на пиксель) для глубины 8 бит
+_PNG_COLOR_TYPES = {0: ("L", 1), 2: ("RGB", 3), 3: ("P", 1), 4: ("LA", 2), 6: ("RGBA", 4)}
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+_PNG_READ_SIZE = 1024 * 1024
+
+# Теги, без которых strip/tile не декодировать; остальные (EXIF, XMP, ICC) в полосу не копируются
+_TIFF_DECODING_TAGS = (
+    258,  # BitsPerSample
+    259,  # Compression
+    262,  # PhotometricInterpretation
+    266,  # FillOrder
+    277,  # SamplesPerPixel
+    284,  # PlanarConfiguration
+    317,  # Predictor
+    320,  # ColorMap
+    338,  # ExtraSamples
+    339,  # SampleFormat
+    347,  # JPEGTables
+    529,  # YCbCrCoefficients
+    530,  # YCbCrSubSampling
+    531,  # YCbCrPositioning
+    532,  # ReferenceBlackWhite
+)
+_TIFF_LONG = 4
+
+ImageSource = Union[str, bytes, bytearray, memoryview]
+# Часть исходного файла, которая декодируется как одно целое: (первая строка, строк, смещения, длины)
+_Segment = Tuple[int, int, Tuple[int, ...], Tuple[int, ...]]
+
+
+class _BufferReader(io.RawIOBase):
+    """
+    Файл только для чтения поверх буфера в памяти. В отличие от io.BytesIO,
+    буфер (bytearray, memoryview члена архива) не копируется: копируется
+    только прочитанное.
+    """
+
+    def __init__(self, buffer: Union[bytes, bytearray, memoryview]):
+        self._view = memoryview(buffer).cast("B")
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def read(self, size: Optional[int] = -1) -> bytes:
+        end = len(self._view) if size is None or size < 0 else self._pos + size
+        data = bytes(self._view[self._pos:end])
+        self._pos += len(data)
+        return data
+
+    def readinto(self, buffer) -> int:
+        data = self._view[self._pos:self._pos + len(buffer)]
+        memoryview(buffer).cast("B")[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        if whence == os.SEEK_CUR:
+            offset += self._pos
+        elif whence == os.SEEK_END:
+            offset += len(self._view)
+        if offset < 0:
+            raise ValueError(f"отрицательная позиция {offset}")
+        self._pos = offset
+        return offset
+
+    def tell(self) -> int:
+        return self._pos
+
+    def close(self) -> None:
+        if not self.closed:
+            self._view.release()
+        super().close()
+
+
+class BandReader:
+    """Полосы изображения сверху вниз: (номер первой строки, Image полосы во всю ширину)."""
+
+    format = ""
+
+    def __init__(self, fp: IO[bytes], size: Tuple[int, int], max_band_bytes: int):
+        self.fp = fp
+        self.size = size
+        self.max_band_bytes = max_band_bytes
+
+    @property
+    def width(self) -> int:
+        return self.size[0]
+
+    @property
+    def height(self) -> int:
+        return self.size[1]
+
+    def bands(self) -> Iterator[Tuple[int, Image.Image]]:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        self.fp.close()
+
+    def __enter__(self) -> "BandReader":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class PngBandReader(BandReader):
+    format = "PNG"
+
+    def __init__(self, fp: IO[bytes], max_band_bytes: int):
+        fp.seek(len(_PNG_SIGNATURE))
+        length, chunk_type = struct.unpack(">I4s", fp.read(8))
+        if chunk_type != b"IHDR" or length != 13:
+            raise ValueError("PNG без IHDR")
+        width, height, bits, color_type, _, _, interlace = struct.unpack(">IIBBBBB", fp.read(13))
+        if bits != 8 or color_type not in _PNG_COLOR_TYPES or interlace:
+            raise ValueError("вариант PNG не читается полосами")
+        super().__init__(fp, (width, height), max_band_bytes)
+        self.mode, self.bytes_per_pixel = _PNG_COLOR_TYPES[color_type]
+        self.palette: Optional[bytes] = None
+        self._stride = 1 + width * self.bytes_per_pixel
+        self._data_start = fp.tell() + 4
+
+    def _chunks(self) -> Iterator[Tuple[bytes, bytes]]:
+        self.fp.seek(self._data_start)
+        while True:
+            header = self.fp.read(8)
+            if len(header) < 8:
+                raise OSError("PNG обрывается до IEND")
+            length, chunk_type = struct.unpack(">I4s", header)
+            if chunk_type == b"IEND":
+                return
+            if chunk_type in (b"IDAT", b"PLTE"):
+                # IDAT может быть любой длины — читается частями
+                while length:
+                    data = self.fp.read(min(length, _PNG_READ_SIZE))
+                    if not data:
+                        raise OSError("PNG обрывается внутри чанка")
+                    length -= len(data)
+                    yield chunk_type, data
+                self.fp.seek(4, os.SEEK_CUR)
+            else:
+                self.fp.seek(length + 4, os.SEEK_CUR)
+
+    def _decode(self, rows: bytearray, count: int) -> Image.Image:
+        band = Image.frombytes(
+            self.mode, (self.width, count), zlib.compress(rows[: count * self._stride], 0), "zip", self.mode
+        )
+        if self.palette is not None:
+            band.putpalette(self.palette)
+        return band
+
+    def bands(self) -> Iterator[Tuple[int, Image.Image]]:
+        band_rows = max(1, self.max_band_bytes // self._stride)
+        decompressor = zlib.decompressobj()
+        # Строки полосы с фильтрами; со второй полосы первой идет восстановленная предыдущая
+        # строка с фильтром None — опора для фильтров Up/Average/Paeth
+        pending = bytearray()
+        prefix = 0
+        top = 0
+
+        def flush(count: int) -> Tuple[int, Image.Image]:
+            nonlocal pending, prefix, top
+            band = self._decode(pending, prefix + count)
+            last = band.crop((0, band.height - 1, self.width, band.height)).tobytes("raw", self.mode)
+            if prefix:
+                band = band.crop((0, 1, self.width, band.height))
+            result = top, band
+            pending, prefix = bytearray(b"\x00" + last), 1
+            top += count
+            return result
+
+        palette = b""
+        for chunk_type, data in self._chunks():
+            if chunk_type == b"PLTE":
+                palette += data
+                self.palette = palette
+                continue
+            while data and top < self.height:
+                # Распаковка не дальше конца полосы: zlib-бомба не раздувает память
+                count = min(band_rows, self.height - top)
+                pending += decompressor.decompress(data, (prefix + count) * self._stride - len(pending))
+                data = decompressor.unconsumed_tail
+                if len(pending) == (prefix + count) * self._stride:
+                    yield flush(count)
+        count = len(pending) // self._stride - prefix
+        if count > 0 and top < self.height:
+            yield flush(count)
+        if top < self.height:
+            raise OSError(f"PNG обрывается на строке {top} из {self.height}")
+
+
+class TiffBandReader(BandReader):
+    format = "TIFF"
+
+    def __init__(self, fp: IO[bytes], max_band_bytes: int):
+        # Плагин напрямую, а не Image.open: проверка на «бомбу декомпрессии» здесь не нужна,
+        # растр целиком не декодируется
+        self.image = TiffImagePlugin.TiffImageFile(fp)
+        tags = self.image.tag_v2
+        super().__init__(fp, self.image.size, max_band_bytes)
+        if tags.get(284, 1) != 1:
+            raise ValueError("TIFF с раздельными плоскостями не читается полосами")
+        bits = tags.get(258, (1,))
+        bits = max(bits) if isinstance(bits, tuple) else bits
+        samples = tags.get(277, 1)
+        self.row_bytes = self.width * samples * max(1, (bits + 7) // 8)
+        self.packed_row_bytes = (self.width * samples * bits + 7) // 8
+        self.tiled = 324 in tags
+        self.segments = self._segments()
+        if any(rows * self.row_bytes > max_band_bytes for _, rows, _, _ in self.segments):
+            raise ValueError("сжатый фрагмент TIFF больше предела полосы")
+
+    def _segments(self) -> List[_Segment]:
+        tags = self.image.tag_v2
+        if self.tiled:
+            tile_width, tile_length = tags[322], tags[323]
+            across = -(-self.width // tile_width)
+            offsets, counts = tags[324], tags[325]
+            return [
+                (top, min(tile_length, self.height - top),
+                 tuple(offsets[i:i + across]), tuple(counts[i:i + across]))
+                for i, top in zip(range(0, len(offsets), across), range(0, self.height, tile_length))
+            ]
+        rows_per_strip = min(tags.get(278, self.height), self.height)
+        segments: List[_Segment] = []
+        for index, (offset, count) in enumerate(zip(tags[273], tags[279])):
+            top = index * rows_per_strip
+            rows = min(rows_per_strip, self.height - top)
+            if rows <= 0:
+                break
+            if tags.get(259, 1) == 1 and rows * self.row_bytes > self.max_band_bytes:
+                # Несжатый strip делится по строкам
+                step = max(1, self.max_band_bytes // self.row_bytes)
+                for start in range(0, rows, step):
+                    part = min(step, rows - start)
+                    segments.append((top + start, part, (offset + start * self.packed_row_bytes,),
+                                     (part * self.packed_row_bytes,)))
+            else:
+                segments.append((top, rows, (offset,), (count,)))
+        return segments
+
+    def _decode(self, segments: List[_Segment]) -> Image.Image:
+        source = self.image.tag_v2
+        ifd = TiffImagePlugin.ImageFileDirectory_v2(prefix=source.prefix)
+        for tag in _TIFF_DECODING_TAGS:
+            if tag in source:
+                ifd[tag] = source[tag]
+                ifd.tagtype[tag] = source.tagtype[tag]
+        counts = tuple(count for segment in segments for count in segment[3])
+        relative = tuple(sum(counts[:i]) for i in range(len(counts)))
+        rows = sum(segment[1] for segment in segments)
+        for tag, value in ((256, self.width), (257, rows)):
+            ifd[tag] = value
+            ifd.tagtype[tag] = _TIFF_LONG
+        if self.tiled:
+            ifd[322], ifd[323] = source[322], source[323]
+            ifd[324], ifd[325] = relative, counts
+            for tag in (322, 323, 324, 325):
+                ifd.tagtype[tag] = _TIFF_LONG
+            # Данные тайлов — сразу за IFD; смещения тайлов PIL пересчитывать не умеет
+            data_start = 8 + len(ifd.tobytes(8))
+            ifd[324] = tuple(data_start + offset for offset in relative)
+        else:
+            # Смещения strip PIL сам сдвигает за конец IFD
+            ifd[278], ifd[273], ifd[279] = segments[0][1], relative, counts
+            for tag in (273, 278, 279):
+                ifd.tagtype[tag] = _TIFF_LONG
+        parts = [ifd._get_ifh(), ifd.tobytes(8)]
+        for segment in segments:
+            for offset, count in zip(segment[2], segment[3]):
+                self.fp.seek(offset)
+                parts.append(self.fp.read(count))
+        band = Image.open(io.BytesIO(b"".join(parts)))
+        band.load()
+        return band
+
+    def bands(self) -> Iterator[Tuple[int, Image.Image]]:
+        # В полосе все фрагменты одной высоты; короче может быть только последний
+        group: List[_Segment] = []
+        for segment in self.segments:
+            if group and (segment[1] > group[0][1]
+                          or (len(group) + 1) * group[0][1] * self.row_bytes > self.max_band_bytes):
+                yield group[0][0], self._decode(group)
+                group = []
+            group.append(segment)
+            if segment[1] < group[0][1]:
+                yield group[0][0], self._decode(group)
+                group = []
+        if group:
+            yield group[0][0], self._decode(group)
+
+    def close(self) -> None:
+        self.image.close()
+        super().close()
+
+
+def open_band_reader(image: ImageSource, max_band_bytes: int = PIXEL_STREAM_BAND_BYTES) -> Optional[BandReader]:
+    """
+    Потоковое чтение изображения, если формат и его вариант это позволяют.
+
+    Открывается только заголовок; растр не декодируется до вызова bands().
+
+    Returns:
+        BandReader (закрывается вызывающим) или None
+    """
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        fp: IO[bytes] = _BufferReader(image)
+    else:
+        fp = open(image, "rb")
+    try:
+        head = fp.read(8)
+        fp.seek(0)
+        if head == _PNG_SIGNATURE:
+            return PngBandReader(fp, max_band_bytes)
+        if head[:4] in (b"II*\x00", b"MM\x00*"):
+            return TiffBandReader(fp, max_band_bytes)
+    except (OSError, ValueError, KeyError, struct.error):
+        pass
+    fp.close()
+    return None
@@ -5,21 +5,124 @@
 - анализ каждого изображения на признаки ИИ
 """
 import zipfile
+import copy
+import hashlib
+import io
+import mmap
 import os
-import tempfile
 import logging
-import shutil
+import struct
+import threading
+import time
+import zlib
 import xml.etree.ElementTree as ET
-from typing import Dict, Any, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Callable, Dict, Any, Iterable, Iterator, List, Optional, Tuple, Union
 
 from app.services.image_analyzer import ImageAnalyzer
 from app.services.ai_detector import AIDetector
+from app.services.result_cache import ImageResultCache, get_image_result_cache
+from app.services.image_hash_index import ImageHashIndex, get_image_hash_index
+from app.services.perceptual_hash import PERCEPTUAL_HASH_ENABLED
+from app.services.pixel_forensics import PIXEL_ANALYSIS_ENABLED, PIXEL_FORENSICS_AVAILABLE
 
 logger = logging.getLogger(__name__)
 
 # Расширения изображений, которые могут быть в Word
 IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".gif", ".bmp", ".tiff", ".tif", ".emf", ".wmf"}
 
+# Число потоков для анализа изображений одного документа (1 — последовательно)
+IMAGE_ANALYSIS_WORKERS = max(1, int(os.environ.get("IMAGE_ANALYSIS_WORKERS", "1")))
+
+# Число потоков распаковки изображений из архива (1 — последовательно)
+ZIP_EXTRACT_WORKERS = max(1, int(os.environ.get("ZIP_EXTRACT_WORKERS", "4")))
+# Сколько байт может распаковываться одновременно (сумма размеров изображений в работе)
+ZIP_INFLIGHT_BYTES = max(1, int(os.environ.get("ZIP_INFLIGHT_MB", "64"))) * 1024 * 1024
+# Параллельная распаковка включается, только если сжатых данных изображений не меньше этого объема
+ZIP_PARALLEL_MIN_BYTES = 1024 * 1024
+
+# Сжатый член архива распаковывается частями этого размера сразу в буфер результата
+_ZIP_READ_CHUNK = 64 * 1024
+
+# Заголовок локального файла ZIP: сигнатура и длины имени/extra-поля (смещения 26 и 28)
+_ZIP_LOCAL_HEADER_SIZE = 30
+_ZIP_LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+
+# Документ: путь к файлу, содержимое в памяти или открытый двоичный файл (с seek)
+DocumentSource = Union[str, bytes, bytearray, memoryview, BinaryIO]
+# Прогресс анализа изображений: progress(обработано, всего)
+ProgressCallback = Callable[[int, int], None]
+# Готовый результат одного изображения: on_image(индекс в архиве, запись как в "images")
+ImageCallback = Callable[[int, Dict[str, Any]], None]
+# Метаданные документа до анализа изображений: on_document(запись с document_type, document_metadata, embedded_images)
+DocumentCallback = Callable[[Dict[str, Any]], None]
+
+
+class ArchiveMember:
+    """Запись центрального каталога ZIP с уже нормализованным именем."""
+
+    __slots__ = ("info", "path", "norm", "filename", "extension", "size", "compress_size", "crc", "compress_type")
+
+    def __init__(self, info: zipfile.ZipInfo):
+        self.info = info
+        # Путь с прямыми слешами (как в archive_path) и его вариант в нижнем регистре для сравнений
+        self.path = info.filename.replace("\\", "/")
+        self.norm = self.path.lower()
+        self.filename = os.path.basename(info.filename)
+        self.extension = os.path.splitext(self.filename)[1].lower()
+        self.size = info.file_size
+        self.compress_size = info.compress_size
+        self.crc = info.CRC
+        self.compress_type = info.compress_type
+
+
+class ArchiveIndex:
+    """
+    Индекс центрального каталога офисного документа: один проход по infolist(),
+    дальше все этапы (тип документа, docProps, выбор и дедупликация изображений)
+    работают с ним, не перечитывая и не нормализуя имена заново.
+    """
+
+    def __init__(self, zf: zipfile.ZipFile):
+        self.members: List[ArchiveMember] = [ArchiveMember(info) for info in zf.infolist()]
+        self._by_norm: Dict[str, ArchiveMember] = {}
+        for member in self.members:
+            self._by_norm.setdefault(member.norm, member)
+        # Каталоги верхнего уровня ("word", "ppt", "docprops", ...)
+        self.top_dirs = {member.norm.split("/", 1)[0] for member in self.members if "/" in member.norm}
+
+    def get(self, name: str) -> Optional[ArchiveMember]:
+        """Поиск члена архива по имени без учета регистра и вида слешей"""
+        return self._by_norm.get(name.replace("\\", "/").lower())
+
+    def with_prefix(self, prefix: str) -> List[ArchiveMember]:
+        """Члены архива, путь которых начинается с prefix (в нижнем регистре), в порядке каталога"""
+        return [member for member in self.members if member.norm.startswith(prefix)]
+
+
+def _map_source(source: "DocumentSource") -> Optional[memoryview]:
+    """
+    Содержимое документа как memoryview без копирования: mmap файла или буфер в памяти.
+    None — если источник так не отобразить (тогда члены архива читаются через ZipFile).
+    Загрузку, которая еще в памяти, вызывающий код передает байтами: fileno()
+    SpooledTemporaryFile сбросил бы ее на диск.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return memoryview(source)
+    if isinstance(source, io.BytesIO):
+        # getvalue() не копирует буфер и, в отличие от getbuffer(), не мешает закрыть файл
+        return memoryview(source.getvalue())
+    try:
+        if isinstance(source, (str, os.PathLike)):
+            with open(source, "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            mapped = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        return None
+    # mmap закрывается сам, когда освобождены все срезы
+    return memoryview(mapped)
+
 
 class DocumentAnalyzer:
     """Извлечение метаданных и изображений из .docx/.pptx."""
@@ -27,14 +130,39 @@ class DocumentAnalyzer:
     DOCX_MEDIA_PREFIX = "word/media/"
     PPTX_MEDIA_PREFIX = "ppt/media/"
 
-    def __init__(self):
+    def __init__(
+        self,
+        max_workers: Optional[int] = None,
+        cache: Optional[ImageResultCache] = None,
+        use_cache: bool = True,
+        extract_workers: Optional[int] = None,
+        pixel_analysis: Optional[bool] = None,
+        hash_index: Optional[ImageHashIndex] = None,
+        use_hash_index: bool = True,
+    ):
         self.image_analyzer = ImageAnalyzer()
         self.ai_detector = AIDetector()
-
-    def _detect_document_type(self, archive_names: List[str]) -> str:
-        names_norm = [name.replace("\\", "/").lower() for name in archive_names]
-        has_word = any(name.startswith("word/") for name in names_norm)
-        has_ppt = any(name.startswith("ppt/") for name in names_norm)
+        # Кэш результатов по хешу изображения (по умолчанию общий для процесса)
+        self.cache = (cache or get_image_result_cache()) if use_cache else None
+        # Индекс почти одинаковых изображений из других документов (по умолчанию общий для процесса)
+        use_hash_index = use_hash_index and PERCEPTUAL_HASH_ENABLED
+        self.hash_index = (hash_index or get_image_hash_index()) if use_hash_index else None
+        # Число потоков для анализа изображений (1 — последовательно)
+        self.max_workers = max(1, max_workers or IMAGE_ANALYSIS_WORKERS)
+        # Число потоков распаковки изображений из архива
+        self.extract_workers = max(1, extract_workers or ZIP_EXTRACT_WORKERS)
+        # Анализ пикселей (нужен NumPy); по умолчанию — PIXEL_ANALYSIS
+        if pixel_analysis is None:
+            pixel_analysis = PIXEL_ANALYSIS_ENABLED
+        self.pixel_analysis = pixel_analysis and PIXEL_FORENSICS_AVAILABLE
+
+    def _cache_key(self, digest: str) -> str:
+        """Ключ кэша изображений: результаты с анализом пикселей и без него хранятся отдельно"""
+        return digest if self.pixel_analysis else f"{digest}:metadata-only"
+
+    def _detect_document_type(self, index: ArchiveIndex) -> str:
+        has_word = "word" in index.top_dirs
+        has_ppt = "ppt" in index.top_dirs
 
         if has_word and not has_ppt:
             return "word"
@@ -45,11 +173,19 @@ class DocumentAnalyzer:
             return "word"
         raise ValueError("Не удалось определить тип офисного документа (ожидался DOCX/PPTX)")
 
-    def _parse_xml_from_zip(self, zf: zipfile.ZipFile, member: str) -> Optional[ET.Element]:
-        try:
-            raw = zf.read(member)
-        except KeyError:
+    @staticmethod
+    def _open_zip(source: DocumentSource) -> zipfile.ZipFile:
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            source = io.BytesIO(source)
+        elif not isinstance(source, (str, os.PathLike)):
+            source.seek(0)
+        return zipfile.ZipFile(source, "r")
+
+    def _parse_xml_from_zip(self, zf: zipfile.ZipFile, index: ArchiveIndex, member: str) -> Optional[ET.Element]:
+        entry = index.get(member)
+        if entry is None:
             return None
+        raw = zf.read(entry.info)
 
         try:
             return ET.fromstring(raw)
@@ -57,7 +193,7 @@ class DocumentAnalyzer:
             logger.warning("Не удалось распарсить XML: %s", member)
             return None
 
-    def _extract_document_metadata(self, zf: zipfile.ZipFile, document_type: str) -> Dict[str, Any]:
+    def _extract_document_metadata(self, zf: zipfile.ZipFile, index: ArchiveIndex, document_type: str) -> Dict[str, Any]:
         ns = {
             "cp": "http://schemas.openxmlformats.org/package/2006/metadata/core-properties",
             "dc": "http://purl.org/dc/elements/1.1/",
@@ -65,8 +201,8 @@ class DocumentAnalyzer:
             "ep": "http://schemas.openxmlformats.org/officeDocument/2006/extended-properties",
         }
 
-        core_root = self._parse_xml_from_zip(zf, "docProps/core.xml")
-        app_root = self._parse_xml_from_zip(zf, "docProps/app.xml")
+        core_root = self._parse_xml_from_zip(zf, index, "docProps/core.xml")
+        app_root = self._parse_xml_from_zip(zf, index, "docProps/app.xml")
 
         metadata = {
             "document_type": document_type,
@@ -110,48 +246,177 @@ class DocumentAnalyzer:
 
         return metadata
 
-    def _extract_images(self, office_path: str, media_prefix: str) -> List[Dict[str, Any]]:
+    @staticmethod
+    def _read_from_buffer(buffer: memoryview, member: ArchiveMember) -> Union[bytes, memoryview]:
+        """
+        Чтение члена архива из отображенного в память документа.
+        Несжатый член возвращается срезом без копирования, deflate распаковывается zlib
+        (zlib отпускает GIL, поэтому распаковка в нескольких потоках идет параллельно).
+        Распаковка идет частями (вход и выход) в буфер размера из центрального каталога: член, занижающий
+        свой размер, отклоняется, а не распаковывается целиком.
+        """
+        offset = member.info.header_offset
+        header = buffer[offset:offset + _ZIP_LOCAL_HEADER_SIZE]
+        if len(header) != _ZIP_LOCAL_HEADER_SIZE or header[:4] != _ZIP_LOCAL_HEADER_SIGNATURE:
+            raise zipfile.BadZipFile(f"Некорректный заголовок члена архива: {member.path}")
+        name_length, extra_length = struct.unpack("<HH", header[26:30])
+        start = offset + _ZIP_LOCAL_HEADER_SIZE + name_length + extra_length
+        raw = buffer[start:start + member.compress_size]
+        if member.compress_type == zipfile.ZIP_STORED:
+            data = raw
+        else:
+            data = memoryview(bytearray(member.size))
+            filled = 0
+            consumed = 0
+            decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            tail: Union[bytes, memoryview] = b""
+            while not decompressor.eof:
+                # Вход тоже подается частями: unconsumed_tail — копия непрочитанного входа
+                if not tail:
+                    tail = raw[consumed:consumed + _ZIP_READ_CHUNK]
+                    consumed += len(tail)
+                chunk = decompressor.decompress(tail, _ZIP_READ_CHUNK)
+                if not chunk and not decompressor.unconsumed_tail and consumed >= len(raw) and not decompressor.eof:
+                    break
+                if filled + len(chunk) > member.size:
+                    raise zipfile.BadZipFile(f"Размер члена архива не совпадает с каталогом: {member.path}")
+                data[filled:filled + len(chunk)] = chunk
+                filled += len(chunk)
+                tail = decompressor.unconsumed_tail
+            if not decompressor.eof or filled != member.size:
+                raise zipfile.BadZipFile(f"Размер члена архива не совпадает с каталогом: {member.path}")
+        if len(data) != member.size or zlib.crc32(data) != member.crc:
+            raise zipfile.BadZipFile(f"Ошибка CRC-32 члена архива: {member.path}")
+        return data
+
+    @staticmethod
+    def _zero_copy(buffer: Optional[memoryview], member: ArchiveMember) -> bool:
+        """Член архива читается срезом отображенного документа, без копирования"""
+        encrypted = member.info.flag_bits & 0x1
+        return buffer is not None and not encrypted and member.compress_type == zipfile.ZIP_STORED
+
+    def _read_members(
+        self, zf: zipfile.ZipFile, members: List[ArchiveMember], buffer: Optional[memoryview]
+    ) -> List[Tuple[Union[bytes, memoryview], str]]:
         """
-        Извлекает все изображения из офисного ZIP-документа во временные файлы.
+        Чтение членов архива и их SHA-256. При большом объеме сжатых данных члены
+        распаковываются параллельно (extract_workers потоков).
 
         Returns:
-            Список объектов:
+            (содержимое, sha256) в порядке members
+        """
+
+        def read_one(member: ArchiveMember) -> Tuple[Union[bytes, memoryview], str]:
+            encrypted = member.info.flag_bits & 0x1
+            if buffer is not None and not encrypted and member.compress_type in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+                data = self._read_from_buffer(buffer, member)
+            else:
+                # ZipFile допускает одновременное чтение разных членов из нескольких потоков;
+                # чтение частями ограничено размером из каталога (zf.read распаковал бы член
+                # целиком), CRC-32 прочитанного ZipFile проверяет сам
+                data = memoryview(bytearray(member.size))
+                filled = 0
+                with zf.open(member.info) as f:
+                    while filled < member.size:
+                        count = f.readinto(data[filled:filled + _ZIP_READ_CHUNK])
+                        if not count:
+                            break
+                        filled += count
+                if filled != member.size:
+                    raise zipfile.BadZipFile(f"Размер члена архива не совпадает с каталогом: {member.path}")
+            return data, hashlib.sha256(data).hexdigest()
+
+        workers = min(self.extract_workers, len(members))
+        if workers <= 1 or sum(member.compress_size for member in members) < ZIP_PARALLEL_MIN_BYTES:
+            return [read_one(member) for member in members]
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="zip-extract") as pool:
+            results = list(pool.map(read_one, members))
+        logger.info(
+            "Распаковано изображений: %d за %.2f сек (потоков: %d)",
+            len(members), time.perf_counter() - started, workers,
+        )
+        return results
+
+    @staticmethod
+    def _image_members(index: ArchiveIndex, media_prefix: str) -> List[ArchiveMember]:
+        """Изображения документа по индексу центрального каталога (префикс и расширение)"""
+        return [member for member in index.with_prefix(media_prefix) if member.extension in IMAGE_EXTENSIONS]
+
+    def _extract_images(
+        self,
+        zf: zipfile.ZipFile,
+        members: List[ArchiveMember],
+        source: Optional[DocumentSource] = None,
+    ) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Извлекает изображения из офисного ZIP-документа в память порциями: распакованные
+        данные одной порции не больше ZIP_INFLIGHT_BYTES (член архива больше предела
+        составляет порцию один). Следующая порция читается, когда вызывающий код
+        запросил ее, — к этому времени он освобождает data предыдущей.
+        Если передан source (тот же документ, что и zf), члены архива читаются из его
+        отображения в память: несжатые — без копирования (и не считаются в пределе),
+        сжатые — параллельно.
+
+        Yields:
+            Списки объектов в порядке архива:
             - filename: имя файла
             - archive_path: путь внутри архива
-            - temp_path: путь к временному файлу
+            - data: содержимое изображения (bytes или memoryview)
             - size: размер извлеченного файла
             - extension: расширение
+            - sha256: хеш содержимого (ключ кэша результатов)
+            - duplicate_of: archive_path первого такого же изображения (только у дубликатов;
+              дубликат ссылается на те же data и не анализируется повторно)
         """
         extracted: List[Dict[str, Any]] = []
-        temp_dir = tempfile.mkdtemp(prefix="office_images_")
+        # (CRC-32, размер) из центрального каталога -> индексы уникальных изображений;
+        # совпадение проверяется по SHA-256, чтобы коллизия CRC не склеила разные файлы
+        unique_by_crc: Dict[Tuple[int, int], List[int]] = {}
+        buffer = _map_source(source) if source is not None else None
+
+        def batches() -> Iterator[List[ArchiveMember]]:
+            batch: List[ArchiveMember] = []
+            batch_bytes = 0
+            for member in members:
+                size = 0 if self._zero_copy(buffer, member) else member.size
+                if batch and batch_bytes + size > ZIP_INFLIGHT_BYTES:
+                    yield batch
+                    batch, batch_bytes = [], 0
+                batch.append(member)
+                batch_bytes += size
+            if batch:
+                yield batch
+
+        def read_batch(batch: List[ArchiveMember]) -> List[Dict[str, Any]]:
+            entries = []
+            for member, (data, digest) in zip(batch, self._read_members(zf, batch, buffer)):
+                entry = {
+                    "filename": member.filename,
+                    "archive_path": member.path,
+                    "size": len(data),
+                    "extension": member.extension,
+                    "sha256": digest,
+                }
+
+                candidates = unique_by_crc.setdefault((member.crc, member.size), [])
+                original = next((extracted[i] for i in candidates if extracted[i]["sha256"] == digest), None)
+                if original is not None:
+                    # Оригинал из прошлой порции уже освобожден
+                    entry["data"] = original.get("data", data)
+                    entry["duplicate_of"] = original["archive_path"]
+                else:
+                    entry["data"] = data
+                    candidates.append(len(extracted))
+                extracted.append(entry)
+                entries.append(entry)
+            return entries
 
         try:
-            with zipfile.ZipFile(office_path, "r") as zf:
-                for name in zf.namelist():
-                    name_norm = name.replace("\\", "/").lower()
-                    if not name_norm.startswith(media_prefix):
-                        continue
-
-                    base = os.path.basename(name)
-                    ext = os.path.splitext(base)[1].lower()
-                    if ext not in IMAGE_EXTENSIONS:
-                        continue
-
-                    data = zf.read(name)
-                    safe_rel = name_norm.replace("/", "__")
-                    out_path = os.path.join(temp_dir, safe_rel)
-                    with open(out_path, "wb") as f:
-                        f.write(data)
-
-                    extracted.append(
-                        {
-                            "filename": base,
-                            "archive_path": name.replace("\\", "/"),
-                            "temp_path": out_path,
-                            "size": len(data),
-                            "extension": ext,
-                        }
-                    )
+            # Между порциями генератор не держит ссылок на прочитанные данные
+            for batch in batches():
+                yield read_batch(batch)
         except zipfile.BadZipFile:
             logger.error("Файл не является корректным офисным ZIP-документом")
             raise ValueError("Файл не является корректным документом DOCX/PPTX")
@@ -159,97 +424,317 @@ class DocumentAnalyzer:
             logger.exception("Ошибка при извлечении изображений из офисного документа")
             raise ValueError(f"Не удалось прочитать документ: {e!s}")
 
-        if not extracted:
-            shutil.rmtree(temp_dir, ignore_errors=True)
-        return extracted
+    def _analyze_images(
+        self,
+        batches: Iterable[List[Dict[str, Any]]],
+        total: int,
+        progress: Optional[ProgressCallback] = None,
+        on_image: Optional[ImageCallback] = None,
+    ) -> Tuple[List[Dict[str, Any]], List[Tuple[Dict[str, Any], Dict[str, Any], Dict[str, float]]]]:
+        """
+        Анализ извлеченных изображений (порции из _extract_images, всего total): метаданные
+        (один пакетный вызов ExifTool на часть изображений) и признаки ИИ; без on_image
+        вероятности порции считаются одним проходом правил (AIDetector.score_ai_signs).
+        После анализа порции ее data освобождаются, и только потом читается следующая.
+        При max_workers > 1 изображения обрабатываются параллельно, результат всегда в порядке архива.
+        Дубликаты (duplicate_of) не анализируются: им копируется результат оригинала.
+        on_image получает результат каждого изображения сразу по готовности (в порядке завершения).
 
-    def analyze_document(self, office_path: str) -> Dict[str, Any]:
+        Returns:
+            (изображения без data, список (metadata, ai_indicators, timing) в их порядке)
+        """
+        extracted_images: List[Dict[str, Any]] = []
+        analyzed: List[Optional[Tuple[Dict[str, Any], Dict[str, Any], Dict[str, float]]]] = []
+        duplicates: List[int] = []
+        cached_count = 0
+        analyzed_count = 0
+        analysis_seconds = 0.0
+
+        # Для потоковой выдачи изображение оценивается сразу, иначе — вся порция одним проходом правил
+        streaming = on_image is not None
+        # on_result вызывается из нескольких потоков
+        progress_lock = threading.Lock()
+        done_count = 0
+        if progress is not None:
+            progress(done_count, total)
+
+        for batch in batches:
+            offset = len(extracted_images)
+            extracted_images.extend(batch)
+            analyzed.extend([None] * len(batch))
+
+            # Результаты для уже встречавшихся изображений берем из кэша по хешу содержимого
+            pending: List[int] = []
+            # Изображения порции, ожидающие итоговой оценки (без потоковой выдачи)
+            unscored: List[int] = []
+            for index in range(offset, len(extracted_images)):
+                image = extracted_images[index]
+                if "duplicate_of" in image:
+                    duplicates.append(index)
+                    continue
+                cached = self.cache.get(self._cache_key(image["sha256"])) if self.cache is not None else None
+                if cached is not None:
+                    metadata, ai_indicators = cached
+                    analyzed[index] = (metadata, ai_indicators, {"analysis_ms": 0.0, "detection_ms": 0.0, "cached": True})
+                    cached_count += 1
+                    if on_image is not None:
+                        on_image(index, self._image_result(image, *analyzed[index]))
+                else:
+                    pending.append(index)
+
+            # Дубликаты и изображения из кэша готовы сразу
+            if len(pending) < len(batch) and progress is not None:
+                with progress_lock:
+                    done_count += len(batch) - len(pending)
+                    progress(done_count, total)
+
+            def on_result(pending_index: int, metadata: Dict[str, Any], analysis_ms: float) -> None:
+                nonlocal done_count
+                index = pending[pending_index]
+                filename = extracted_images[index]["filename"]
+                start = time.perf_counter()
+                try:
+                    if "error" in metadata:
+                        raise ValueError(metadata["error"])
+                    if self.pixel_analysis:
+                        metadata["pixel_analysis"] = self.ai_detector.analyze_image_characteristics(
+                            extracted_images[index]["data"], metadata
+                        )
+                    ai_indicators = self.ai_detector.detect_ai_signs(metadata, file_type="image", score=streaming)
+                except Exception as e:
+                    logger.warning("Ошибка анализа изображения %s: %s", filename, e)
+                    metadata = {"error": str(e)}
+                    ai_indicators = {
+                        "software_detected": [],
+                        "anomalies": [],
+                        "evidence_from_metadata": [],
+                        "ai_probability": 0,
+                        "confidence": "low",
+                    }
+                else:
+                    if not streaming:
+                        unscored.append(index)
+                    elif self.cache is not None:
+                        self.cache.put(self._cache_key(extracted_images[index]["sha256"]), metadata, ai_indicators)
+                timing = {
+                    "analysis_ms": round(analysis_ms, 1),
+                    "detection_ms": round((time.perf_counter() - start) * 1000, 1),
+                }
+                analyzed[index] = (metadata, ai_indicators, timing)
+                if on_image is not None:
+                    on_image(index, self._image_result(extracted_images[index], metadata, ai_indicators, timing))
+                if progress is not None:
+                    with progress_lock:
+                        done_count += 1
+                        progress(done_count, total)
+
+            if pending:
+                started = time.perf_counter()
+                self.image_analyzer.analyze_many(
+                    [extracted_images[index]["archive_path"] for index in pending],
+                    max_workers=self.max_workers,
+                    on_result=on_result,
+                    contents=[extracted_images[index]["data"] for index in pending],
+                )
+                analysis_seconds += time.perf_counter() - started
+                analyzed_count += len(pending)
+            if unscored:
+                self._score_images(extracted_images, analyzed, unscored)
+            for image in batch:
+                del image["data"]
+
+        unique_count = len(extracted_images) - len(duplicates)
+        if duplicates:
+            logger.info("Одинаковых изображений в документе: %d (уникальных %d)", len(duplicates), unique_count)
+        if cached_count:
+            logger.info("Кэш изображений: найдено %d из %d", cached_count, unique_count)
+        logger.info(
+            "Проанализировано изображений: %d за %.2f сек (потоков: %d)",
+            analyzed_count, analysis_seconds, self.max_workers,
+        )
+
+        index_by_path = {image["archive_path"]: index for index, image in enumerate(extracted_images)}
+        for index in duplicates:
+            original_path = extracted_images[index]["duplicate_of"]
+            metadata, ai_indicators, _ = analyzed[index_by_path[original_path]]
+            analyzed[index] = (
+                copy.deepcopy(metadata),
+                copy.deepcopy(ai_indicators),
+                {"analysis_ms": 0.0, "detection_ms": 0.0, "duplicate_of": original_path},
+            )
+            if on_image is not None:
+                on_image(index, self._image_result(extracted_images[index], *analyzed[index]))
+        return extracted_images, analyzed
+
+    def _score_images(
+        self,
+        extracted_images: List[Dict[str, Any]],
+        analyzed: List[Optional[Tuple[Dict[str, Any], Dict[str, Any], Dict[str, float]]]],
+        indices: List[int],
+    ) -> None:
+        """Итоговая оценка изображений порции (detect_ai_signs(score=False)) и запись в кэш"""
+        indices = sorted(indices)
+        start = time.perf_counter()
+        self.ai_detector.score_ai_signs(
+            [analyzed[index][1] for index in indices], [analyzed[index][0] for index in indices]
+        )
+        scoring_ms = (time.perf_counter() - start) * 1000 / len(indices)
+        for index in indices:
+            metadata, ai_indicators, timing = analyzed[index]
+            timing["detection_ms"] = round(timing["detection_ms"] + scoring_ms, 1)
+            if self.cache is not None:
+                self.cache.put(self._cache_key(extracted_images[index]["sha256"]), metadata, ai_indicators)
+
+    def _link_near_duplicates(
+        self,
+        extracted_images: List[Dict[str, Any]],
+        analyzed: List[Tuple[Dict[str, Any], Dict[str, Any], Dict[str, float]]],
+        document_id: Optional[str],
+    ) -> Tuple[List[Optional[Dict[str, Any]]], int]:
+        """
+        Поиск изображений документа среди изображений, проанализированных раньше
+        (по перцептивному хешу), и запись изображений документа в индекс.
+
+        Returns:
+            (совпадения для каждого изображения или None, число документов, где встречались изображения)
+        """
+        if self.hash_index is None:
+            return [None] * len(extracted_images), 0
+        if document_id is None:
+            # Без SHA-256 файла документ опознается по набору своих изображений
+            document_id = hashlib.sha256(
+                "\n".join(sorted(image["sha256"] for image in extracted_images)).encode("ascii")
+            ).hexdigest()
+        hashes = [metadata.get("perceptual_hash") for metadata, _, _ in analyzed]
+        near_duplicates, documents = self.hash_index.lookup(hashes, exclude_document=document_id)
+        self.hash_index.add(
+            document_id,
+            [
+                (image["sha256"], image_hashes, ai_indicators.get("ai_probability", 0), ai_indicators.get("confidence", "low"))
+                for image, image_hashes, (_, ai_indicators, _) in zip(extracted_images, hashes, analyzed)
+                if image_hashes and "duplicate_of" not in image
+            ],
+        )
+        found = sum(entry is not None for entry in near_duplicates)
+        if found:
+            logger.info("Изображений, встречавшихся в других документах: %d (документов: %d)", found, documents)
+        return near_duplicates, documents
+
+    @staticmethod
+    def _image_result(
+        image_entry: Dict[str, Any],
+        metadata: Dict[str, Any],
+        ai_indicators: Dict[str, Any],
+        timing: Dict[str, Any],
+    ) -> Dict[str, Any]:
+        """Запись об изображении в формате списка "images" результата анализа"""
+        return {
+            "filename": image_entry["filename"],
+            "archive_path": image_entry.get("archive_path"),
+            "size": image_entry.get("size"),
+            "extension": image_entry.get("extension"),
+            "metadata": metadata,
+            "ai_indicators": {
+                "software_detected": ai_indicators.get("software_detected", []),
+                "heuristics": ai_indicators.get("heuristics", {}),
+                "anomalies": ai_indicators.get("anomalies", []),
+                "evidence_from_metadata": ai_indicators.get("evidence_from_metadata") or [],
+                "ai_probability": ai_indicators.get("ai_probability", 0),
+                "confidence": ai_indicators.get("confidence", "low"),
+            },
+            "timing": timing,
+        }
+
+    def analyze_document(
+        self,
+        source: DocumentSource,
+        progress: Optional[ProgressCallback] = None,
+        on_document: Optional[DocumentCallback] = None,
+        on_image: Optional[ImageCallback] = None,
+        document_id: Optional[str] = None,
+    ) -> Dict[str, Any]:
         """
         Анализирует DOCX/PPTX: метаданные документа + анализ встроенных изображений.
+
+        Args:
+            source: путь к документу, его содержимое (bytes) или открытый двоичный файл;
+                документ и изображения читаются в памяти, без временных файлов
+            progress: вызывается по мере анализа изображений: progress(обработано, всего)
+            on_document: вызывается с метаданными документа до анализа изображений
+            on_image: вызывается с результатом каждого изображения по готовности
+                (для потоковой выдачи; порядок вызовов — порядок завершения)
+            document_id: идентификатор документа для индекса почти одинаковых изображений
+                (SHA-256 файла); по умолчанию — хеш набора его изображений
         """
+        # Архив открывается один раз; индекс центрального каталога используется всеми этапами
         try:
-            with zipfile.ZipFile(office_path, "r") as zf:
-                archive_names = zf.namelist()
-                document_type = self._detect_document_type(archive_names)
-                document_metadata = self._extract_document_metadata(zf, document_type)
+            with self._open_zip(source) as zf:
+                index = ArchiveIndex(zf)
+                document_type = self._detect_document_type(index)
+                document_metadata = self._extract_document_metadata(zf, index, document_type)
+                media_prefix = self.DOCX_MEDIA_PREFIX if document_type == "word" else self.PPTX_MEDIA_PREFIX
+                members = self._image_members(index, media_prefix)
+                embedded_images = [
+                    {
+                        "filename": member.filename,
+                        "archive_path": member.path,
+                        "size": member.size,
+                        "extension": member.extension,
+                    }
+                    for member in members
+                ]
+                if on_document is not None:
+                    on_document(
+                        {
+                            "document_type": document_type,
+                            "document_metadata": document_metadata,
+                            "embedded_images": embedded_images,
+                            "images_count": len(members),
+                        }
+                    )
+                # Изображения распаковываются и анализируются порциями, пока архив открыт
+                extracted_images, analyzed = self._analyze_images(
+                    self._extract_images(zf, members, source=source), len(members), progress=progress, on_image=on_image
+                )
         except zipfile.BadZipFile:
             raise ValueError("Файл не является корректным документом DOCX/PPTX")
 
-        media_prefix = self.DOCX_MEDIA_PREFIX if document_type == "word" else self.PPTX_MEDIA_PREFIX
-        extracted_images = self._extract_images(office_path, media_prefix=media_prefix)
-
         images_results: List[Dict[str, Any]] = []
-        all_software = set()
+        # ПО в порядке изображений в архиве, без повторов (ответ и отчет не зависят от хеширования строк)
+        all_software: Dict[str, None] = {}
         all_anomalies = []
         all_evidence = []
         max_ai_prob = 0
         images_with_ai = 0
 
-        for image_entry in extracted_images:
-            filename = image_entry["filename"]
-            img_path = image_entry["temp_path"]
-
-            try:
-                metadata = self.image_analyzer.analyze(img_path)
-                ai_indicators = self.ai_detector.detect_ai_signs(metadata, file_type="image")
-            except Exception as e:
-                logger.warning("Ошибка анализа изображения %s: %s", filename, e)
-                metadata = {"error": str(e)}
-                ai_indicators = {
-                    "software_detected": [],
-                    "anomalies": [],
-                    "evidence_from_metadata": [],
-                    "ai_probability": 0,
-                    "confidence": "low",
-                }
+        near_duplicates, seen_documents = self._link_near_duplicates(extracted_images, analyzed, document_id)
 
-            prob = ai_indicators.get("ai_probability", 0)
+        for image_entry, (metadata, ai_indicators, timing), near in zip(extracted_images, analyzed, near_duplicates):
+            image_result = self._image_result(image_entry, metadata, ai_indicators, timing)
+            if near is not None:
+                # То же изображение (возможно, пересжатое или уменьшенное) уже встречалось: вердикты тех анализов
+                image_result["near_duplicates"] = near
+            prob = image_result["ai_indicators"]["ai_probability"]
             if prob > 0:
                 images_with_ai += 1
             max_ai_prob = max(max_ai_prob, prob)
-            all_software.update(ai_indicators.get("software_detected", []))
-            all_anomalies.extend(ai_indicators.get("anomalies", []))
-            ev = ai_indicators.get("evidence_from_metadata") or []
-            all_evidence.extend(ev)
-
-            images_results.append(
-                {
-                    "filename": filename,
-                    "archive_path": image_entry.get("archive_path"),
-                    "size": image_entry.get("size"),
-                    "extension": image_entry.get("extension"),
-                    "metadata": metadata,
-                    "ai_indicators": {
-                        "software_detected": ai_indicators.get("software_detected", []),
-                        "heuristics": ai_indicators.get("heuristics", {}),
-                        "anomalies": ai_indicators.get("anomalies", []),
-                        "evidence_from_metadata": ev,
-                        "ai_probability": prob,
-                        "confidence": ai_indicators.get("confidence", "low"),
-                    },
-                }
-            )
-
-        if extracted_images:
-            temp_dir = os.path.dirname(extracted_images[0]["temp_path"])
-            shutil.rmtree(temp_dir, ignore_errors=True)
+            all_software.update(dict.fromkeys(image_result["ai_indicators"]["software_detected"]))
+            all_anomalies.extend(image_result["ai_indicators"]["anomalies"])
+            all_evidence.extend(image_result["ai_indicators"]["evidence_from_metadata"])
+            images_results.append(image_result)
 
         return {
             "document_type": document_type,
             "document_metadata": document_metadata,
-            "embedded_images": [
-                {
-                    "filename": image["filename"],
-                    "archive_path": image.get("archive_path"),
-                    "size": image.get("size"),
-                    "extension": image.get("extension"),
-                }
-                for image in images_results
-            ],
+            "embedded_images": embedded_images,
             "images_count": len(images_results),
             "images_with_ai_count": images_with_ai,
             "max_ai_probability": max_ai_prob,
             "images": images_results,
+            "seen_before": {
+                "documents": seen_documents,
+                "images": sum(entry is not None for entry in near_duplicates),
+            },
             "aggregated": {
                 "software_detected": list(all_software),
                 "anomalies": all_anomalies,
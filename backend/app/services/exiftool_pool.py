@@ -0,0 +1,236 @@
+"""
+Пул долгоживущих процессов ExifTool в режиме -stay_open.
+
+Запуск Perl/ExifTool стоит дороже, чем чтение метаданных одного изображения,
+поэтому процессы запускаются один раз и принимают команды через stdin
+(`-stay_open True -@ -`). Каждая команда завершается `-execute<N>`, а ответ
+считывается до маркера `{ready<N>}` в stdout; stderr обрамляется через
+`-echo4 {status<N>}${status}`, что заодно даёт код завершения команды.
+"""
+import os
+import queue
+import subprocess
+import threading
+import time
+import logging
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Количество процессов ExifTool в пуле
+EXIFTOOL_POOL_SIZE = max(1, int(os.environ.get("EXIFTOOL_POOL_SIZE", "2")))
+# Таймаут одной команды (сек); при превышении процесс перезапускается
+EXIFTOOL_REQUEST_TIMEOUT = float(os.environ.get("EXIFTOOL_REQUEST_TIMEOUT", "15"))
+# Простой процесса (сек), после которого перед командой выполняется проверка -ver
+EXIFTOOL_HEALTHCHECK_INTERVAL = float(os.environ.get("EXIFTOOL_HEALTHCHECK_INTERVAL", "60"))
+EXIFTOOL_HEALTHCHECK_TIMEOUT = 5.0
+
+
+class ExifToolError(RuntimeError):
+    """Процесс ExifTool завершился или перестал отвечать по протоколу -stay_open."""
+
+
+class ExifToolWorker:
+    """Один процесс ExifTool в режиме -stay_open."""
+
+    def __init__(self, command: List[str], cwd: Optional[str] = None):
+        self._command = list(command)
+        self._cwd = cwd
+        self._proc: Optional[subprocess.Popen] = None
+        self._stdout_lines: "queue.Queue[Optional[bytes]]" = queue.Queue()
+        self._stderr_lines: "queue.Queue[Optional[bytes]]" = queue.Queue()
+        self._counter = 0
+        self.last_used = 0.0
+
+    def is_alive(self) -> bool:
+        return self._proc is not None and self._proc.poll() is None
+
+    def start(self) -> None:
+        """Запуск процесса и потоков чтения stdout/stderr."""
+        self._stdout_lines = queue.Queue()
+        self._stderr_lines = queue.Queue()
+        self._proc = subprocess.Popen(
+            self._command + ["-stay_open", "True", "-@", "-"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=self._cwd,
+        )
+        for stream, lines in ((self._proc.stdout, self._stdout_lines), (self._proc.stderr, self._stderr_lines)):
+            threading.Thread(target=self._pump, args=(stream, lines), daemon=True).start()
+        self.last_used = time.monotonic()
+        logger.info(f"Запущен процесс ExifTool -stay_open (pid={self._proc.pid})")
+
+    @staticmethod
+    def _pump(stream, lines: "queue.Queue[Optional[bytes]]") -> None:
+        # Читаем построчно в отдельном потоке: это даёт таймауты без select() (который не работает с pipe на Windows)
+        try:
+            for line in iter(stream.readline, b""):
+                lines.put(line)
+        except (OSError, ValueError):
+            pass
+        finally:
+            lines.put(None)
+
+    def stop(self) -> None:
+        """Корректное завершение процесса (-stay_open False), при зависании — kill."""
+        proc, self._proc = self._proc, None
+        if proc is None:
+            return
+        try:
+            if proc.poll() is None:
+                proc.stdin.write(b"-stay_open\nFalse\n")
+                proc.stdin.flush()
+                proc.wait(timeout=2)
+        except (OSError, ValueError, subprocess.TimeoutExpired):
+            proc.kill()
+            try:
+                proc.wait(timeout=2)
+            except subprocess.TimeoutExpired:
+                logger.warning(f"Процесс ExifTool (pid={proc.pid}) не завершился после kill")
+        for stream in (proc.stdin, proc.stdout, proc.stderr):
+            try:
+                stream.close()
+            except (OSError, ValueError):
+                pass
+
+    def _read_until(self, lines: "queue.Queue[Optional[bytes]]", marker: str, deadline: float, args: List[str], timeout: float) -> List[str]:
+        collected = []
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise subprocess.TimeoutExpired(self._command + args, timeout)
+            try:
+                raw = lines.get(timeout=remaining)
+            except queue.Empty:
+                raise subprocess.TimeoutExpired(self._command + args, timeout)
+            if raw is None:
+                raise ExifToolError("Процесс ExifTool неожиданно завершился")
+            line = raw.decode("utf-8", errors="replace").rstrip("\r\n")
+            if line.startswith(marker):
+                collected.append(line[len(marker):])
+                return collected
+            collected.append(line)
+
+    def execute(self, args: List[str], timeout: float = EXIFTOOL_REQUEST_TIMEOUT) -> subprocess.CompletedProcess:
+        """
+        Выполнение одной команды ExifTool.
+
+        Returns:
+            subprocess.CompletedProcess с returncode/stdout/stderr, как у subprocess.run
+        """
+        if not self.is_alive():
+            raise ExifToolError("Процесс ExifTool не запущен")
+
+        self._counter += 1
+        n = self._counter
+        ready_marker = f"{{ready{n}}}"
+        status_marker = f"{{status{n}}}"
+        lines = ["-charset", "filename=utf8", *args, "-echo4", status_marker + "${status}", f"-execute{n}"]
+        payload = ("\n".join(lines) + "\n").encode("utf-8")
+
+        deadline = time.monotonic() + timeout
+        try:
+            self._proc.stdin.write(payload)
+            self._proc.stdin.flush()
+        except (OSError, ValueError) as e:
+            raise ExifToolError(f"Не удалось передать команду ExifTool: {e}")
+
+        stdout_lines = self._read_until(self._stdout_lines, ready_marker, deadline, args, timeout)
+        stdout_lines.pop()  # остаток строки с маркером {readyN}
+        stderr_lines = self._read_until(self._stderr_lines, status_marker, deadline, args, timeout)
+        status_text = stderr_lines.pop().strip()
+        self.last_used = time.monotonic()
+
+        try:
+            returncode = int(status_text)
+        except ValueError:
+            # Старые версии ExifTool не подставляют ${status}
+            returncode = 0 if stdout_lines else 1
+
+        stdout = "\n".join(stdout_lines)
+        return subprocess.CompletedProcess(
+            args=self._command + args,
+            returncode=returncode,
+            stdout=stdout + "\n" if stdout else "",
+            stderr="\n".join(stderr_lines),
+        )
+
+
+class ExifToolPool:
+    """
+    Пул процессов ExifTool -stay_open.
+
+    Процессы запускаются лениво при первом запросе. Перед выдачей процесс
+    проверяется: упавший перезапускается, а долго простаивавший проходит
+    проверку `-ver`. Процесс, не уложившийся в таймаут, убивается и будет
+    перезапущен при следующем обращении.
+    """
+
+    def __init__(
+        self,
+        command: List[str],
+        cwd: Optional[str] = None,
+        size: int = EXIFTOOL_POOL_SIZE,
+        healthcheck_interval: float = EXIFTOOL_HEALTHCHECK_INTERVAL,
+    ):
+        self.size = size
+        self._healthcheck_interval = healthcheck_interval
+        self._workers: "queue.Queue[ExifToolWorker]" = queue.Queue()
+        self._all_workers = [ExifToolWorker(command, cwd) for _ in range(size)]
+        for worker in self._all_workers:
+            self._workers.put(worker)
+        self._closed = False
+
+    def _ensure_healthy(self, worker: ExifToolWorker) -> None:
+        if not worker.is_alive():
+            worker.stop()
+            worker.start()
+            return
+        if time.monotonic() - worker.last_used < self._healthcheck_interval:
+            return
+        try:
+            result = worker.execute(["-ver"], timeout=EXIFTOOL_HEALTHCHECK_TIMEOUT)
+            if result.returncode == 0 and result.stdout.strip():
+                return
+            logger.warning(f"Проверка ExifTool -ver вернула код {result.returncode}, перезапуск процесса")
+        except (subprocess.TimeoutExpired, ExifToolError) as e:
+            logger.warning(f"Проверка ExifTool не пройдена ({e}), перезапуск процесса")
+        worker.stop()
+        worker.start()
+
+    def run(self, args: List[str], timeout: float = EXIFTOOL_REQUEST_TIMEOUT) -> subprocess.CompletedProcess:
+        """
+        Выполнение команды на свободном процессе пула (блокируется, если все заняты).
+
+        Raises:
+            subprocess.TimeoutExpired: команда не уложилась в timeout (процесс перезапускается)
+            ExifToolError: процесс упал дважды подряд
+            OSError: ExifTool не удалось запустить
+        """
+        if self._closed:
+            raise ExifToolError("Пул ExifTool закрыт")
+
+        worker = self._workers.get()
+        try:
+            for attempt in (1, 2):
+                self._ensure_healthy(worker)
+                try:
+                    return worker.execute(args, timeout=timeout)
+                except subprocess.TimeoutExpired:
+                    logger.error(f"ExifTool не ответил за {timeout:.0f} сек, процесс будет перезапущен")
+                    worker.stop()
+                    raise
+                except ExifToolError as e:
+                    worker.stop()
+                    if attempt == 2:
+                        raise
+                    logger.warning(f"Процесс ExifTool упал ({e}), повтор на новом процессе")
+        finally:
+            self._workers.put(worker)
+
+    def close(self) -> None:
+        """Остановка всех процессов пула."""
+        self._closed = True
+        for worker in self._all_workers:
+            worker.stop()
@@ -2,68 +2,57 @@ import exifread
 from PIL import Image
 from PIL.ExifTags import TAGS, GPSTAGS
 import piexif
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Callable
 import os
 import subprocess
 import json
 import platform
 import logging
 import shutil
+import threading
+import io
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.services.exiftool_pool import ExifToolPool, ExifToolError, EXIFTOOL_REQUEST_TIMEOUT
+from app.services.image_header import parse_image_header, LazyPilHeader
+from app.services.ai_keywords import AI_SOFTWARE_KEYWORDS, get_ai_keyword_matcher
+from app.services.perceptual_hash import PERCEPTUAL_HASH_ENABLED, perceptual_hashes
 
 logger = logging.getLogger(__name__)
 
+# Максимум файлов в одном пакетном вызове ExifTool (ограничивает размер ответа и цену сбоя)
+EXIFTOOL_BATCH_SIZE = max(1, int(os.environ.get("EXIFTOOL_BATCH_SIZE", "200")))
+# Добавка к таймауту пакетного вызова на каждый файл (сек)
+EXIFTOOL_BATCH_TIMEOUT_PER_FILE = 1.0
+
+
+def _default_spool_dir() -> Optional[str]:
+    # /dev/shm — tmpfs: файлы для ExifTool не попадают на overlay-диск контейнера
+    shm = "/dev/shm"
+    if os.path.isdir(shm) and os.access(shm, os.W_OK):
+        return shm
+    return None
+
+
+# Каталог для временных копий изображений, переданных байтами (нужны только ExifTool);
+# пусто — системный каталог временных файлов
+IMAGE_SPOOL_DIR = os.environ.get("IMAGE_SPOOL_DIR", "").strip() or _default_spool_dir()
+
 class ImageAnalyzer:
     """Анализатор метаданных изображений"""
     
     # Кэш для результатов проверки ExifTool (чтобы не проверять каждый раз)
     _exiftool_available: Optional[bool] = None
     _exiftool_command: Optional[str] = None
+    # Пул процессов ExifTool -stay_open, общий для всех экземпляров
+    _exiftool_pool: Optional[ExifToolPool] = None
+    _exiftool_pool_lock = threading.Lock()
     
     def __init__(self):
-        self.ai_software_keywords = [
-            "stable diffusion",
-            "midjourney",
-            "dall-e",
-            "dalle",
-            "dall·e",
-            "comfyui",
-            "comfy ui",
-            "automatic1111",
-            "automatic 1111",
-            "novelai",
-            "novel ai",
-            "leonardo",
-            "runway",
-            "sora",
-            "pika",
-            "generated",
-            "ai generated",
-            "artificial intelligence",
-            "ai art",
-            "neural network",
-            "deep learning",
-            "gan",
-            "vae",
-            "diffusion",
-            "latent diffusion",
-            "openai",
-            "open ai",
-            "stability ai",
-            "stabilityai",
-            "dreamstudio",
-            "dream studio",
-            "lexica",
-            "nightcafe",
-            "night cafe",
-            "artbreeder",
-            "art breeder",
-            "thispersondoesnotexist",
-            "this person does not exist",
-            "generated by",
-            "created with ai",
-            "ai tool",
-            "machine learning"
-        ]
+        # Общий словарь с AIDetector; поиск — через get_ai_keyword_matcher()
+        self.ai_software_keywords = AI_SOFTWARE_KEYWORDS
     
     def analyze(self, file_path: str) -> Dict[str, Any]:
         """
@@ -75,6 +64,110 @@ class ImageAnalyzer:
         Returns:
             Словарь с метаданными и результатами анализа
         """
+        # Единый проход по файлу: одно чтение, один вызов ExifTool, одно открытие через PIL
+        record = self._build_image_record(file_path)
+        return self._analyze_record(file_path, record)
+    
+    def analyze_many(
+        self,
+        file_paths: List[str],
+        max_workers: int = 1,
+        on_result: Optional[Callable[[int, Dict[str, Any], float], None]] = None,
+        contents: Optional[List[bytes]] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Пакетный анализ изображений: один вызов ExifTool на пачку файлов
+        вместо отдельного вызова на каждый файл
+        
+        Args:
+            file_paths: Пути к файлам изображений (при contents — только имена)
+            max_workers: Число потоков; при max_workers > 1 файлы делятся на части,
+                каждая часть обрабатывается своим процессом ExifTool, а разбор
+                результатов идет параллельно
+            on_result: Вызывается из рабочего потока по готовности каждого изображения:
+                on_result(индекс в file_paths, результат, время анализа в мс)
+            contents: Содержимое изображений в памяти (параллельно file_paths). PIL и exifread
+                читают буферы; на диск (IMAGE_SPOOL_DIR) изображения пишутся только для ExifTool,
+                которому в режиме -stay_open нужен путь: его stdin занят командами
+            
+        Returns:
+            Результаты analyze() в порядке file_paths; при ошибке анализа
+            изображения вместо результата возвращается {"error": ...}
+        """
+        spool_dir = None
+        tool_paths = list(file_paths)
+        exiftool_available = bool(file_paths) and self._check_exiftool_available()
+        if contents is not None and exiftool_available:
+            spool_dir = tempfile.mkdtemp(prefix="image_spool_", dir=IMAGE_SPOOL_DIR)
+            tool_paths = self._spool_contents(spool_dir, file_paths, contents)
+        try:
+            return self._analyze_many(file_paths, tool_paths, contents, exiftool_available, max_workers, on_result)
+        finally:
+            if spool_dir is not None:
+                shutil.rmtree(spool_dir, ignore_errors=True)
+    
+    @staticmethod
+    def _spool_contents(spool_dir: str, names: List[str], contents: List[bytes]) -> List[str]:
+        """Запись изображений из памяти во временный каталог (для ExifTool)"""
+        paths = []
+        for index, (name, data) in enumerate(zip(names, contents)):
+            # Индекс в имени: одинаковые имена из разных каталогов архива не перезаписывают друг друга
+            path = os.path.join(spool_dir, f"{index}_{os.path.basename(name)}")
+            with open(path, 'wb') as f:
+                f.write(data)
+            paths.append(path)
+        return paths
+    
+    def _analyze_many(
+        self,
+        file_paths: List[str],
+        tool_paths: List[str],
+        contents: Optional[List[bytes]],
+        exiftool_available: bool,
+        max_workers: int,
+        on_result: Optional[Callable[[int, Dict[str, Any], float], None]],
+    ) -> List[Dict[str, Any]]:
+        workers = max(1, min(max_workers, len(file_paths)))
+        exiftool_results: Dict[str, Dict[str, Any]] = {}
+        if exiftool_available:
+            if workers > 1:
+                chunk_size = -(-len(tool_paths) // workers)
+                chunks = [tool_paths[i:i + chunk_size] for i in range(0, len(tool_paths), chunk_size)]
+                with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="exiftool-batch") as pool:
+                    for part in pool.map(self._extract_many_with_exiftool, chunks):
+                        exiftool_results.update(part)
+            else:
+                exiftool_results = self._extract_many_with_exiftool(tool_paths)
+        
+        results: List[Optional[Dict[str, Any]]] = [None] * len(file_paths)
+        
+        def analyze_one(index: int) -> None:
+            file_path = tool_paths[index]
+            start = time.perf_counter()
+            try:
+                record = self._build_image_record(
+                    file_path,
+                    exiftool_data=exiftool_results.get(file_path),
+                    data=contents[index] if contents is not None else None,
+                )
+                metadata = self._analyze_record(file_path, record)
+            except Exception as e:
+                logger.warning(f"Ошибка анализа изображения {file_path}: {e}")
+                metadata = {"error": str(e)}
+            results[index] = metadata
+            if on_result is not None:
+                on_result(index, metadata, (time.perf_counter() - start) * 1000)
+        
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image-analysis") as pool:
+                list(pool.map(analyze_one, range(len(file_paths))))
+        else:
+            for index in range(len(file_paths)):
+                analyze_one(index)
+        return results
+    
+    def _analyze_record(self, file_path: str, record: Dict[str, Any]) -> Dict[str, Any]:
+        """Анализ изображения по уже прочитанной записи (_build_image_record)"""
         result = {
             "exif": {},
             "xmp": {},
@@ -89,15 +182,15 @@ class ImageAnalyzer:
         }
         
         # Извлечение EXIF данных
-        exif_data = self.extract_exif_data(file_path)
+        exif_data = self.extract_exif_data(file_path, record)
         result["exif"] = exif_data
         
         # Извлечение XMP данных
-        xmp_data = self.extract_xmp_data(file_path)
+        xmp_data = self.extract_xmp_data(file_path, record)
         result["xmp"] = xmp_data
         
         # Анализ характеристик изображения
-        image_chars = self.analyze_image_characteristics(file_path, exif_data)
+        image_chars = self.analyze_image_characteristics(file_path, exif_data, record)
         result["image_characteristics"] = image_chars
         
         # Проверка целостности метаданных
@@ -105,11 +198,98 @@ class ImageAnalyzer:
         result["metadata_integrity"] = integrity
         
         # Поиск упоминаний ИИ-инструментов
-        ai_software = self.detect_ai_software(exif_data, xmp_data)
+        ai_software_matches: List[Dict[str, str]] = []
+        ai_software = self.detect_ai_software(exif_data, xmp_data, matches=ai_software_matches)
         result["ai_software_detected"] = ai_software
+        # В каком поле найдено каждое ключевое слово
+        result["ai_software_matches"] = ai_software_matches
+        
+        # Перцептивные хеши — для поиска того же изображения в других документах
+        if PERCEPTUAL_HASH_ENABLED:
+            result["perceptual_hash"] = perceptual_hashes(record["data"]) if record.get("data") else None
         
         return result
     
+    def _build_image_record(
+        self,
+        file_path: str,
+        exiftool_data: Optional[Dict[str, Any]] = None,
+        data: Optional[bytes] = None,
+    ) -> Dict[str, Any]:
+        """
+        Единый этап чтения изображения, общий для всех этапов анализа
+        
+        Args:
+            file_path: Путь к файлу изображения
+            exiftool_data: Теги ExifTool, уже полученные пакетным вызовом (иначе ExifTool вызывается для файла)
+            data: Содержимое изображения, уже находящееся в памяти (файл не читается)
+        
+        Returns:
+            Словарь:
+            - path: путь к файлу
+            - data: содержимое файла (bytes) или None при ошибке чтения
+            - size: размер файла в байтах
+            - exiftool: сырые теги ExifTool (-j -G -a -u -n), словарь с '_exiftool_error' или None, если ExifTool недоступен
+            - header: формат и размеры из быстрого разбора заголовка (parse_image_header) или None
+            - pil: заголовок PIL (format, width, height, mode, info) или {'error': ...};
+              изображение открывается через PIL только при первом обращении
+        """
+        record = {"path": file_path, "data": data, "size": None, "exiftool": None, "header": None, "pil": {}}
+        if record["data"] is None:
+            try:
+                with open(file_path, 'rb') as f:
+                    record["data"] = f.read()
+            except OSError as e:
+                logger.error(f"Не удалось прочитать файл {file_path}: {e}")
+                record["pil"] = {"error": str(e)}
+                return record
+        record["size"] = len(record["data"])
+        
+        if exiftool_data is not None:
+            record["exiftool"] = exiftool_data
+        elif self._check_exiftool_available():
+            record["exiftool"] = self._extract_with_exiftool(file_path)
+        
+        # Текстовые чанки PNG нужны только fallback-методу, а их чтение требует декодирования всего файла
+        exiftool_ok = bool(record["exiftool"]) and '_exiftool_error' not in record["exiftool"]
+        data = record["data"]
+        record["header"] = parse_image_header(data)
+        record["pil"] = LazyPilHeader(lambda: self._read_pil_header(data, with_text=not exiftool_ok))
+        return record
+    
+    def _read_pil_header(self, data: bytes, with_text: bool = False) -> Dict[str, Any]:
+        """Открытие изображения через PIL (только заголовок, без декодирования пикселей)"""
+        try:
+            with Image.open(io.BytesIO(data)) as img:
+                header = {
+                    "format": img.format,
+                    "width": img.width,
+                    "height": img.height,
+                    "mode": img.mode,
+                    "info": dict(img.info),
+                }
+                if with_text and img.format == 'PNG' and hasattr(img, 'text'):
+                    header["text"] = dict(img.text or {})
+                logger.info(f"Изображение открыто через PIL: формат={img.format}, размер={img.size}, режим={img.mode}")
+                return header
+        except Exception as e:
+            logger.error(f"Ошибка открытия изображения через PIL: {e}")
+            return {"error": str(e)}
+    
+    @staticmethod
+    def _parsed_header(record: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Заголовок из быстрого разбора, если в нем есть img.info (PNG и JPEG).
+        None — поля нужно читать через PIL (record["pil"]).
+        """
+        header = record.get("header")
+        if header is None or "info" not in header:
+            return None
+        # Слишком большие изображения Image.open отвергает — эту ошибку сообщает PIL
+        if Image.MAX_IMAGE_PIXELS and header["width"] * header["height"] > 2 * Image.MAX_IMAGE_PIXELS:
+            return None
+        return header
+    
     def _get_exiftool_paths(self) -> List[str]:
         """Получение возможных путей к exiftool"""
         paths = []
@@ -391,6 +571,82 @@ class ImageAnalyzer:
         ImageAnalyzer._exiftool_command = 'exiftool'
         return 'exiftool'  # Fallback
     
+    def _get_exiftool_pool(self) -> ExifToolPool:
+        """Пул процессов ExifTool -stay_open (создаётся один раз на процесс)"""
+        if ImageAnalyzer._exiftool_pool is None:
+            with ImageAnalyzer._exiftool_pool_lock:
+                if ImageAnalyzer._exiftool_pool is None:
+                    exiftool_cmd = self._get_exiftool_command()
+                    # Для Windows с путями со скобками запускаем из директории ExifTool с относительным путем
+                    if platform.system() == 'Windows' and '(' in exiftool_cmd and ')' in exiftool_cmd:
+                        pool = ExifToolPool([os.path.basename(exiftool_cmd)], cwd=os.path.dirname(exiftool_cmd))
+                    else:
+                        pool = ExifToolPool([exiftool_cmd])
+                    logger.info(f"Создан пул ExifTool: {pool.size} процесс(ов), команда: {exiftool_cmd}")
+                    ImageAnalyzer._exiftool_pool = pool
+        return ImageAnalyzer._exiftool_pool
+
+    @classmethod
+    def shutdown_exiftool_pool(cls) -> None:
+        """Остановка процессов ExifTool (вызывается при завершении приложения)"""
+        with cls._exiftool_pool_lock:
+            if cls._exiftool_pool is not None:
+                cls._exiftool_pool.close()
+                cls._exiftool_pool = None
+
+    def _run_exiftool(self, args: List[str], timeout: float = EXIFTOOL_REQUEST_TIMEOUT) -> subprocess.CompletedProcess:
+        """Выполнение команды ExifTool на прогретом процессе пула; если пул не запускается — разовый запуск"""
+        try:
+            return self._get_exiftool_pool().run(args, timeout=timeout)
+        except OSError as e:
+            logger.warning(f"Не удалось запустить ExifTool в режиме -stay_open: {e}, используется разовый запуск")
+            return self._run_exiftool_once(args, timeout)
+
+    def _run_exiftool_once(self, args: List[str], timeout: float) -> subprocess.CompletedProcess:
+        """Разовый запуск ExifTool через subprocess.run"""
+        exiftool_cmd = self._get_exiftool_command()
+        # Для Windows с файлами, содержащими скобки, используем прямой запуск из директории
+        if platform.system() == 'Windows' and '(' in exiftool_cmd and ')' in exiftool_cmd:
+            logger.info(f"Выполнение команды ExifTool (путь со скобками): {exiftool_cmd}")
+            # Запускаем из директории ExifTool с относительным путем - это обходит проблемы со скобками
+            try:
+                exiftool_dir = os.path.dirname(exiftool_cmd)
+                exiftool_file = os.path.basename(exiftool_cmd)
+                logger.debug(f"Директория: {exiftool_dir}, файл: {exiftool_file}")
+                return subprocess.run(
+                    [exiftool_file, *args],
+                    capture_output=True,
+                    text=True,
+                    timeout=timeout,
+                    shell=False,
+                    cwd=exiftool_dir  # Запускаем из директории ExifTool
+                )
+            except subprocess.TimeoutExpired as e:
+                logger.error(f"Таймаут при выполнении ExifTool: {e}")
+                raise
+            except Exception as e:
+                logger.warning(f"Ошибка при прямом запуске: {e}, пробуем cmd.exe")
+                # Fallback на cmd.exe
+                try:
+                    return subprocess.run(
+                        ['cmd.exe', '/c', f'"{exiftool_cmd}"', *[a if a.startswith('-') else f'"{a}"' for a in args]],
+                        capture_output=True,
+                        text=True,
+                        timeout=timeout,
+                        shell=False
+                    )
+                except Exception as e2:
+                    logger.error(f"Ошибка при выполнении через cmd.exe: {e2}")
+                    raise
+        logger.debug(f"Выполнение команды: {[exiftool_cmd, *args]}")
+        return subprocess.run(
+            [exiftool_cmd, *args],
+            capture_output=True,
+            text=True,
+            timeout=timeout,
+            shell=False
+        )
+
     def _extract_with_exiftool(self, file_path: str) -> Dict[str, Any]:
         """Извлечение метаданных с помощью exiftool (самый мощный метод)"""
         exif_data = {}
@@ -409,62 +665,16 @@ class ImageAnalyzer:
             return exif_data
         
         try:
-            logger.debug(f"Запуск ExifTool: {exiftool_cmd} для файла: {file_path}")
-            
             # Использование exiftool для полного извлечения метаданных
             # -j: JSON формат
             # -G: Группировка по тегам (EXIF:, XMP:, IPTC:, CBOR:)
             # -a: Все теги, включая дубликаты
             # -u: Неизвестные теги
             # -n: Числовые значения (без форматирования)
-            # Уменьшен таймаут с 30 до 15 секунд для предотвращения зависаний
-            
-            logger.info(f"Начало извлечения метаданных через ExifTool (таймаут: 10 сек)")
-            logger.info(f"Команда: {exiftool_cmd}")
+            logger.info(f"Начало извлечения метаданных через ExifTool (таймаут: {EXIFTOOL_REQUEST_TIMEOUT:.0f} сек)")
             logger.info(f"Файл: {file_path}")
             
-            # Для Windows с файлами, содержащими скобки, используем прямой запуск из директории
-            if platform.system() == 'Windows' and '(' in exiftool_cmd and ')' in exiftool_cmd:
-                logger.info(f"Выполнение команды ExifTool (путь со скобками): {exiftool_cmd}")
-                # Запускаем из директории ExifTool с относительным путем - это обходит проблемы со скобками
-                try:
-                    exiftool_dir = os.path.dirname(exiftool_cmd)
-                    exiftool_file = os.path.basename(exiftool_cmd)
-                    logger.debug(f"Директория: {exiftool_dir}, файл: {exiftool_file}")
-                    result = subprocess.run(
-                        [exiftool_file, '-j', '-G', '-a', '-u', '-n', file_path],
-                        capture_output=True,
-                        text=True,
-                        timeout=15,
-                        shell=False,
-                        cwd=exiftool_dir  # Запускаем из директории ExifTool
-                    )
-                except subprocess.TimeoutExpired as e:
-                    logger.error(f"Таймаут при выполнении ExifTool: {e}")
-                    raise
-                except Exception as e:
-                    logger.warning(f"Ошибка при прямом запуске: {e}, пробуем cmd.exe")
-                    # Fallback на cmd.exe
-                    try:
-                        result = subprocess.run(
-                            ['cmd.exe', '/c', f'"{exiftool_cmd}"', '-j', '-G', '-a', '-u', '-n', f'"{file_path}"'],
-                            capture_output=True,
-                            text=True,
-                            timeout=15,
-                            shell=False
-                        )
-                    except Exception as e2:
-                        logger.error(f"Ошибка при выполнении через cmd.exe: {e2}")
-                        raise
-            else:
-                logger.debug(f"Выполнение команды: {[exiftool_cmd, '-j', '-G', '-a', '-u', '-n', file_path]}")
-                result = subprocess.run(
-                    [exiftool_cmd, '-j', '-G', '-a', '-u', '-n', file_path],
-                    capture_output=True,
-                    text=True,
-                    timeout=10,
-                    shell=False
-                )
+            result = self._run_exiftool(['-j', '-G', '-a', '-u', '-n', file_path])
             
             logger.debug(f"ExifTool завершился с кодом: {result.returncode}")
             
@@ -475,13 +685,8 @@ class ImageAnalyzer:
                         data = json.loads(result.stdout)
                         if data and len(data) > 0:
                             # exiftool возвращает список с одним словарем
-                            exif_data = data[0]
+                            exif_data = self._normalize_exiftool_entry(data[0])
                             logger.debug(f"ExifTool успешно извлек {len(exif_data)} полей метаданных")
-                            # Сохраняем версию ExifTool для отображения
-                            if 'ExifTool:ExifToolVersion' in exif_data:
-                                exif_data['ExifTool:Version'] = exif_data.pop('ExifTool:ExifToolVersion')
-                            # Удаляем служебные поля
-                            exif_data.pop('SourceFile', None)
                         else:
                             logger.warning("ExifTool вернул пустые данные")
                             exif_data['_exiftool_error'] = "Пустой ответ от ExifTool"
@@ -500,37 +705,93 @@ class ImageAnalyzer:
             logger.error(f"ExifTool не найден: {e}")
             exif_data['_exiftool_error'] = f"ExifTool не найден: {str(e)}"
         except subprocess.TimeoutExpired as e:
-            logger.error(f"Таймаут при выполнении ExifTool (превышен лимит 15 секунд): {e}")
-            exif_data['_exiftool_error'] = "Таймаут выполнения ExifTool (превышен лимит 15 секунд). Файл может быть слишком большим или поврежденным."
+            logger.error(f"Таймаут при выполнении ExifTool (превышен лимит {EXIFTOOL_REQUEST_TIMEOUT:.0f} секунд): {e}")
+            exif_data['_exiftool_error'] = f"Таймаут выполнения ExifTool (превышен лимит {EXIFTOOL_REQUEST_TIMEOUT:.0f} секунд). Файл может быть слишком большим или поврежденным."
         except json.JSONDecodeError as e:
             logger.error(f"Ошибка парсинга JSON: {e}")
             exif_data['_exiftool_error'] = f"Ошибка парсинга JSON: {str(e)}"
+        except ExifToolError as e:
+            logger.error(f"Процесс ExifTool не ответил: {e}")
+            exif_data['_exiftool_error'] = f"Ошибка exiftool: {str(e)}"
         except Exception as e:
             logger.error(f"Неожиданная ошибка ExifTool: {e}", exc_info=True)
             exif_data['_exiftool_error'] = f"Ошибка exiftool: {str(e)}"
         
         return exif_data
     
-    def extract_exif_data(self, file_path: str) -> Dict[str, Any]:
+    @staticmethod
+    def _normalize_exiftool_entry(entry: Dict[str, Any]) -> Dict[str, Any]:
+        """Приведение одного объекта из JSON-ответа ExifTool к формату анализатора"""
+        # Сохраняем версию ExifTool для отображения
+        if 'ExifTool:ExifToolVersion' in entry:
+            entry['ExifTool:Version'] = entry.pop('ExifTool:ExifToolVersion')
+        # Удаляем служебные поля
+        entry.pop('SourceFile', None)
+        return entry
+    
+    @staticmethod
+    def _exiftool_path_key(path: str) -> str:
+        # ExifTool возвращает SourceFile с прямыми слешами (в том числе на Windows)
+        return os.path.normcase(os.path.normpath(path))
+    
+    def _extract_many_with_exiftool(self, file_paths: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Извлечение метаданных пачки файлов одним вызовом ExifTool на EXIFTOOL_BATCH_SIZE файлов.
+        
+        Returns:
+            Словарь {путь: теги ExifTool или {'_exiftool_error': ...}}. Файлы пачки,
+            которая завершилась сбоем (таймаут, падение процесса), в словарь не попадают —
+            для них ExifTool будет вызван по отдельности.
+        """
+        results: Dict[str, Dict[str, Any]] = {}
+        exiftool_cmd = self._get_exiftool_command()
+        if exiftool_cmd == 'exiftool' and platform.system() == 'Windows':
+            logger.warning("Используется fallback команда 'exiftool', которая может не работать на Windows")
+            return results
+        
+        for start in range(0, len(file_paths), EXIFTOOL_BATCH_SIZE):
+            chunk = file_paths[start:start + EXIFTOOL_BATCH_SIZE]
+            timeout = EXIFTOOL_REQUEST_TIMEOUT + EXIFTOOL_BATCH_TIMEOUT_PER_FILE * len(chunk)
+            logger.info(f"Пакетное извлечение метаданных через ExifTool: {len(chunk)} файл(ов), таймаут {timeout:.0f} сек")
+            try:
+                result = self._run_exiftool(['-j', '-G', '-a', '-u', '-n', *chunk], timeout=timeout)
+                # При ошибке в одном из файлов ExifTool возвращает код 1, но JSON по остальным файлам валиден
+                data = json.loads(result.stdout) if result.stdout.strip() else []
+            except (subprocess.TimeoutExpired, ExifToolError, OSError, json.JSONDecodeError) as e:
+                logger.warning(f"Пакетный вызов ExifTool не удался ({e}), файлы будут обработаны по отдельности")
+                continue
+            
+            by_source = {}
+            for entry in data:
+                source = entry.get('SourceFile')
+                if source:
+                    by_source[self._exiftool_path_key(source)] = entry
+            
+            for file_path in chunk:
+                entry = by_source.get(self._exiftool_path_key(file_path))
+                if entry is not None:
+                    results[file_path] = self._normalize_exiftool_entry(entry)
+                else:
+                    stderr = result.stderr[:200] if result.stderr else 'нет сообщения об ошибке'
+                    results[file_path] = {'_exiftool_error': f"ExifTool ошибка (код {result.returncode}): {stderr}"}
+        
+        logger.info(f"ExifTool: метаданные получены для {len(results)} из {len(file_paths)} файлов")
+        return results
+    
+    def extract_exif_data(self, file_path: str, record: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """Извлечение EXIF данных из изображения (комбинированный подход)"""
         import time
         start_time = time.time()
         exif_data = {}
         
         logger.info(f"Начало извлечения EXIF данных из файла: {file_path}")
+        if record is None:
+            record = self._build_image_record(file_path)
         
-        # Сначала пробуем exiftool (самый мощный)
-        logger.info("Проверка доступности ExifTool перед извлечением...")
-        exiftool_available = self._check_exiftool_available()
-        logger.info(f"Результат проверки ExifTool: {'доступен' if exiftool_available else 'недоступен'}")
+        # Сначала пробуем exiftool (самый мощный); данные уже получены на этапе чтения
+        exiftool_data = record.get("exiftool")
         
-        if exiftool_available:
-            logger.info("ExifTool доступен, начинаю извлечение метаданных...")
-            exiftool_start = time.time()
-            exiftool_data = self._extract_with_exiftool(file_path)
-            exiftool_time = time.time() - exiftool_start
-            logger.info(f"ExifTool завершил извлечение за {exiftool_time:.2f} сек")
-            
+        if exiftool_data is not None:
             if exiftool_data:
                 if '_exiftool_error' in exiftool_data:
                     error_msg = exiftool_data['_exiftool_error']
@@ -566,147 +827,155 @@ class ImageAnalyzer:
         logger.info("Использование fallback метода (exifread/PIL)...")
         fallback_start = time.time()
         try:
-            # Использование exifread для чтения EXIF
-            with open(file_path, 'rb') as f:
-                tags = exifread.process_file(f, details=True)
-                
-                logger.info(f"Exifread извлек {len(tags)} тегов")
-                
-                # Создаем группированные метаданные для отображения
-                grouped_metadata = {
-                    'EXIF': [],
-                    'Image': [],
-                    'GPS': [],
-                    'Thumbnail': [],
-                    'Interoperability': [],
-                    'Other': []
-                }
-                
-                # Основные метаданные
-                if 'EXIF DateTimeOriginal' in tags:
-                    exif_data['date_time'] = str(tags['EXIF DateTimeOriginal'])
-                    grouped_metadata['EXIF'].append(['DateTimeOriginal', str(tags['EXIF DateTimeOriginal'])])
-                elif 'Image DateTime' in tags:
-                    exif_data['date_time'] = str(tags['Image DateTime'])
-                    grouped_metadata['Image'].append(['DateTime', str(tags['Image DateTime'])])
-                
-                if 'Image Make' in tags:
-                    exif_data['camera_make'] = str(tags['Image Make'])
-                    grouped_metadata['Image'].append(['Make', str(tags['Image Make'])])
-                if 'Image Model' in tags:
-                    exif_data['camera_model'] = str(tags['Image Model'])
-                    grouped_metadata['Image'].append(['Model', str(tags['Image Model'])])
-                
-                # GPS координаты
-                if 'GPS GPSLatitude' in tags and 'GPS GPSLongitude' in tags:
-                    try:
-                        lat = self._convert_to_degrees(tags['GPS GPSLatitude'])
-                        lon = self._convert_to_degrees(tags['GPS GPSLongitude'])
-                        if tags.get('GPS GPSLatitudeRef') == 'S':
-                            lat = -lat
-                        if tags.get('GPS GPSLongitudeRef') == 'W':
-                            lon = -lon
-                        exif_data['gps'] = {
-                            'latitude': lat,
-                            'longitude': lon
-                        }
-                        grouped_metadata['GPS'].append(['Latitude', str(lat)])
-                        grouped_metadata['GPS'].append(['Longitude', str(lon)])
-                    except Exception as e:
-                        logger.debug(f"Ошибка конвертации GPS: {e}")
-                
-                # Параметры съемки
-                if 'EXIF ISOSpeedRatings' in tags:
-                    exif_data['iso'] = str(tags['EXIF ISOSpeedRatings'])
-                    grouped_metadata['EXIF'].append(['ISO', str(tags['EXIF ISOSpeedRatings'])])
-                if 'EXIF ExposureTime' in tags:
-                    exif_data['exposure_time'] = str(tags['EXIF ExposureTime'])
-                    grouped_metadata['EXIF'].append(['ExposureTime', str(tags['EXIF ExposureTime'])])
-                if 'EXIF FNumber' in tags:
-                    exif_data['f_number'] = str(tags['EXIF FNumber'])
-                    grouped_metadata['EXIF'].append(['FNumber', str(tags['EXIF FNumber'])])
-                if 'EXIF FocalLength' in tags:
-                    exif_data['focal_length'] = str(tags['EXIF FocalLength'])
-                    grouped_metadata['EXIF'].append(['FocalLength', str(tags['EXIF FocalLength'])])
-                
-                # Software
-                if 'Image Software' in tags:
-                    exif_data['software'] = str(tags['Image Software'])
-                    grouped_metadata['Image'].append(['Software', str(tags['Image Software'])])
-                elif 'EXIF Software' in tags:
-                    exif_data['software'] = str(tags['EXIF Software'])
-                    grouped_metadata['EXIF'].append(['Software', str(tags['EXIF Software'])])
+            if record.get("data") is None:
+                raise OSError(record.get("pil", {}).get("error") or f"Файл не прочитан: {file_path}")
+            # Использование exifread для чтения EXIF (из уже прочитанного буфера)
+            tags = exifread.process_file(io.BytesIO(record["data"]), details=True)
+            
+            logger.info(f"Exifread извлек {len(tags)} тегов")
+            
+            # Создаем группированные метаданные для отображения
+            grouped_metadata = {
+                'EXIF': [],
+                'Image': [],
+                'GPS': [],
+                'Thumbnail': [],
+                'Interoperability': [],
+                'Other': []
+            }
+            
+            # Основные метаданные
+            if 'EXIF DateTimeOriginal' in tags:
+                exif_data['date_time'] = str(tags['EXIF DateTimeOriginal'])
+                grouped_metadata['EXIF'].append(['DateTimeOriginal', str(tags['EXIF DateTimeOriginal'])])
+            elif 'Image DateTime' in tags:
+                exif_data['date_time'] = str(tags['Image DateTime'])
+                grouped_metadata['Image'].append(['DateTime', str(tags['Image DateTime'])])
+            
+            if 'Image Make' in tags:
+                exif_data['camera_make'] = str(tags['Image Make'])
+                grouped_metadata['Image'].append(['Make', str(tags['Image Make'])])
+            if 'Image Model' in tags:
+                exif_data['camera_model'] = str(tags['Image Model'])
+                grouped_metadata['Image'].append(['Model', str(tags['Image Model'])])
+            
+            # GPS координаты
+            if 'GPS GPSLatitude' in tags and 'GPS GPSLongitude' in tags:
+                try:
+                    lat = self._convert_to_degrees(tags['GPS GPSLatitude'])
+                    lon = self._convert_to_degrees(tags['GPS GPSLongitude'])
+                    if tags.get('GPS GPSLatitudeRef') == 'S':
+                        lat = -lat
+                    if tags.get('GPS GPSLongitudeRef') == 'W':
+                        lon = -lon
+                    exif_data['gps'] = {
+                        'latitude': lat,
+                        'longitude': lon
+                    }
+                    grouped_metadata['GPS'].append(['Latitude', str(lat)])
+                    grouped_metadata['GPS'].append(['Longitude', str(lon)])
+                except Exception as e:
+                    logger.debug(f"Ошибка конвертации GPS: {e}")
+            
+            # Параметры съемки
+            if 'EXIF ISOSpeedRatings' in tags:
+                exif_data['iso'] = str(tags['EXIF ISOSpeedRatings'])
+                grouped_metadata['EXIF'].append(['ISO', str(tags['EXIF ISOSpeedRatings'])])
+            if 'EXIF ExposureTime' in tags:
+                exif_data['exposure_time'] = str(tags['EXIF ExposureTime'])
+                grouped_metadata['EXIF'].append(['ExposureTime', str(tags['EXIF ExposureTime'])])
+            if 'EXIF FNumber' in tags:
+                exif_data['f_number'] = str(tags['EXIF FNumber'])
+                grouped_metadata['EXIF'].append(['FNumber', str(tags['EXIF FNumber'])])
+            if 'EXIF FocalLength' in tags:
+                exif_data['focal_length'] = str(tags['EXIF FocalLength'])
+                grouped_metadata['EXIF'].append(['FocalLength', str(tags['EXIF FocalLength'])])
+            
+            # Software
+            if 'Image Software' in tags:
+                exif_data['software'] = str(tags['Image Software'])
+                grouped_metadata['Image'].append(['Software', str(tags['Image Software'])])
+            elif 'EXIF Software' in tags:
+                exif_data['software'] = str(tags['EXIF Software'])
+                grouped_metadata['EXIF'].append(['Software', str(tags['EXIF Software'])])
+            
+            # Размеры изображения
+            if 'EXIF ExifImageWidth' in tags:
+                exif_data['width'] = int(str(tags['EXIF ExifImageWidth']))
+                grouped_metadata['EXIF'].append(['ExifImageWidth', str(tags['EXIF ExifImageWidth'])])
+            if 'EXIF ExifImageLength' in tags:
+                exif_data['height'] = int(str(tags['EXIF ExifImageLength']))
+                grouped_metadata['EXIF'].append(['ExifImageLength', str(tags['EXIF ExifImageLength'])])
+            
+            # Добавляем все остальные теги в группированные метаданные
+            for tag_name, tag_value in tags.items():
+                tag_str = str(tag_name)
+                value_str = str(tag_value)
                 
-                # Размеры изображения
-                if 'EXIF ExifImageWidth' in tags:
-                    exif_data['width'] = int(str(tags['EXIF ExifImageWidth']))
-                    grouped_metadata['EXIF'].append(['ExifImageWidth', str(tags['EXIF ExifImageWidth'])])
-                if 'EXIF ExifImageLength' in tags:
-                    exif_data['height'] = int(str(tags['EXIF ExifImageLength']))
-                    grouped_metadata['EXIF'].append(['ExifImageLength', str(tags['EXIF ExifImageLength'])])
+                # Пропускаем уже обработанные теги
+                if tag_name in ['EXIF DateTimeOriginal', 'Image DateTime', 'Image Make', 'Image Model',
+                               'GPS GPSLatitude', 'GPS GPSLongitude', 'EXIF ISOSpeedRatings',
+                               'EXIF ExposureTime', 'EXIF FNumber', 'EXIF FocalLength',
+                               'Image Software', 'EXIF Software', 'EXIF ExifImageWidth', 'EXIF ExifImageLength']:
+                    continue
                 
-                # Добавляем все остальные теги в группированные метаданные
-                for tag_name, tag_value in tags.items():
-                    tag_str = str(tag_name)
-                    value_str = str(tag_value)
-                    
-                    # Пропускаем уже обработанные теги
-                    if tag_name in ['EXIF DateTimeOriginal', 'Image DateTime', 'Image Make', 'Image Model',
-                                   'GPS GPSLatitude', 'GPS GPSLongitude', 'EXIF ISOSpeedRatings',
-                                   'EXIF ExposureTime', 'EXIF FNumber', 'EXIF FocalLength',
-                                   'Image Software', 'EXIF Software', 'EXIF ExifImageWidth', 'EXIF ExifImageLength']:
-                        continue
-                    
-                    # Группируем по префиксу
-                    if tag_str.startswith('EXIF '):
-                        clean_name = tag_str.replace('EXIF ', '')
-                        grouped_metadata['EXIF'].append([clean_name, value_str])
-                    elif tag_str.startswith('Image '):
-                        clean_name = tag_str.replace('Image ', '')
-                        grouped_metadata['Image'].append([clean_name, value_str])
-                    elif tag_str.startswith('GPS '):
-                        clean_name = tag_str.replace('GPS ', '')
-                        grouped_metadata['GPS'].append([clean_name, value_str])
-                    elif tag_str.startswith('Thumbnail '):
-                        clean_name = tag_str.replace('Thumbnail ', '')
-                        grouped_metadata['Thumbnail'].append([clean_name, value_str])
-                    elif tag_str.startswith('Interoperability '):
-                        clean_name = tag_str.replace('Interoperability ', '')
-                        grouped_metadata['Interoperability'].append([clean_name, value_str])
+                # Группируем по префиксу
+                if tag_str.startswith('EXIF '):
+                    clean_name = tag_str.replace('EXIF ', '')
+                    grouped_metadata['EXIF'].append([clean_name, value_str])
+                elif tag_str.startswith('Image '):
+                    clean_name = tag_str.replace('Image ', '')
+                    grouped_metadata['Image'].append([clean_name, value_str])
+                elif tag_str.startswith('GPS '):
+                    clean_name = tag_str.replace('GPS ', '')
+                    grouped_metadata['GPS'].append([clean_name, value_str])
+                elif tag_str.startswith('Thumbnail '):
+                    clean_name = tag_str.replace('Thumbnail ', '')
+                    grouped_metadata['Thumbnail'].append([clean_name, value_str])
+                elif tag_str.startswith('Interoperability '):
+                    clean_name = tag_str.replace('Interoperability ', '')
+                    grouped_metadata['Interoperability'].append([clean_name, value_str])
+                else:
+                    grouped_metadata['Other'].append([tag_str, value_str])
+            
+            # Удаляем пустые секции
+            grouped_metadata = {k: v for k, v in grouped_metadata.items() if v}
+            
+            # Сохраняем группированные метаданные из exifread
+            if grouped_metadata:
+                if '_grouped_metadata' not in exif_data:
+                    exif_data['_grouped_metadata'] = {}
+                # Объединяем с уже существующими метаданными из PIL
+                for section, items in grouped_metadata.items():
+                    if section in exif_data['_grouped_metadata']:
+                        exif_data['_grouped_metadata'][section].extend(items)
                     else:
-                        grouped_metadata['Other'].append([tag_str, value_str])
+                        exif_data['_grouped_metadata'][section] = items
                 
-                # Удаляем пустые секции
-                grouped_metadata = {k: v for k, v in grouped_metadata.items() if v}
-                
-                # Сохраняем группированные метаданные из exifread
-                if grouped_metadata:
-                    if '_grouped_metadata' not in exif_data:
-                        exif_data['_grouped_metadata'] = {}
-                    # Объединяем с уже существующими метаданными из PIL
-                    for section, items in grouped_metadata.items():
-                        if section in exif_data['_grouped_metadata']:
-                            exif_data['_grouped_metadata'][section].extend(items)
-                        else:
-                            exif_data['_grouped_metadata'][section] = items
-                    
-                    total_fields = sum(len(v) for v in grouped_metadata.values())
-                    logger.info(f"Exifread добавил {len(grouped_metadata)} секций с {total_fields} полями метаданных")
-        
+                total_fields = sum(len(v) for v in grouped_metadata.values())
+                logger.info(f"Exifread добавил {len(grouped_metadata)} секций с {total_fields} полями метаданных")
+    
         except Exception as e:
             logger.error(f"Ошибка чтения EXIF через fallback метод: {str(e)}", exc_info=True)
             exif_data['error'] = f"Ошибка чтения EXIF: {str(e)}"
         
-        # Дополнительная проверка через PIL для извлечения всех доступных метаданных
-        try:
-            with Image.open(file_path) as img:
-                logger.info(f"Изображение открыто через PIL: формат={img.format}, размер={img.size}, режим={img.mode}")
+        # Дополнительная проверка через PIL для извлечения всех доступных метаданных.
+        # Поля берутся из разобранного заголовка; PIL открывается только за недостающими:
+        # img.info других форматов и текстовые чанки PNG (они могут идти после IDAT)
+        pil = self._parsed_header(record)
+        if pil is None or pil["format"] == 'PNG':
+            pil = record["pil"]
+        if pil.get("error"):
+            logger.error(f"Ошибка при дополнительной проверке через PIL: {pil['error']}")
+        else:
+            try:
+                info = pil.get("info") or {}
                 
                 # Базовые метаданные изображения
                 if 'width' not in exif_data:
-                    exif_data['width'] = img.width
+                    exif_data['width'] = pil["width"]
                 if 'height' not in exif_data:
-                    exif_data['height'] = img.height
+                    exif_data['height'] = pil["height"]
                 
                 # Добавляем в группированные метаданные
                 if '_grouped_metadata' not in exif_data:
@@ -714,21 +983,22 @@ class ImageAnalyzer:
                 if 'File' not in exif_data['_grouped_metadata']:
                     exif_data['_grouped_metadata']['File'] = []
                 
-                exif_data['_grouped_metadata']['File'].append(['Format', img.format or 'Unknown'])
-                exif_data['_grouped_metadata']['File'].append(['Width', str(img.width)])
-                exif_data['_grouped_metadata']['File'].append(['Height', str(img.height)])
-                exif_data['_grouped_metadata']['File'].append(['Mode', img.mode])
+                exif_data['_grouped_metadata']['File'].append(['Format', pil.get("format") or 'Unknown'])
+                exif_data['_grouped_metadata']['File'].append(['Width', str(pil["width"])])
+                exif_data['_grouped_metadata']['File'].append(['Height', str(pil["height"])])
+                exif_data['_grouped_metadata']['File'].append(['Mode', pil["mode"]])
                 
                 # Для PNG файлов извлекаем метаданные из chunks
-                if img.format == 'PNG':
+                if pil.get("format") == 'PNG':
                     logger.info("Обработка PNG файла - извлечение chunks метаданных")
                     if 'PNG' not in exif_data['_grouped_metadata']:
                         exif_data['_grouped_metadata']['PNG'] = []
                     
                     # PNG chunks доступны через img.text (для tEXt chunks)
-                    if hasattr(img, 'text') and img.text:
-                        logger.info(f"Найдены PNG text chunks: {len(img.text)} элементов")
-                        for key, value in img.text.items():
+                    text_chunks = pil.get("text") or {}
+                    if text_chunks:
+                        logger.info(f"Найдены PNG text chunks: {len(text_chunks)} элементов")
+                        for key, value in text_chunks.items():
                             exif_data['_grouped_metadata']['PNG'].append([f'tEXt:{key}', str(value)])
                             # Проверяем на XMP данные
                             if 'xmp' in key.lower() or 'xml' in key.lower():
@@ -737,11 +1007,11 @@ class ImageAnalyzer:
                                 exif_data['_grouped_metadata']['XMP'].append([key, str(value)[:500]])  # Ограничиваем длину
                     
                     # Проверяем img.info на наличие PNG-specific метаданных
-                    if img.info:
+                    if info:
                         png_info_keys = ['transparency', 'gamma', 'chroma', 'icc_profile', 'dpi', 'compression']
                         for key in png_info_keys:
-                            if key in img.info:
-                                value = img.info[key]
+                            if key in info:
+                                value = info[key]
                                 if isinstance(value, bytes):
                                     if key == 'icc_profile':
                                         exif_data['_grouped_metadata']['PNG'].append([key, f"<ICC profile {len(value)} bytes>"])
@@ -751,7 +1021,7 @@ class ImageAnalyzer:
                                     exif_data['_grouped_metadata']['PNG'].append([key, str(value)])
                 
                 # EXIF данные через PIL
-                exif_bytes = img.info.get('exif', None)
+                exif_bytes = info.get('exif', None)
                 logger.info(f"EXIF данные в img.info: {'найдены' if exif_bytes else 'отсутствуют'}")
                 
                 if exif_bytes:
@@ -782,41 +1052,23 @@ class ImageAnalyzer:
                                 
                                 if tag_count > 0:
                                     logger.info(f"Добавлено {tag_count} тегов в секцию {section_name}")
+                        
                     except Exception as e:
                         logger.error(f"Ошибка загрузки EXIF через piexif: {e}", exc_info=True)
-                
-                # Также пробуем через _getexif для старых версий PIL
-                elif hasattr(img, '_getexif') and img._getexif() is not None:
-                    logger.info("Найдены EXIF данные через PIL._getexif (старый метод)")
+                    
+                    # Software из EXIF
                     try:
-                        exif_dict = piexif.load(img.info.get('exif', b''))
-                        if exif_dict:
-                            # Обрабатываем все секции EXIF
-                            for ifd_name in ['0th', 'Exif', 'GPS', 'Interop', '1st', 'thumbnail']:
-                                if ifd_name in exif_dict and exif_dict[ifd_name]:
-                                    section_name = ifd_name.upper() if ifd_name != '0th' else 'Image'
-                                    if section_name not in exif_data['_grouped_metadata']:
-                                        exif_data['_grouped_metadata'][section_name] = []
-                                    
-                                    for tag_id, tag_value in exif_dict[ifd_name].items():
-                                        try:
-                                            tag_name = TAGS.get(tag_id, f"Tag_{tag_id}")
-                                            if isinstance(tag_value, bytes):
-                                                try:
-                                                    tag_value = tag_value.decode('utf-8', errors='ignore')
-                                                except:
-                                                    tag_value = f"<binary data {len(tag_value)} bytes>"
-                                            exif_data['_grouped_metadata'][section_name].append([tag_name, str(tag_value)])
-                                        except Exception as e:
-                                            logger.debug(f"Ошибка обработки тега {tag_id}: {e}")
-                    except Exception as e:
-                        logger.error(f"Ошибка обработки EXIF через _getexif: {e}", exc_info=True)
+                        exif_dict = piexif.load(exif_bytes)
+                        if piexif.ImageIFD.Software in exif_dict.get('0th', {}) and 'software' not in exif_data:
+                            exif_data['software'] = exif_dict['0th'][piexif.ImageIFD.Software].decode('utf-8')
+                    except:
+                        pass
                 
                 # Дополнительные метаданные из img.info
-                if img.info:
+                if info:
                     if 'Image' not in exif_data['_grouped_metadata']:
                         exif_data['_grouped_metadata']['Image'] = []
-                    for key, value in img.info.items():
+                    for key, value in info.items():
                         if key not in ['exif', 'icc_profile']:  # Пропускаем бинарные данные
                             try:
                                 if isinstance(value, bytes):
@@ -824,20 +1076,8 @@ class ImageAnalyzer:
                                 exif_data['_grouped_metadata']['Image'].append([key, str(value)])
                             except Exception as e:
                                 logger.debug(f"Ошибка обработки info.{key}: {e}")
-                
-                # Software из EXIF
-                if hasattr(img, '_getexif') and img._getexif() is not None:
-                    try:
-                        exif_dict = piexif.load(img.info.get('exif', b''))
-                        if exif_dict and '0th' in exif_dict:
-                            if piexif.ImageIFD.Software in exif_dict['0th']:
-                                software = exif_dict['0th'][piexif.ImageIFD.Software].decode('utf-8')
-                                if 'software' not in exif_data:
-                                    exif_data['software'] = software
-                    except:
-                        pass
-        except Exception as e:
-            logger.error(f"Ошибка при дополнительной проверке через PIL: {e}", exc_info=True)
+            except Exception as e:
+                logger.error(f"Ошибка при дополнительной проверке через PIL: {e}", exc_info=True)
         
         fallback_time = time.time() - fallback_start
         
@@ -1132,74 +1372,44 @@ class ImageAnalyzer:
         
         return converted
     
-    def extract_xmp_data(self, file_path: str) -> Dict[str, Any]:
+    def extract_xmp_data(self, file_path: str, record: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """Извлечение XMP/IPTC данных (улучшенная версия)"""
         xmp_data = {}
+        if record is None:
+            record = self._build_image_record(file_path)
         
-        # Сначала пробуем exiftool для более полного извлечения
-        if self._check_exiftool_available():
-            exiftool_cmd = self._get_exiftool_command()
-            try:
-                result = subprocess.run(
-                    [exiftool_cmd, '-XMP:All', '-IPTC:All', '-j', file_path],
-                    capture_output=True,
-                    text=True,
-                    timeout=30
-                )
-                
-                if result.returncode == 0 and result.stdout:
-                    data = json.loads(result.stdout)
-                    if data and len(data) > 0:
-                        exiftool_data = data[0]
-                        
-                        # Извлекаем XMP поля
-                        xmp_fields = {}
-                        for key, value in exiftool_data.items():
-                            if key.startswith('XMP:'):
-                                clean_key = key.replace('XMP:', '').replace(':', '_')
-                                xmp_fields[clean_key] = str(value)
-                        
-                        if xmp_fields:
-                            xmp_data.update(xmp_fields)
-                        
-                        # Извлекаем IPTC поля
-                        iptc_fields = {}
-                        for key, value in exiftool_data.items():
-                            if key.startswith('IPTC:'):
-                                clean_key = key.replace('IPTC:', '').replace(':', '_')
-                                iptc_fields[clean_key] = str(value)
-                        
-                        if iptc_fields:
-                            xmp_data['iptc'] = iptc_fields
-            except Exception:
-                pass  # Fallback на PIL
+        # Поля ExifTool сюда не попадают: раньше отдельный вызов -XMP:All -IPTC:All -j
+        # (без -G) не давал ключей с префиксами XMP:/IPTC:, и вклад ExifTool был пустым.
+        # Сохраняем прежний результат (has_xmp, metadata_removed и оценки от них зависят);
+        # сгруппированные XMP/IPTC-теги ExifTool доступны в exif["_grouped_metadata"].
         
-        # Fallback на PIL для базового извлечения
-        try:
-            with Image.open(file_path) as img:
-                # XMP данные обычно хранятся в img.info
-                if 'xmp' in img.info:
-                    if 'raw_xmp' not in xmp_data:
-                        xmp_data['raw_xmp'] = img.info['xmp']
-                
-                # IPTC данные
-                if 'iptc' in img.info:
-                    if 'iptc' not in xmp_data:
-                        xmp_data['iptc'] = img.info['iptc']
-                
-                # Дополнительные метаданные из img.info
-                for key, value in img.info.items():
-                    if key not in ['xmp', 'iptc', 'exif'] and key not in xmp_data:
-                        # Добавляем другие метаданные
-                        if isinstance(value, (str, int, float)):
-                            xmp_data[f'info_{key}'] = str(value)
-        except Exception as e:
+        # Fallback на PIL для базового извлечения; img.info PNG и JPEG уже есть в разобранном заголовке
+        pil = self._parsed_header(record) or record["pil"]
+        if pil.get("error"):
             if not xmp_data:
-                xmp_data['error'] = f"Ошибка чтения XMP: {str(e)}"
+                xmp_data['error'] = f"Ошибка чтения XMP: {pil['error']}"
+        else:
+            info = pil.get("info") or {}
+            # XMP данные обычно хранятся в img.info
+            if 'xmp' in info:
+                if 'raw_xmp' not in xmp_data:
+                    xmp_data['raw_xmp'] = info['xmp']
+            
+            # IPTC данные
+            if 'iptc' in info:
+                if 'iptc' not in xmp_data:
+                    xmp_data['iptc'] = info['iptc']
+            
+            # Дополнительные метаданные из img.info
+            for key, value in info.items():
+                if key not in ['xmp', 'iptc', 'exif'] and key not in xmp_data:
+                    # Добавляем другие метаданные
+                    if isinstance(value, (str, int, float)):
+                        xmp_data[f'info_{key}'] = str(value)
         
         return xmp_data
     
-    def analyze_image_characteristics(self, file_path: str, exif_data: Dict) -> Dict[str, Any]:
+    def analyze_image_characteristics(self, file_path: str, exif_data: Dict, record: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """Анализ характеристик изображения для выявления признаков ИИ"""
         characteristics = {
             "width": None,
@@ -1215,49 +1425,55 @@ class ImageAnalyzer:
             "supports_exif": True
         }
         
+        if record is None:
+            record = self._build_image_record(file_path)
+        # Формат и размеры — из заголовка; PIL открывается, только если заголовок не разобран
+        header = record.get("header") or record.get("pil") or {}
+        
         try:
-            with Image.open(file_path) as img:
-                width, height = img.size
-                characteristics["width"] = width
-                characteristics["height"] = height
-                # Формат файла и поддержка EXIF (PNG/GIF не хранят EXIF как JPEG)
-                fmt = (img.format or "").upper()
-                characteristics["file_format"] = fmt or None
-                characteristics["supports_exif"] = fmt not in ("PNG", "GIF", "BMP", "WEBP")
-                
-                # Соотношение сторон
-                if height > 0:
-                    aspect_ratio = width / height
-                    characteristics["aspect_ratio"] = round(aspect_ratio, 2)
-                    
-                    # Квадратное изображение - частый признак ИИ
-                    if abs(aspect_ratio - 1.0) < 0.01:
-                        characteristics["is_square"] = True
-                
-                # Стандартные размеры для ИИ-генераторов
-                standard_ai_sizes = [
-                    (512, 512), (768, 768), (1024, 1024), (512, 768), (768, 512),
-                    (1024, 1024), (1152, 896), (896, 1152), (1344, 768), (768, 1344),
-                    (1536, 640), (640, 1536), (1024, 1792), (1792, 1024)
-                ]
-                
-                if (width, height) in standard_ai_sizes or (height, width) in standard_ai_sizes:
-                    characteristics["is_standard_ai_size"] = True
-                    characteristics["suspicious_features"].append(f"Стандартный размер ИИ-генератора: {width}x{height}")
-                
-                # Проверка наличия GPS
-                if 'gps' in exif_data:
-                    characteristics["has_gps"] = True
-                
-                # Проверка наличия информации о камере
-                if 'camera_make' in exif_data or 'camera_model' in exif_data:
-                    characteristics["has_camera_info"] = True
+            if header.get("error"):
+                raise ValueError(header["error"])
+            width, height = header["width"], header["height"]
+            characteristics["width"] = width
+            characteristics["height"] = height
+            # Формат файла и поддержка EXIF (PNG/GIF не хранят EXIF как JPEG)
+            fmt = (header.get("format") or "").upper()
+            characteristics["file_format"] = fmt or None
+            characteristics["supports_exif"] = fmt not in ("PNG", "GIF", "BMP", "WEBP")
+            
+            # Соотношение сторон
+            if height > 0:
+                aspect_ratio = width / height
+                characteristics["aspect_ratio"] = round(aspect_ratio, 2)
                 
-                # Проверка параметров съемки
-                shooting_params = ['iso', 'exposure_time', 'f_number', 'focal_length']
-                if any(param in exif_data for param in shooting_params):
-                    characteristics["has_shooting_params"] = True
-        
+                # Квадратное изображение - частый признак ИИ
+                if abs(aspect_ratio - 1.0) < 0.01:
+                    characteristics["is_square"] = True
+            
+            # Стандартные размеры для ИИ-генераторов
+            standard_ai_sizes = [
+                (512, 512), (768, 768), (1024, 1024), (512, 768), (768, 512),
+                (1024, 1024), (1152, 896), (896, 1152), (1344, 768), (768, 1344),
+                (1536, 640), (640, 1536), (1024, 1792), (1792, 1024)
+            ]
+            
+            if (width, height) in standard_ai_sizes or (height, width) in standard_ai_sizes:
+                characteristics["is_standard_ai_size"] = True
+                characteristics["suspicious_features"].append(f"Стандартный размер ИИ-генератора: {width}x{height}")
+            
+            # Проверка наличия GPS
+            if 'gps' in exif_data:
+                characteristics["has_gps"] = True
+            
+            # Проверка наличия информации о камере
+            if 'camera_make' in exif_data or 'camera_model' in exif_data:
+                characteristics["has_camera_info"] = True
+            
+            # Проверка параметров съемки
+            shooting_params = ['iso', 'exposure_time', 'f_number', 'focal_length']
+            if any(param in exif_data for param in shooting_params):
+                characteristics["has_shooting_params"] = True
+    
         except Exception as e:
             characteristics["error"] = str(e)
         
@@ -1294,9 +1510,22 @@ class ImageAnalyzer:
         
         return integrity
     
-    def detect_ai_software(self, exif_data: Dict, xmp_data: Dict) -> List[str]:
-        """Поиск упоминаний ИИ-инструментов в метаданных"""
+    def detect_ai_software(
+        self,
+        exif_data: Dict,
+        xmp_data: Dict,
+        matches: Optional[List[Dict[str, str]]] = None,
+    ) -> List[str]:
+        """
+        Поиск упоминаний ИИ-инструментов в метаданных
+
+        Args:
+            matches: если передан, сюда добавляются совпадения
+                {"keyword": слово, "field": поле метаданных}
+        """
         detected = []
+        matcher = get_ai_keyword_matcher()
+        hits: List[Dict[str, str]] = []
         
         # Проверка C2PA метаданных (самый надежный способ детекции ИИ!)
         if '_c2pa_metadata' in exif_data:
@@ -1323,41 +1552,35 @@ class ImageAnalyzer:
             detected.extend(exif_data['_c2pa_indicators'])
         
         # Поиск в EXIF Software
-        if 'software' in exif_data:
-            software_lower = exif_data['software'].lower()
-            for keyword in self.ai_software_keywords:
-                if keyword.lower() in software_lower:
-                    # Сохраняем оригинальное значение, но также добавляем найденный ключ
-                    if exif_data['software'] not in detected:
-                        detected.append(exif_data['software'])
-                    # Добавляем найденный ключ для более точной идентификации
-                    if keyword not in detected:
-                        detected.append(keyword.title())
-        
-        # Поиск в XMP данных (более тщательный поиск)
+        software = exif_data.get('software')
+        if isinstance(software, str):
+            software_hits = matcher.scan([('software', software)])
+            if software_hits:
+                # Сохраняем оригинальное значение, но также добавляем найденные ключи
+                detected.append(software)
+                hits.extend(software_hits)
+        
+        # Поиск в XMP данных (весь пакет XMP просматривается за один проход)
         if 'raw_xmp' in xmp_data:
-            xmp_str = str(xmp_data['raw_xmp']).lower()
-            for keyword in self.ai_software_keywords:
-                if keyword.lower() in xmp_str:
-                    if keyword.title() not in detected:
-                        detected.append(keyword.title())
+            hits.extend(matcher.scan([('raw_xmp', str(xmp_data['raw_xmp']))]))
         
         # Поиск в других полях EXIF
         for key, value in exif_data.items():
-            if isinstance(value, str):
-                value_lower = value.lower()
+            if isinstance(value, str) and key != 'software':
                 # Проверяем на C2PA поля
                 if 'c2pa' in key.lower() or 'cbor' in key.lower():
+                    value_lower = value.lower()
                     if any(kw in value_lower for kw in ['gpt', 'chatgpt', 'dall', 'midjourney', 'stable diffusion']):
                         detected.append(f"Найдено в {key}: {value}")
                 
                 # Общий поиск по ключевым словам
-                for keyword in self.ai_software_keywords:
-                    if keyword.lower() in value_lower:
-                        if keyword.title() not in detected:
-                            detected.append(keyword.title())
+                hits.extend(matcher.scan([(key, value)]))
+        
+        detected.extend(hit['keyword'].title() for hit in hits)
+        if matches is not None:
+            matches.extend(hits)
         
-        return list(set(detected))  # Удаление дубликатов
+        return list(dict.fromkeys(detected))  # Удаление дубликатов с сохранением порядка
     
     def _convert_to_degrees(self, value) -> float:
         """Конвертация GPS координат в градусы"""
@@ -0,0 +1,269 @@
+"""
+Индекс перцептивных хешей уже проанализированных изображений (SQLite).
+
+Поиск почти одинаковых изображений — multi-index hashing: 64-битный pHash
+делится на 4 части по 16 бит, каждая часть хранится в отдельной
+индексированной строке таблицы. Если расстояние Хэмминга между хешами не
+больше IMAGE_HASH_MAX_DISTANCE, то хотя бы одна часть отличается не больше
+чем на IMAGE_HASH_MAX_DISTANCE // 4 бит (принцип Дирихле), поэтому кандидаты
+находятся точными запросами по индексу для немногих соседних значений части,
+без перебора всей таблицы; затем расстояние проверяется по обоим хешам.
+
+Для каждого изображения хранятся вердикт первого анализа (вероятность ИИ,
+уверенность) и документы, в которых оно встречалось: ответ говорит, в скольких
+документах изображение уже попадалось, без повторного анализа этих документов.
+
+Без IMAGE_HASH_INDEX_DB индекс живет в памяти процесса.
+"""
+import itertools
+import os
+import sqlite3
+import threading
+import time
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Путь к SQLite-базе индекса; пусто — индекс в памяти процесса
+IMAGE_HASH_INDEX_DB = os.environ.get("IMAGE_HASH_INDEX_DB", "").strip()
+# Наибольшее расстояние Хэмминга (по pHash и по dHash), при котором изображения считаются одинаковыми
+IMAGE_HASH_MAX_DISTANCE = max(0, int(os.environ.get("IMAGE_HASH_MAX_DISTANCE", "6")))
+# Сколько изображений хранится в индексе; сверх этого удаляются самые давно встречавшиеся
+IMAGE_HASH_INDEX_MAX_IMAGES = max(1, int(os.environ.get("IMAGE_HASH_INDEX_MAX_IMAGES", "200000")))
+
+_BANDS = 4
+_BAND_BITS = 16
+_BAND_MASK = (1 << _BAND_BITS) - 1
+_HASH_MASK = (1 << 64) - 1
+# Сколько совпадений возвращается для одного изображения (ближайшие)
+MAX_MATCHES = 5
+
+
+def _signed(value: int) -> int:
+    """64-битный хеш как знаковое целое SQLite"""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _distance(first: int, second: int) -> int:
+    """Расстояние Хэмминга (second — знаковое значение из SQLite)"""
+    return bin(first ^ (second & _HASH_MASK)).count("1")
+
+
+def _bands(value: int) -> List[int]:
+    return [(value >> (band * _BAND_BITS)) & _BAND_MASK for band in range(_BANDS)]
+
+
+def _neighbors(value: int, radius: int) -> List[int]:
+    """Все 16-битные значения на расстоянии Хэмминга не больше radius"""
+    result = [value]
+    for distance in range(1, radius + 1):
+        for bits in itertools.combinations(range(_BAND_BITS), distance):
+            flipped = value
+            for bit in bits:
+                flipped ^= 1 << bit
+            result.append(flipped)
+    return result
+
+
+class ImageHashIndex:
+    """Индекс почти одинаковых изображений по pHash/dHash с документами, где они встречались."""
+
+    def __init__(
+        self,
+        db_path: Optional[str] = IMAGE_HASH_INDEX_DB or None,
+        max_distance: int = IMAGE_HASH_MAX_DISTANCE,
+        max_images: int = IMAGE_HASH_INDEX_MAX_IMAGES,
+    ):
+        self.max_distance = max_distance
+        self.max_images = max_images
+        self._band_radius = max_distance // _BANDS
+        self._lock = threading.Lock()
+        self._db = self._open_db(db_path)
+
+    @staticmethod
+    def _open_db(db_path: Optional[str]) -> sqlite3.Connection:
+        if db_path:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+                db = sqlite3.connect(db_path, check_same_thread=False, timeout=10)
+                db.execute("PRAGMA journal_mode=WAL")
+                ImageHashIndex._create_schema(db)
+                return db
+            except sqlite3.Error as e:
+                logger.warning("Индекс хешей изображений на диске недоступен (%s), используется память: %s", db_path, e)
+        db = sqlite3.connect(":memory:", check_same_thread=False)
+        ImageHashIndex._create_schema(db)
+        return db
+
+    @staticmethod
+    def _create_schema(db: sqlite3.Connection) -> None:
+        db.executescript(
+            "CREATE TABLE IF NOT EXISTS images ("
+            " id INTEGER PRIMARY KEY, sha256 TEXT NOT NULL UNIQUE, phash INTEGER NOT NULL, dhash INTEGER NOT NULL,"
+            " ai_probability INTEGER NOT NULL, confidence TEXT NOT NULL, seen REAL NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS images_seen ON images (seen);"
+            "CREATE TABLE IF NOT EXISTS image_bands ("
+            " band INTEGER NOT NULL, value INTEGER NOT NULL, image_id INTEGER NOT NULL,"
+            " PRIMARY KEY (band, value, image_id)) WITHOUT ROWID;"
+            "CREATE INDEX IF NOT EXISTS image_bands_image ON image_bands (image_id);"
+            "CREATE TABLE IF NOT EXISTS image_documents ("
+            " image_id INTEGER NOT NULL, document TEXT NOT NULL, seen REAL NOT NULL,"
+            " PRIMARY KEY (image_id, document)) WITHOUT ROWID;"
+        )
+        db.commit()
+
+    def _candidates(self, phash: int) -> Set[int]:
+        candidates: Set[int] = set()
+        for band, value in enumerate(_bands(phash)):
+            values = _neighbors(value, self._band_radius)
+            rows = self._db.execute(
+                f"SELECT image_id FROM image_bands WHERE band = ? AND value IN ({','.join('?' * len(values))})",
+                (band, *values),
+            )
+            candidates.update(image_id for (image_id,) in rows)
+        return candidates
+
+    def _documents(self, image_ids: Sequence[int], exclude_document: Optional[str]) -> Dict[int, Set[str]]:
+        documents: Dict[int, Set[str]] = {image_id: set() for image_id in image_ids}
+        for start in range(0, len(image_ids), 500):
+            part = image_ids[start:start + 500]
+            rows = self._db.execute(
+                f"SELECT image_id, document FROM image_documents WHERE image_id IN ({','.join('?' * len(part))})",
+                part,
+            )
+            for image_id, document in rows:
+                if document != exclude_document:
+                    documents[image_id].add(document)
+        return documents
+
+    def lookup(
+        self,
+        hashes: Sequence[Optional[Dict[str, str]]],
+        exclude_document: Optional[str] = None,
+    ) -> Tuple[List[Optional[Dict[str, Any]]], int]:
+        """
+        Почти одинаковые изображения из других документов.
+
+        Args:
+            hashes: перцептивные хеши изображений документа ({"phash", "dhash"} или None)
+            exclude_document: документ, который сейчас анализируется (его записи не считаются)
+
+        Returns:
+            (для каждого изображения {"documents": N, "max_ai_probability", "matches": [...]} или None,
+             число разных документов, где встречалось хотя бы одно изображение)
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(hashes)
+        all_documents: Set[str] = set()
+        with self._lock:
+            for index, hashes_entry in enumerate(hashes):
+                if not hashes_entry:
+                    continue
+                phash, dhash = int(hashes_entry["phash"], 16), int(hashes_entry["dhash"], 16)
+                candidates = sorted(self._candidates(phash))
+                matches = []
+                for start in range(0, len(candidates), 500):
+                    part = candidates[start:start + 500]
+                    rows = self._db.execute(
+                        "SELECT id, sha256, phash, dhash, ai_probability, confidence FROM images"
+                        f" WHERE id IN ({','.join('?' * len(part))})",
+                        part,
+                    )
+                    for image_id, sha256, other_phash, other_dhash, ai_probability, confidence in rows:
+                        distance = _distance(phash, other_phash)
+                        dhash_distance = _distance(dhash, other_dhash)
+                        if distance <= self.max_distance and dhash_distance <= self.max_distance:
+                            matches.append((distance + dhash_distance, image_id, sha256, ai_probability, confidence))
+                if not matches:
+                    continue
+                documents = self._documents([match[1] for match in matches], exclude_document)
+                seen_in = set().union(*documents.values())
+                if not seen_in:
+                    continue
+                all_documents |= seen_in
+                matches = [match for match in matches if documents[match[1]]]
+                matches.sort(key=lambda match: (match[0], -match[3]))
+                results[index] = {
+                    "documents": len(seen_in),
+                    "max_ai_probability": max(match[3] for match in matches),
+                    "matches": [
+                        {
+                            "sha256": sha256,
+                            "distance": distance,
+                            "documents": len(documents[image_id]),
+                            "ai_probability": ai_probability,
+                            "confidence": confidence,
+                        }
+                        for distance, image_id, sha256, ai_probability, confidence in matches[:MAX_MATCHES]
+                    ],
+                }
+        return results, len(all_documents)
+
+    def add(self, document: str, images: Iterable[Tuple[str, Dict[str, str], int, str]]) -> None:
+        """
+        Запоминает изображения документа.
+
+        Args:
+            document: идентификатор документа (SHA-256 файла)
+            images: (sha256 изображения, {"phash", "dhash"}, вероятность ИИ, уверенность)
+        """
+        now = time.time()
+        with self._lock:
+            try:
+                for sha256, hashes_entry, ai_probability, confidence in images:
+                    phash = int(hashes_entry["phash"], 16)
+                    row = self._db.execute("SELECT id FROM images WHERE sha256 = ?", (sha256,)).fetchone()
+                    if row is None:
+                        image_id = self._db.execute(
+                            "INSERT INTO images (sha256, phash, dhash, ai_probability, confidence, seen)"
+                            " VALUES (?, ?, ?, ?, ?, ?)",
+                            (sha256, _signed(phash), _signed(int(hashes_entry["dhash"], 16)),
+                             ai_probability, confidence, now),
+                        ).lastrowid
+                        self._db.executemany(
+                            "INSERT INTO image_bands (band, value, image_id) VALUES (?, ?, ?)",
+                            [(band, value, image_id) for band, value in enumerate(_bands(phash))],
+                        )
+                    else:
+                        image_id = row[0]
+                        self._db.execute(
+                            "UPDATE images SET ai_probability = ?, confidence = ?, seen = ? WHERE id = ?",
+                            (ai_probability, confidence, now, image_id),
+                        )
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO image_documents (image_id, document, seen) VALUES (?, ?, ?)",
+                        (image_id, document, now),
+                    )
+                self._evict()
+                self._db.commit()
+            except sqlite3.Error as e:
+                self._db.rollback()
+                logger.warning("Ошибка записи в индекс хешей изображений: %s", e)
+
+    def _evict(self) -> None:
+        excess = self._db.execute("SELECT COUNT(*) FROM images").fetchone()[0] - self.max_images
+        if excess <= 0:
+            return
+        # Удаляются изображения, которые дольше всего не встречались
+        stale = [row[0] for row in self._db.execute("SELECT id FROM images ORDER BY seen LIMIT ?", (excess,))]
+        for table, column in (("image_bands", "image_id"), ("image_documents", "image_id"), ("images", "id")):
+            self._db.executemany(f"DELETE FROM {table} WHERE {column} = ?", [(image_id,) for image_id in stale])
+
+    def clear(self) -> None:
+        with self._lock:
+            self._db.executescript("DELETE FROM image_bands; DELETE FROM image_documents; DELETE FROM images;")
+            self._db.commit()
+
+
+_image_hash_index: Optional[ImageHashIndex] = None
+_image_hash_index_lock = threading.Lock()
+
+
+def get_image_hash_index() -> ImageHashIndex:
+    """Общий для процесса индекс (создается при первом обращении)"""
+    global _image_hash_index
+    if _image_hash_index is None:
+        with _image_hash_index_lock:
+            if _image_hash_index is None:
+                _image_hash_index = ImageHashIndex()
+    return _image_hash_index
@@ -0,0 +1,505 @@
+"""
+Быстрый разбор заголовков изображений без PIL.
+
+Для характеристик изображения (формат, размеры) достаточно нескольких байт
+заголовка: PNG IHDR, JPEG SOFn, логический экран GIF, BITMAPINFOHEADER BMP,
+IFD0 TIFF. Для PNG и JPEG разбираются и чанки/маркеры до данных изображения —
+из них собирается img.info так же, как это делают PngImagePlugin и
+JpegImagePlugin. Image.open для этого не нужен; PIL открывается лениво
+(LazyPilHeader) только там, где нужна более глубокая информация (img.info
+остальных форматов, текстовые чанки PNG после IDAT).
+
+Формат и размеры совпадают с тем, что вернул бы PIL; режим (mode) заполняется
+только там, где он однозначно следует из заголовка, иначе — None. Поле info
+есть только у файлов, разобранных полностью: при любой неоднозначности
+(поврежденный чанк, APNG, неизвестный маркер) его нет и img.info читает PIL.
+"""
+import re
+import struct
+import zlib
+from collections.abc import Mapping
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+# (глубина цвета, тип цвета) IHDR -> режим PIL
+_PNG_MODES = {
+    (1, 0): "1", (2, 0): "L", (4, 0): "L", (8, 0): "L", (16, 0): "I;16",
+    (8, 2): "RGB", (16, 2): "RGB",
+    (1, 3): "P", (2, 3): "P", (4, 3): "P", (8, 3): "P",
+    (8, 4): "LA", (16, 4): "RGBA",
+    (8, 6): "RGBA", (16, 6): "RGBA",
+}
+_JPEG_MODES = {1: "L", 3: "RGB", 4: "CMYK"}
+# SOF0..SOF15, кроме DHT (C4), JPG (C8) и DAC (CC)
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# Маркеры без длины: TEM, RSTn
+_JPEG_STANDALONE_MARKERS = {0x01, *range(0xD0, 0xD8)}
+# Маркеры, сегменты которых PIL пропускает: DHT, DAC, DNL, DRI, EXP
+_JPEG_SKIPPED_MARKERS = {0xC4, 0xCC, 0xDC, 0xDD, 0xDF}
+# SOFn прогрессивного сжатия
+_JPEG_PROGRESSIVE_MARKERS = {0xC2, 0xC6, 0xCA, 0xCE}
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# Чанки APNG: кадры анимации PIL разбирает отдельно
+_APNG_CHUNKS = {b"acTL", b"fcTL", b"fdAT"}
+_PNG_CHUNK_TYPE = re.compile(rb"\w\w\w\w")
+_PNG_SIMPLE_PALETTE = re.compile(b"^\xff*\x00\xff*$")
+# Пределы текстовых чанков, как PngImagePlugin.MAX_TEXT_CHUNK и MAX_TEXT_MEMORY
+_PNG_MAX_TEXT_CHUNK = 1024 * 1024
+_PNG_MAX_TEXT_MEMORY = 64 * _PNG_MAX_TEXT_CHUNK
+_XMP_PREFIX = b"http://ns.adobe.com/xap/1.0/\x00"
+
+
+class _Unsupported(Exception):
+    """Файл нельзя разобрать так же, как PIL: img.info нужно читать через PIL"""
+
+
+def _header(fmt: str, width: int, height: int, mode: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    if width <= 0 or height <= 0:
+        return None
+    return {"format": fmt, "width": width, "height": height, "mode": mode}
+
+
+def _with_info(header: Optional[Dict[str, Any]], parse: Callable[..., Dict[str, Any]], *args: Any) -> Optional[Dict[str, Any]]:
+    """Добавление img.info к заголовку, если файл разобран так же, как его разобрал бы PIL"""
+    if header is not None and header["mode"] is not None:
+        try:
+            header["info"] = parse(*args)
+        except (_Unsupported, struct.error, IndexError):
+            pass
+    return header
+
+
+def _u16(data: bytes, offset: int = 0) -> int:
+    return struct.unpack_from(">H", data, offset)[0]
+
+
+def _u32(data: bytes, offset: int = 0) -> int:
+    return struct.unpack_from(">I", data, offset)[0]
+
+
+def _png_decompress(data: bytes) -> bytes:
+    """Распаковка сжатого чанка с тем же пределом, что у PIL"""
+    decompressor = zlib.decompressobj()
+    plain = decompressor.decompress(data, _PNG_MAX_TEXT_CHUNK)
+    if decompressor.unconsumed_tail:
+        raise _Unsupported("сжатый чанк больше предела PIL")
+    return plain
+
+
+def _png_itxt(chunk: bytes, info: Dict[str, Any]) -> int:
+    """Чанк iTXt; возвращает длину текста, учитываемую в пределе памяти"""
+    key, separator, rest = chunk.partition(b"\0")
+    if not separator or len(rest) < 2:
+        return 0
+    compressed, method, rest = rest[0], rest[1], rest[2:]
+    parts = rest.split(b"\0", 2)
+    if len(parts) < 3:
+        return 0
+    lang, translated_key, value = parts
+    if compressed:
+        if method != 0:
+            return 0
+        try:
+            value = _png_decompress(value)
+        except zlib.error:
+            return 0
+    if key == b"XML:com.adobe.xmp":
+        info["xmp"] = value
+    try:
+        lang.decode("utf-8")
+        translated_key.decode("utf-8")
+        text = value.decode("utf-8")
+    except UnicodeError:
+        return 0
+    info[key.decode("latin-1")] = text
+    return len(text)
+
+
+def _png_info(data: bytes, mode: str) -> Dict[str, Any]:
+    """img.info PNG по чанкам до первого IDAT (как PngStream)"""
+    info: Dict[str, Any] = {}
+    text_memory = 0
+    pos = 8
+    while True:
+        if pos + 8 > len(data):
+            raise _Unsupported("нет IDAT")
+        length, chunk_type = struct.unpack(">I4s", data[pos:pos + 8])
+        if not _PNG_CHUNK_TYPE.match(chunk_type) or chunk_type in _APNG_CHUNKS:
+            raise _Unsupported(f"чанк {chunk_type!r}")
+        if chunk_type in (b"IDAT", b"IEND"):
+            return info
+        start, end = pos + 8, pos + 8 + length
+        chunk = bytes(data[start:end])
+        crc = bytes(data[end:end + 4])
+        if len(chunk) < length or len(crc) < 4 or _u32(crc) != zlib.crc32(chunk, zlib.crc32(chunk_type)):
+            raise _Unsupported(f"поврежденный чанк {chunk_type!r}")
+        pos = end + 4
+
+        if chunk_type == b"IHDR":
+            if start != 16 or length < 13 or chunk[11]:
+                raise _Unsupported("IHDR")
+            if chunk[12]:
+                info["interlace"] = 1
+        elif chunk_type == b"tRNS":
+            if mode == "P":
+                if _PNG_SIMPLE_PALETTE.match(chunk):
+                    index = chunk.find(b"\0")
+                    if index >= 0:
+                        info["transparency"] = index
+                else:
+                    info["transparency"] = chunk
+            elif mode == "1":
+                info["transparency"] = 255 if _u16(chunk) else 0
+            elif mode in ("L", "I;16"):
+                info["transparency"] = _u16(chunk)
+            elif mode == "RGB":
+                info["transparency"] = _u16(chunk), _u16(chunk, 2), _u16(chunk, 4)
+        elif chunk_type == b"gAMA":
+            info["gamma"] = _u32(chunk) / 100000.0
+        elif chunk_type == b"cHRM":
+            values = struct.unpack(f">{len(chunk) // 4}I", chunk)
+            info["chromaticity"] = tuple(value / 100000.0 for value in values)
+        elif chunk_type == b"sRGB":
+            info["srgb"] = chunk[0]
+        elif chunk_type == b"pHYs":
+            if length < 9:
+                raise _Unsupported("pHYs")
+            x, y = struct.unpack_from(">II", chunk)
+            if chunk[8] == 1:
+                info["dpi"] = x * 0.0254, y * 0.0254
+            elif chunk[8] == 0:
+                info["aspect"] = x, y
+        elif chunk_type == b"tEXt":
+            key, _, value = chunk.partition(b"\0")
+            if key:
+                text = value.decode("latin-1", "replace")
+                info[key.decode("latin-1")] = value if key == b"exif" else text
+                text_memory += len(text)
+        elif chunk_type == b"zTXt":
+            key, _, value = chunk.partition(b"\0")
+            if value and value[0] != 0:
+                raise _Unsupported("zTXt")
+            try:
+                value = _png_decompress(value[1:])
+            except zlib.error:
+                value = b""
+            if key:
+                text = value.decode("latin-1", "replace")
+                info[key.decode("latin-1")] = text
+                text_memory += len(text)
+        elif chunk_type == b"iTXt":
+            text_memory += _png_itxt(chunk, info)
+        elif chunk_type == b"iCCP":
+            separator = chunk.find(b"\0")
+            if chunk[separator + 1] != 0:
+                raise _Unsupported("iCCP")
+            try:
+                info["icc_profile"] = _png_decompress(chunk[separator + 2:])
+            except zlib.error:
+                info["icc_profile"] = None
+        elif chunk_type == b"eXIf":
+            info["exif"] = b"Exif\x00\x00" + chunk
+        if text_memory > _PNG_MAX_TEXT_MEMORY:
+            raise _Unsupported("текстовые чанки больше предела PIL")
+
+
+def _parse_png(data: bytes) -> Optional[Dict[str, Any]]:
+    if len(data) < 29 or data[:8] != _PNG_SIGNATURE or data[12:16] != b"IHDR":
+        return None
+    width, height, bits, color_type = struct.unpack(">IIBB", data[16:26])
+    header = _header("PNG", width, height, _PNG_MODES.get((bits, color_type)))
+    return _with_info(header, _png_info, data, header and header["mode"])
+
+
+def _parse_gif(data: bytes) -> Optional[Dict[str, Any]]:
+    if len(data) < 10:
+        return None
+    width, height = struct.unpack("<HH", data[6:10])
+    return _header("GIF", width, height)
+
+
+def _parse_bmp(data: bytes) -> Optional[Dict[str, Any]]:
+    if len(data) < 26:
+        return None
+    dib_size = struct.unpack("<I", data[14:18])[0]
+    if dib_size == 12:
+        width, height = struct.unpack("<HH", data[18:22])
+    elif dib_size >= 40:
+        width, height = struct.unpack("<ii", data[18:26])
+        # Отрицательная высота — строки хранятся сверху вниз
+        height = abs(height)
+    else:
+        return None
+    return _header("BMP", width, height)
+
+
+def _parse_jpeg(data: bytes) -> Optional[Dict[str, Any]]:
+    pos = 2
+    size = len(data)
+    while pos + 4 <= size:
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            # Байты-заполнители перед маркером
+            pos += 1
+            continue
+        if marker in _JPEG_STANDALONE_MARKERS:
+            pos += 2
+            continue
+        if marker in (0xD9, 0xDA):
+            # Конец изображения или начало данных скана до SOF
+            return None
+        length = struct.unpack(">H", data[pos + 2:pos + 4])[0]
+        if marker == 0xE2 and data[pos + 4:pos + 8] == b"MPF\x00":
+            # Multi-Picture (MPO): PIL определяет такой файл как отдельный формат
+            return None
+        if marker in _JPEG_SOF_MARKERS:
+            if pos + 10 > size:
+                return None
+            height, width, components = struct.unpack(">HHB", data[pos + 5:pos + 10])
+            return _with_info(_header("JPEG", width, height, _JPEG_MODES.get(components)), _jpeg_info, data)
+        pos += 2 + length
+    return None
+
+
+def _photoshop_resources(segment: bytes, photoshop: Dict[int, Any]) -> None:
+    """Ресурсы Photoshop из APP13"""
+    offset = 14
+    try:
+        while segment[offset:offset + 4] == b"8BIM":
+            code = _u16(segment, offset + 4)
+            offset += 6
+            offset += 1 + segment[offset]
+            offset += offset & 1
+            size = _u32(segment, offset)
+            offset += 4
+            block = segment[offset:offset + size]
+            if code == 0x03ED:
+                # ResolutionInfo
+                photoshop[code] = {
+                    "XResolution": _u32(block, 0) / 65536,
+                    "DisplayedUnitsX": _u16(block, 4),
+                    "YResolution": _u32(block, 8) / 65536,
+                    "DisplayedUnitsY": _u16(block, 12),
+                }
+            else:
+                photoshop[code] = block
+            offset += size
+            offset += offset & 1
+    except struct.error:
+        pass
+
+
+def _jpeg_app(marker: int, segment: bytes, info: Dict[str, Any], icc: List[bytes]) -> None:
+    """Сегмент APPn: те же ключи img.info, что у JpegImagePlugin"""
+    if marker == 0xE0 and segment.startswith(b"JFIF"):
+        info["jfif"] = version = _u16(segment, 5)
+        info["jfif_version"] = divmod(version, 256)
+        if len(segment) >= 12:
+            unit, density = segment[7], (_u16(segment, 8), _u16(segment, 10))
+            if unit == 1:
+                info["dpi"] = density
+            elif unit == 2:
+                # Точки на сантиметр
+                info["dpi"] = tuple(d * 2.54 for d in density)
+            info["jfif_unit"] = unit
+            info["jfif_density"] = density
+    elif marker == 0xE1 and segment.startswith(b"Exif\0\0"):
+        if "exif" in info:
+            info["exif"] += segment[6:]
+        else:
+            info["exif"] = segment
+    elif marker == 0xE1 and segment.startswith(_XMP_PREFIX):
+        info["xmp"] = segment.split(b"\0", 1)[1]
+    elif marker == 0xE2 and segment.startswith(b"FPXR\0"):
+        info["flashpix"] = segment
+    elif marker == 0xE2 and segment.startswith(b"ICC_PROFILE\0"):
+        icc.append(segment)
+    elif marker == 0xE2 and segment.startswith(b"MPF\0"):
+        # Multi-Picture (MPO): PIL определяет такой файл как отдельный формат
+        raise _Unsupported("MPF")
+    elif marker == 0xED and segment.startswith(b"Photoshop 3.0\0"):
+        _photoshop_resources(segment, info.setdefault("photoshop", {}))
+    elif marker == 0xEE and segment.startswith(b"Adobe"):
+        info["adobe"] = _u16(segment, 5)
+        if len(segment) > 11:
+            info["adobe_transform"] = segment[11]
+
+
+def _exif_dpi(exif: bytes) -> Tuple[float, float]:
+    """dpi из XResolution/ResolutionUnit IFD0 (как JpegImagePlugin при отсутствии JFIF)"""
+    tiff = exif[6:]
+    if tiff[:4] == b"II*\x00":
+        endian = "<"
+    elif tiff[:4] == b"MM\x00*":
+        endian = ">"
+    else:
+        raise _Unsupported("EXIF без заголовка TIFF")
+    ifd_offset = struct.unpack_from(endian + "I", tiff, 4)[0]
+    count = struct.unpack_from(endian + "H", tiff, ifd_offset)[0]
+    entries = {}
+    for i in range(count):
+        tag, field_type, values = struct.unpack_from(endian + "HHI", tiff, ifd_offset + 2 + i * 12)
+        entries[tag] = (field_type, values, ifd_offset + 10 + i * 12)
+    if 0x0128 not in entries or 0x011A not in entries:
+        return 72, 72
+    (unit_type, unit_count, unit_at), (x_type, x_count, x_at) = entries[0x0128], entries[0x011A]
+    # SHORT и RATIONAL по одному значению; иное PIL трактует по-своему
+    if (unit_type, unit_count, x_type, x_count) != (3, 1, 5, 1):
+        raise _Unsupported("нестандартные теги разрешения")
+    unit = struct.unpack_from(endian + "H", tiff, unit_at)[0]
+    numerator, denominator = struct.unpack_from(endian + "II", tiff, struct.unpack_from(endian + "I", tiff, x_at)[0])
+    if denominator == 0:
+        raise _Unsupported("XResolution с нулевым знаменателем")
+    dpi = numerator / denominator
+    if unit == 3:
+        # Точки на сантиметр
+        dpi *= 2.54
+    return dpi, dpi
+
+
+def _jpeg_info(data: bytes) -> Dict[str, Any]:
+    """img.info JPEG по маркерам до SOS (как JpegImageFile._open)"""
+    info: Dict[str, Any] = {}
+    icc: List[bytes] = []
+    frames = 0
+    pos = 2
+    while True:
+        if data[pos] != 0xFF:
+            # Мусор между сегментами PIL пропускает
+            pos += 1
+            continue
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if marker == 0x00:
+            pos += 2
+            continue
+        if marker < 0xC0 or marker in (0xC8, 0xD8, 0xD9) or 0xD0 <= marker <= 0xD7 or 0xF0 <= marker <= 0xFD:
+            raise _Unsupported(f"маркер {marker:#x} до SOS")
+        length = _u16(data, pos + 2)
+        segment = bytes(data[pos + 4:pos + 2 + length])
+        if length < 2 or len(segment) < length - 2:
+            raise _Unsupported("обрезанный сегмент")
+        pos += 2 + length
+
+        if marker == 0xDA:
+            break
+        if marker in _JPEG_SKIPPED_MARKERS:
+            continue
+        if marker == 0xDB:
+            # Таблицы квантования: PIL отвергает обрезанные
+            while segment:
+                table_length = 65 if segment[0] // 16 == 0 else 129
+                if len(segment) < table_length:
+                    raise _Unsupported("DQT")
+                segment = segment[table_length:]
+        elif marker == 0xFE:
+            info["comment"] = segment
+        elif marker >= 0xE0:
+            _jpeg_app(marker, segment, info, icc)
+        else:
+            # SOFn и DHP: размеры по первому кадру, как в parse_image_header
+            frames += 1
+            if frames > 1 or segment[0] != 8 or segment[5] not in _JPEG_MODES or (len(segment) - 6) % 3:
+                raise _Unsupported("кадр, который PIL разбирает иначе")
+            if marker in _JPEG_PROGRESSIVE_MARKERS:
+                info["progressive"] = info["progression"] = 1
+            if icc:
+                # Профиль ICC разбит на сегменты APP2 с порядковыми номерами
+                icc.sort()
+                info["icc_profile"] = b"".join(part[14:] for part in icc) if icc[0][13] == len(icc) else None
+                icc.clear()
+    if "dpi" not in info and "exif" in info:
+        info["dpi"] = _exif_dpi(info["exif"])
+    return info
+
+
+def _parse_tiff(data: bytes) -> Optional[Dict[str, Any]]:
+    endian = "<" if data[:2] == b"II" else ">"
+    if len(data) < 8 or struct.unpack(endian + "H", data[2:4])[0] != 42:
+        return None
+    ifd_offset = struct.unpack(endian + "I", data[4:8])[0]
+    if ifd_offset + 2 > len(data):
+        return None
+    count = struct.unpack(endian + "H", data[ifd_offset:ifd_offset + 2])[0]
+    width = height = None
+    for i in range(count):
+        entry = ifd_offset + 2 + i * 12
+        if entry + 12 > len(data):
+            return None
+        tag, field_type = struct.unpack(endian + "HH", data[entry:entry + 4])
+        if tag not in (256, 257):
+            continue
+        # SHORT (3) или LONG (4), значение лежит прямо в записи
+        if field_type == 3:
+            value = struct.unpack(endian + "H", data[entry + 8:entry + 10])[0]
+        elif field_type == 4:
+            value = struct.unpack(endian + "I", data[entry + 8:entry + 12])[0]
+        else:
+            return None
+        if tag == 256:
+            width = value
+        else:
+            height = value
+    if width is None or height is None:
+        return None
+    return _header("TIFF", width, height)
+
+
+def parse_image_header(data: bytes) -> Optional[Dict[str, Any]]:
+    """
+    Формат и размеры изображения по заголовку.
+
+    Returns:
+        {"format", "width", "height", "mode"} (для полностью разобранных PNG и JPEG
+        еще "info", как img.info PIL) или None, если формат не поддерживается
+        или заголовок поврежден (тогда нужен PIL)
+    """
+    if not data:
+        return None
+    head = bytes(data[:4])
+    try:
+        if head == b"\x89PNG":
+            return _parse_png(data)
+        if head[:3] == b"\xff\xd8\xff":
+            return _parse_jpeg(data)
+        if head[:3] == b"GIF":
+            return _parse_gif(data)
+        if head[:2] == b"BM":
+            return _parse_bmp(data)
+        if head in (b"II*\x00", b"MM\x00*"):
+            return _parse_tiff(data)
+    except struct.error:
+        return None
+    return None
+
+
+class LazyPilHeader(Mapping):
+    """
+    Заголовок PIL (format, width, height, mode, info, text или error), который
+    читается при первом обращении к любому ключу.
+    """
+
+    def __init__(self, loader: Callable[[], Dict[str, Any]]):
+        self._loader = loader
+        self._header: Optional[Dict[str, Any]] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._header is not None
+
+    def _load(self) -> Dict[str, Any]:
+        if self._header is None:
+            self._header = self._loader()
+        return self._header
+
+    def __getitem__(self, key: str) -> Any:
+        return self._load()[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._load())
+
+    def __len__(self) -> int:
+        return len(self._load())
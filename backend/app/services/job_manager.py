@@ -0,0 +1,192 @@
+"""
+Фоновые задачи анализа документов (асинхронный режим API).
+
+POST /api/jobs сразу возвращает идентификатор задачи, а анализ выполняется
+в пуле analysis_executor — том же, что и у POST /api/analyze/document, с теми
+же ANALYSIS_EXECUTOR, ANALYSIS_MAX_WORKERS и ANALYSIS_MAX_PENDING. Клиент
+опрашивает статус и прогресс, затем забирает результат. Задачи хранятся в
+памяти процесса и удаляются через JOB_TTL секунд после завершения.
+
+На события задачи можно подписаться (Job.subscribe) — так работает потоковая
+выдача результатов по мере анализа изображений.
+"""
+import os
+import threading
+import time
+import uuid
+import logging
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.services.task_executor import BoundedExecutor, analysis_executor
+
+logger = logging.getLogger(__name__)
+
+# Сколько секунд хранится завершённая задача
+JOB_TTL = max(60, int(os.environ.get("JOB_TTL", "3600")))
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+
+class Job:
+    """Состояние одной задачи анализа."""
+
+    def __init__(self, job_id: str, file_name: str):
+        self.id = job_id
+        self.file_name = file_name
+        self.status = JOB_QUEUED
+        self.stage = JOB_QUEUED
+        self.images_done = 0
+        self.images_total: Optional[int] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result: Optional[Dict[str, Any]] = None
+        self.report_filename: Optional[str] = None
+        self.error: Optional[str] = None
+        # HTTP-код, с которым отдается ошибка задачи (400 — некорректный документ)
+        self.error_status = 500
+        self._listeners: List[Callable[[str, Dict[str, Any]], None]] = []
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (JOB_DONE, JOB_FAILED)
+
+    def set_stage(self, stage: str) -> None:
+        self.stage = stage
+
+    def set_progress(self, done: int, total: int) -> None:
+        self.images_done = done
+        self.images_total = total
+
+    def subscribe(self, listener: Callable[[str, Dict[str, Any]], None]) -> None:
+        """listener(событие, данные) вызывается из рабочего потока задачи"""
+        self._listeners.append(listener)
+
+    def unsubscribe(self, listener: Callable[[str, Dict[str, Any]], None]) -> None:
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def notify(self, event: str, payload: Dict[str, Any]) -> None:
+        for listener in list(self._listeners):
+            try:
+                listener(event, payload)
+            except Exception as e:
+                # Ошибка подписчика (например, клиент отключился) не должна прерывать анализ
+                logger.debug("Подписчик задачи %s: %s", self.id, e)
+
+
+class JobManager:
+    """
+    Реестр задач анализа; сами задачи выполняются в общем пуле анализа.
+
+    Задача — функция func(job, *args), выполняемая в пуле; через job она сообщает
+    этап и прогресс. finalize(результат func) выполняется в этом процессе и
+    возвращает (ответ API, имя PDF-отчёта).
+    """
+
+    def __init__(self, executor: BoundedExecutor = analysis_executor, ttl: int = JOB_TTL):
+        self.executor = executor
+        self.ttl = ttl
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def _purge_expired(self) -> None:
+        now = time.time()
+        expired = [job_id for job_id, job in self._jobs.items() if job.finished and now - job.finished_at > self.ttl]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def create(self, file_name: str) -> Job:
+        """Регистрация новой задачи"""
+        with self._lock:
+            self._purge_expired()
+            job = Job(uuid.uuid4().hex, file_name)
+            self._jobs[job.id] = job
+        return job
+
+    def _finish(self, job: Job, status: str, result: Optional[Tuple[Dict[str, Any], str]] = None) -> None:
+        # finished_at — раньше статуса и под блокировкой: уборка не видит завершенную задачу
+        # со временем начала вместо времени завершения
+        with self._lock:
+            job.finished_at = time.time()
+            if job.started_at is None:
+                job.started_at = job.finished_at
+            if result is not None:
+                job.result, job.report_filename = result
+                job.stage = JOB_DONE
+            job.status = status
+        job.notify(status, {})
+
+    def complete(self, job: Job, result: Dict[str, Any], report_filename: str) -> None:
+        """Сразу завершенная задача (например, ответ найден в кэше)"""
+        self._finish(job, JOB_DONE, (result, report_filename))
+
+    def submit(
+        self,
+        job: Job,
+        func: Callable[..., Any],
+        *args: Any,
+        finalize: Callable[[Any], Tuple[Dict[str, Any], str]],
+        on_finish: Optional[Callable[[], None]] = None,
+    ) -> None:
+        """
+        Постановка задачи в пул. Объект задачи в другой процесс не передать: в пуле
+        процессов выполняется func(None, *args) — без этапов и прогресса, задача
+        считается выполняемой с момента постановки. on_finish вызывается после
+        завершения (освобождение ресурсов).
+
+        Raises:
+            ExecutorBusyError: пул анализа заполнен; задача удаляется
+        """
+        try:
+            if self.executor.kind == "process":
+                future = self.executor.submit(func, None, *args)
+                with self._lock:
+                    job.status, job.started_at = JOB_RUNNING, time.time()
+            else:
+                future = self.executor.submit(self._run, job, func, args)
+        except BaseException:
+            with self._lock:
+                self._jobs.pop(job.id, None)
+            raise
+        future.add_done_callback(lambda done: self._complete_future(job, done, finalize, on_finish))
+
+    def _run(self, job: Job, func: Callable[..., Any], args: tuple) -> Any:
+        with self._lock:
+            job.status, job.started_at = JOB_RUNNING, time.time()
+        return func(job, *args)
+
+    def _complete_future(
+        self,
+        job: Job,
+        future: Future,
+        finalize: Callable[[Any], Tuple[Dict[str, Any], str]],
+        on_finish: Optional[Callable[[], None]],
+    ) -> None:
+        try:
+            result = finalize(future.result())
+        except ValueError as e:
+            job.error, job.error_status = str(e), 400
+            result = None
+        except BaseException as e:
+            # В т.ч. отмена задачи при остановке пула
+            logger.error("Ошибка задачи %s: %s", job.id, e, exc_info=not future.cancelled())
+            job.error = f"Ошибка анализа документа: {e!s}"
+            result = None
+        finally:
+            if on_finish is not None:
+                on_finish()
+        self._finish(job, JOB_DONE if result is not None else JOB_FAILED, result)
+        logger.info("Задача %s: %s за %.2f сек", job.id, job.status, job.finished_at - job.started_at)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            self._purge_expired()
+            return self._jobs.get(job_id)
+
+
+job_manager = JobManager()
@@ -0,0 +1,125 @@
+"""
+Перцептивные хеши изображений (pHash, dHash) для поиска почти одинаковых картинок.
+
+В отличие от SHA-256, хеш почти не меняется при пересжатии, изменении размера
+и небольшой цветокоррекции: близость изображений — расстояние Хэмминга между
+64-битными хешами.
+
+- dHash: уменьшенная до 9×8 яркость, бит — «следующий пиксель строки ярче»;
+- pHash: DCT уменьшенной до 32×32 яркости, бит — «низкочастотный коэффициент
+  8×8 больше медианы».
+
+Хеши считаются на PIL без NumPy; JPEG декодируется сразу в уменьшенном масштабе
+(draft), большие PNG/TIFF — полосами (band_reader), остальные форматы больше
+PIXEL_ANALYSIS_MAX_PIXELS не хешируются.
+"""
+import io
+import math
+import os
+import logging
+import statistics
+from typing import Dict, List, Optional
+
+from PIL import Image
+
+from app.services.band_reader import open_band_reader
+from app.services.image_header import parse_image_header
+from app.services.pixel_forensics import PIXEL_ANALYSIS_MAX_PIXELS
+
+logger = logging.getLogger(__name__)
+
+# Перцептивные хеши изображений (нужны индексу почти одинаковых изображений)
+PERCEPTUAL_HASH_ENABLED = os.environ.get("PERCEPTUAL_HASH", "1").strip().lower() not in ("0", "false", "no", "off")
+# Однотонные картинки (фон, заливка) не хешируются: их хеши совпадают у совершенно разных изображений
+PERCEPTUAL_HASH_MIN_CONTRAST = 2.0
+
+_HASH_SIZE = 8
+_DCT_SIZE = 32
+# Базис DCT-II: только 8 низких частот из 32
+_DCT_BASIS = [
+    [math.cos(math.pi * k * (2 * n + 1) / (2 * _DCT_SIZE)) for n in range(_DCT_SIZE)]
+    for k in range(_HASH_SIZE)
+]
+# Сторона промежуточной копии, которая собирается по полосам большого изображения
+_THUMBNAIL_SIDE = 256
+
+
+def _bits_to_hex(bits: List[bool]) -> str:
+    value = 0
+    for bit in bits:
+        value = (value << 1) | bit
+    return f"{value:0{len(bits) // 4}x}"
+
+
+def _dhash(gray: Image.Image) -> str:
+    with gray.resize((_HASH_SIZE + 1, _HASH_SIZE), Image.Resampling.LANCZOS) as small:
+        pixels = list(small.getdata())
+    width = _HASH_SIZE + 1
+    return _bits_to_hex([
+        pixels[row * width + x + 1] > pixels[row * width + x]
+        for row in range(_HASH_SIZE) for x in range(_HASH_SIZE)
+    ])
+
+
+def _phash(pixels: List[float]) -> str:
+    rows = [pixels[i * _DCT_SIZE:(i + 1) * _DCT_SIZE] for i in range(_DCT_SIZE)]
+    # Двумерное DCT как два одномерных: по строкам, затем по столбцам (только нужные частоты)
+    by_rows = [[sum(c * v for c, v in zip(basis, row)) for basis in _DCT_BASIS] for row in rows]
+    coefficients = [
+        sum(c * row[u] for c, row in zip(basis, by_rows))
+        for basis in _DCT_BASIS for u in range(_HASH_SIZE)
+    ]
+    median = statistics.median(coefficients)
+    return _bits_to_hex([c > median for c in coefficients])
+
+
+def _streamed_thumbnail(data: bytes) -> Optional[Image.Image]:
+    """Уменьшенная копия большого PNG/TIFF, собранная по полосам (None — формат не читается полосами)"""
+    reader = open_band_reader(data)
+    if reader is None:
+        return None
+    with reader:
+        scale = _THUMBNAIL_SIDE / max(reader.size)
+        size = (max(1, round(reader.width * scale)), max(1, round(reader.height * scale)))
+        thumbnail = Image.new("L", size)
+        for y, band in reader.bands():
+            top, bottom = round(y * scale), round((y + band.height) * scale)
+            with band, band.convert("L") as gray:
+                if bottom > top:
+                    with gray.resize((size[0], bottom - top), Image.Resampling.BOX) as part:
+                        thumbnail.paste(part, (0, top))
+        return thumbnail
+
+
+def perceptual_hashes(data: bytes, max_pixels: int = PIXEL_ANALYSIS_MAX_PIXELS) -> Optional[Dict[str, str]]:
+    """
+    pHash и dHash изображения.
+
+    Returns:
+        {"phash": 16 hex-символов, "dhash": 16 hex-символов} или None, если изображение
+        не декодируется, слишком велико или однотонное
+    """
+    header = parse_image_header(data) or {}
+    try:
+        if header.get("format") != "JPEG" and header.get("width", 0) * header.get("height", 0) > max_pixels:
+            gray = _streamed_thumbnail(data)
+            if gray is None:
+                return None
+        else:
+            with Image.open(io.BytesIO(data)) as img:
+                if img.width * img.height > max_pixels and img.format != "JPEG":
+                    return None
+                # JPEG: DCT-масштабирование при декодировании, до 1/8
+                img.draft("L", (_DCT_SIZE * 2, _DCT_SIZE * 2))
+                gray = img.convert("L")
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        logger.debug("Перцептивный хеш не посчитан: %s", e)
+        return None
+
+    with gray:
+        with gray.resize((_DCT_SIZE, _DCT_SIZE), Image.Resampling.LANCZOS) as small:
+            pixels = [float(value) for value in small.getdata()]
+        if statistics.pstdev(pixels) < PERCEPTUAL_HASH_MIN_CONTRAST:
+            return None
+        return {"phash": _phash(pixels), "dhash": _dhash(gray)}
+
@@ -0,0 +1,308 @@
+"""
+Анализ пикселей изображения (NumPy): признаки, которые не зависят от метаданных.
+
+- шум: остаток после высокочастотного фильтра, статистика по тайлам;
+- симметрия: корреляция изображения с его зеркальным отражением;
+- блочность JPEG: скачки яркости на границах блоков 8×8 (в исходном масштабе);
+- спектр: средний спектр мощности тайлов (БПФ с окном Ханна) и его
+  периодические пики — следы повышающей дискретизации генераторов.
+
+Шум, симметрия и спектр считаются на уменьшенной копии (не больше
+PIXEL_ANALYSIS_MAX_SIDE по длинной стороне), разбитой на тайлы
+PIXEL_TILE_SIZE×PIXEL_TILE_SIZE; все вычисления векторные, по всем тайлам сразу.
+Память ограничена: большие JPEG декодируются сразу в уменьшенном масштабе
+(draft), PNG и TIFF больше PIXEL_ANALYSIS_MAX_PIXELS читаются полосами
+(band_reader) — уменьшенная копия и фрагмент для блочности собираются по
+полосам, результат тот же, что при декодировании целиком; остальные форматы
+такого размера пропускаются.
+
+NumPy — необязательная зависимость: без нее анализ пикселей недоступен
+(PIXEL_FORENSICS_AVAILABLE = False), остальной анализ работает как прежде.
+"""
+import io
+import math
+import os
+import logging
+from typing import Any, Dict, Optional, Tuple, Union
+
+from PIL import Image
+
+from app.services.band_reader import BandReader, open_band_reader
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - зависит от окружения
+    np = None
+
+logger = logging.getLogger(__name__)
+
+PIXEL_FORENSICS_AVAILABLE = np is not None
+# Анализ пикселей по умолчанию (отключается и для отдельного запроса, параметр pixel_analysis)
+PIXEL_ANALYSIS_ENABLED = os.environ.get("PIXEL_ANALYSIS", "1").strip().lower() not in ("0", "false", "no", "off")
+# Длинная сторона уменьшенной копии для анализа шума, симметрии и спектра
+PIXEL_ANALYSIS_MAX_SIDE = max(64, int(os.environ.get("PIXEL_ANALYSIS_MAX_SIDE", "1024")))
+# Сторона тайла (степень двойки удобна для БПФ)
+PIXEL_TILE_SIZE = max(16, int(os.environ.get("PIXEL_TILE_SIZE", "64")))
+# Больше скольких пикселей изображение не декодируется в исходном масштабе
+PIXEL_ANALYSIS_MAX_PIXELS = max(1, int(os.environ.get("PIXEL_ANALYSIS_MAX_MEGAPIXELS", "40"))) * 1_000_000
+# Сторона фрагмента в исходном масштабе, по которому оценивается блочность JPEG
+BLOCKINESS_CROP = 1024
+# Пик спектра: мощность во столько раз выше средней на той же частоте (радиусе)
+SPECTRAL_PEAK_THRESHOLD = 10.0
+
+# Стандартная таблица квантования яркости JPEG (Annex K) для оценки качества
+_JPEG_LUMINANCE_TABLE = (
+    16, 11, 10, 16, 24, 40, 51, 61, 12, 12, 14, 19, 26, 58, 60, 55,
+    14, 13, 16, 24, 40, 57, 69, 56, 14, 17, 22, 29, 51, 87, 80, 62,
+    18, 22, 37, 56, 68, 109, 103, 77, 24, 35, 55, 64, 81, 104, 113, 92,
+    49, 64, 78, 87, 103, 121, 120, 101, 72, 92, 95, 98, 112, 100, 103, 99,
+)
+
+ImageSource = Union[str, bytes, bytearray, memoryview]
+
+
+def _skipped(reason: str, **extra: Any) -> Dict[str, Any]:
+    return {"skipped": reason, **extra}
+
+
+def _jpeg_quality(img: Image.Image) -> Optional[int]:
+    """Оценка качества JPEG (1–100) по таблице квантования яркости, как в libjpeg"""
+    tables = getattr(img, "quantization", None) or {}
+    table = tables.get(0)
+    if not table or len(table) != 64:
+        return None
+    # Порядок коэффициентов не важен: сравниваются средние масштабы
+    scale = sum(q * 100.0 / base for q, base in zip(table, _JPEG_LUMINANCE_TABLE)) / 64
+    if scale <= 0:
+        return None
+    quality = (200 - scale) / 2 if scale <= 100 else 5000 / scale
+    return int(round(min(100, max(1, quality))))
+
+
+def _tiles(array: "np.ndarray", size: int) -> "np.ndarray":
+    """Разбиение на тайлы size×size без копирования: (число тайлов, size, size)"""
+    rows, cols = array.shape[0] // size, array.shape[1] // size
+    return (
+        array[: rows * size, : cols * size]
+        .reshape(rows, size, cols, size)
+        .swapaxes(1, 2)
+        .reshape(-1, size, size)
+    )
+
+
+def _noise_statistics(gray: "np.ndarray", tile: int) -> Tuple[float, float]:
+    """
+    Уровень шума и его неравномерность по тайлам.
+
+    Остаток — лапласиан, нормированный так, что для белого шума с σ дает σ.
+    Уровень — 10-й перцентиль σ тайлов (в гладких областях остаток — в основном шум),
+    неравномерность — (90-й − 10-й перцентиль) / медиана.
+    """
+    residual = (
+        4 * gray[1:-1, 1:-1] - gray[:-2, 1:-1] - gray[2:, 1:-1] - gray[1:-1, :-2] - gray[1:-1, 2:]
+    ) / math.sqrt(20)
+    sigma = _tiles(residual, tile).std(axis=(1, 2))
+    low, median, high = np.percentile(sigma, (10, 50, 90))
+    variation = float((high - low) / median) if median > 0 else 0.0
+    return float(low), variation
+
+
+def _symmetry_score(gray: "np.ndarray") -> Optional[float]:
+    """Максимум корреляции с отражением по горизонтали и по вертикали (−1…1)"""
+    centered = gray - gray.mean()
+    energy = float(np.einsum("ij,ij->", centered, centered))
+    if energy <= 0:
+        return None
+    horizontal = float(np.einsum("ij,ij->", centered, centered[:, ::-1])) / energy
+    vertical = float(np.einsum("ij,ij->", centered, centered[::-1, :])) / energy
+    return max(horizontal, vertical)
+
+
+def _blockiness(gray: "np.ndarray") -> Optional[float]:
+    """
+    Блочность 8×8: во сколько раз средний перепад яркости на границах блоков
+    больше, чем внутри блоков, минус 1 (0 — сетки нет).
+    """
+    if gray.shape[0] < 32 or gray.shape[1] < 32:
+        return None
+    ratios = []
+    for diffs in (np.abs(np.diff(gray, axis=1)).mean(axis=0), np.abs(np.diff(gray, axis=0)).mean(axis=1)):
+        # Перепад i — между пикселями i и i+1; граница блока — i % 8 == 7
+        boundary = np.zeros(diffs.shape[0], dtype=bool)
+        boundary[7::8] = True
+        inner = float(diffs[~boundary].mean())
+        if inner <= 0:
+            return None
+        ratios.append(float(diffs[boundary].mean()) / inner)
+    return max(0.0, sum(ratios) / len(ratios) - 1.0)
+
+
+def _spectral_peaks(gray: "np.ndarray", tile: int, jpeg_grid: bool) -> Tuple[float, int]:
+    """
+    Периодические пики среднего спектра мощности тайлов.
+
+    Мощность каждой частоты сравнивается со средней мощностью на том же радиусе;
+    оси и низкие частоты не учитываются (края и крупные структуры), для JPEG —
+    также гармоники сетки блоков 8×8.
+
+    Returns:
+        (максимальное превышение, число частот с превышением не меньше SPECTRAL_PEAK_THRESHOLD)
+    """
+    tiles = _tiles(gray, tile)
+    tiles = tiles - tiles.mean(axis=(1, 2), keepdims=True)
+    window = np.outer(np.hanning(tile), np.hanning(tile)).astype(np.float32)
+    power = (np.abs(np.fft.rfft2(tiles * window)) ** 2).mean(axis=0)
+
+    fy = np.abs(np.fft.fftfreq(tile) * tile).astype(np.int64)[:, None]
+    fx = (np.fft.rfftfreq(tile) * tile).astype(np.int64)[None, :]
+    radius = np.rint(np.sqrt(fy ** 2 + fx ** 2)).astype(np.int64)
+    radial_mean = np.bincount(radius.ravel(), weights=power.ravel()) / np.maximum(np.bincount(radius.ravel()), 1)
+    reference = radial_mean[radius]
+
+    mask = (radius >= tile // 8) & (radius <= tile // 2) & (fx != 0) & (fy != 0) & (reference > 0)
+    if jpeg_grid:
+        step = max(1, tile // 8)
+        mask &= ~((fx % step == 0) & (fy % step == 0))
+    if not mask.any():
+        return 0.0, 0
+    ratio = power[mask] / reference[mask]
+    return float(ratio.max()), int((ratio >= SPECTRAL_PEAK_THRESHOLD).sum())
+
+
+def _open(image: ImageSource) -> Image.Image:
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return Image.open(io.BytesIO(image))
+    return Image.open(image)
+
+
+def _blockiness_crop(width: int, height: int) -> Tuple[int, int, int, int]:
+    """Центральный фрагмент для блочности, выровненный по сетке 8×8: (left, top, right, bottom)"""
+    crop_w, crop_h = min(width, BLOCKINESS_CROP), min(height, BLOCKINESS_CROP)
+    left = (width - crop_w) // 2 // 8 * 8
+    top = (height - crop_h) // 2 // 8 * 8
+    return left, top, left + crop_w, top + crop_h
+
+
+def _read_bands(reader: BandReader, factor: int) -> Tuple["np.ndarray", "np.ndarray"]:
+    """
+    Уменьшенная в factor раз копия (как Image.reduce) и фрагмент для блочности,
+    собранные по полосам: в памяти одновременно только одна полоса.
+    """
+    left, top, right, bottom = _blockiness_crop(reader.width, reader.height)
+    crop = np.empty((bottom - top, right - left), dtype=np.uint8)
+    reduced = []
+    carry = np.empty((0, reader.width), dtype=np.uint8)
+
+    def reduce(rows: "np.ndarray") -> "np.ndarray":
+        with Image.fromarray(rows) as band:
+            with band.reduce(factor) as small:
+                return np.asarray(small)
+
+    for y, band in reader.bands():
+        with band:
+            with band.convert("L") as gray_band:
+                rows = np.asarray(gray_band)
+        start, stop = max(top, y), min(bottom, y + rows.shape[0])
+        if start < stop:
+            crop[start - top:stop - top] = rows[start - y:stop - y, left:right]
+        # Остаток строк, не кратный factor, переходит в следующую полосу
+        rows = np.concatenate((carry, rows)) if carry.shape[0] else rows
+        usable = rows.shape[0] // factor * factor
+        if usable:
+            reduced.append(reduce(rows[:usable]))
+        carry = rows[usable:]
+    if carry.shape[0]:
+        reduced.append(reduce(np.ascontiguousarray(carry)))
+    return np.concatenate(reduced).astype(np.float32), crop.astype(np.float32)
+
+
+def _features(
+    gray: "np.ndarray",
+    blockiness_crop: Optional["np.ndarray"],
+    tile: int,
+    fmt: Optional[str],
+    quality: Optional[int],
+    size: Tuple[int, int],
+) -> Dict[str, Any]:
+    if min(gray.shape) < tile + 2:
+        return _skipped("too_small", width=size[0], height=size[1])
+    blockiness = _blockiness(blockiness_crop) if blockiness_crop is not None else None
+    noise_level, noise_variation = _noise_statistics(gray, tile)
+    peak_ratio, peaks = _spectral_peaks(gray, tile, jpeg_grid=fmt == "JPEG")
+    symmetry = _symmetry_score(gray)
+    return {
+        "quality_score": quality,
+        "noise_level": round(noise_level, 4),
+        "noise_variation": round(noise_variation, 4),
+        "symmetry_score": round(symmetry, 4) if symmetry is not None else None,
+        "jpeg_blockiness": round(blockiness, 4) if blockiness is not None else None,
+        "spectral_peak_ratio": round(peak_ratio, 3),
+        "spectral_peaks": peaks,
+        "analyzed_size": [int(gray.shape[1]), int(gray.shape[0])],
+        "tiles": int((gray.shape[0] - 2) // tile * ((gray.shape[1] - 2) // tile)),
+    }
+
+
+def analyze_pixels(
+    image: ImageSource,
+    max_side: int = PIXEL_ANALYSIS_MAX_SIDE,
+    tile: int = PIXEL_TILE_SIZE,
+    max_pixels: int = PIXEL_ANALYSIS_MAX_PIXELS,
+) -> Dict[str, Any]:
+    """
+    Пиксельные признаки изображения.
+
+    Args:
+        image: путь к файлу или содержимое изображения
+
+    Returns:
+        {"quality_score", "noise_level", "noise_variation", "symmetry_score",
+         "jpeg_blockiness", "spectral_peak_ratio", "spectral_peaks", "analyzed_size", "tiles"}
+        или {"skipped": причина}, если анализ невозможен
+    """
+    if np is None:
+        return _skipped("numpy_unavailable")
+
+    reader = open_band_reader(image)
+    if reader is not None:
+        with reader:
+            if reader.width * reader.height > max_pixels:
+                try:
+                    gray, crop = _read_bands(reader, math.ceil(max(reader.size) / max_side))
+                except (OSError, ValueError, SyntaxError) as e:
+                    return _skipped("decode_error", error=str(e))
+                return _features(gray, crop, tile, reader.format, None, reader.size)
+
+    try:
+        with _open(image) as img:
+            width, height = img.size
+            fmt = img.format
+            quality = _jpeg_quality(img) if fmt == "JPEG" else None
+            native = True
+            if width * height > max_pixels:
+                if fmt != "JPEG":
+                    return _skipped("too_large", width=width, height=height)
+                # JPEG декодируется сразу уменьшенным (1/2…1/8) — полный растр в память не попадает
+                img.draft("L", (max_side, max_side))
+                native = False
+            elif fmt == "JPEG":
+                # Только яркость: меньше памяти и быстрее декодирование
+                img.draft("L", img.size)
+            gray_image = img.convert("L")
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        return _skipped("decode_error", error=str(e))
+
+    with gray_image:
+        scale = max(gray_image.size) / max_side
+        reduced = gray_image.reduce(math.ceil(scale)) if scale > 1 else gray_image
+        gray = np.asarray(reduced, dtype=np.float32)
+        if reduced is not gray_image:
+            reduced.close()
+
+        crop = None
+        if native:
+            # Блочность — только в исходном масштабе, по центральному фрагменту, выровненному по сетке 8×8
+            with gray_image.crop(_blockiness_crop(*gray_image.size)) as cropped:
+                crop = np.asarray(cropped, dtype=np.float32)
+
+    return _features(gray, crop, tile, fmt, quality, (width, height))
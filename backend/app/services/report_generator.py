@@ -1,17 +1,237 @@
 from reportlab.lib.pagesizes import A4
 from reportlab.lib import colors
 from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, PageBreak
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, LongTable, TableStyle, PageBreak
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.enums import TA_CENTER, TA_LEFT
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.pdfmetrics import registerFontFamily
+from reportlab.pdfbase.ttfonts import TTFont, TTFError
+import asyncio
+import io
 import json
 import os
-import tempfile
-from typing import Dict, Any, Optional
+import uuid
+import threading
+import logging
+from concurrent.futures import Future
+from typing import Dict, Any, List, Optional, Tuple
 from datetime import datetime
 
-# Единая папка для PDF-отчётов (используется и в routes.get_report)
-REPORTS_DIR = os.path.join(tempfile.gettempdir(), "deepfake_reports")
+from app.services.report_store import REPORTS_DIR, get_report_store
+from app.services.task_executor import BoundedExecutor, ExecutorBusyError, ExecutorRestartedError
+
+logger = logging.getLogger(__name__)
+
+# Рендерить PDF в фоне сразу после анализа (иначе — при первом запросе отчёта)
+REPORT_PRERENDER = os.environ.get("REPORT_PRERENDER", "0").strip().lower() not in ("0", "false", "no", "off")
+# Пул рендеринга PDF: "process" (по умолчанию) или "thread"
+REPORT_RENDER_EXECUTOR = os.environ.get("REPORT_RENDER_EXECUTOR", "process").strip().lower()
+# Сколько отчётов рендерится одновременно
+REPORT_RENDER_WORKERS = max(1, int(os.environ.get("REPORT_RENDER_WORKERS", "1")))
+# Сколько отчётов может ждать рендеринга сверх выполняемых
+REPORT_RENDER_MAX_PENDING = max(0, int(os.environ.get("REPORT_RENDER_MAX_PENDING", "8")))
+# Предельное время рендеринга одного отчёта, сек
+REPORT_RENDER_TIMEOUT = max(1, int(os.environ.get("REPORT_RENDER_TIMEOUT", "60")))
+# Подробные разделы (метаданные, аномалии) выводятся для стольких первых изображений,
+# остальные — строкой в сводной таблице
+REPORT_MAX_IMAGE_SECTIONS = max(0, int(os.environ.get("REPORT_MAX_IMAGE_SECTIONS", "50")))
+# Строк метаданных в таблице одного изображения
+REPORT_MAX_METADATA_ROWS = max(1, int(os.environ.get("REPORT_MAX_METADATA_ROWS", "60")))
+# Аномалий в разделе одного изображения
+REPORT_MAX_IMAGE_ANOMALIES = 20
+# Строк в одной таблице: длинные таблицы делятся на части, чтобы разбиение
+# по страницам не копировало оставшиеся строки снова и снова
+_TABLE_CHUNK_ROWS = 200
+# Длина значения в ячейке таблицы метаданных и сводной таблицы изображений; ячейки —
+# строки без переноса (Paragraph в каждой ячейке в разы замедляет разметку)
+_CELL_MAX_CHARS = 50
+_SUMMARY_CELL_MAX_CHARS = 45
+
+# Шрифты отчёта: встроенные Helvetica содержат только Latin-1, кириллица — в TTF
+DEFAULT_FONTS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "assets", "fonts")
+REPORT_FONTS_DIR = os.environ.get("REPORT_FONTS_DIR", "").strip() or DEFAULT_FONTS_DIR
+_FONT_FILES = {"DejaVuSans": "DejaVuSans.ttf", "DejaVuSans-Bold": "DejaVuSans-Bold.ttf"}
+
+
+def _register_fonts() -> Tuple[str, str]:
+    """
+    Регистрация TTF-шрифтов отчёта (один раз на процесс, при импорте модуля).
+
+    Разобранные TTFont хранятся в реестре reportlab и переиспользуются всеми
+    отчётами; в PDF встраивается только подмножество использованных глифов.
+
+    Returns:
+        (имя обычного шрифта, имя полужирного); без файлов шрифтов — Helvetica
+    """
+    try:
+        for name, filename in _FONT_FILES.items():
+            pdfmetrics.registerFont(TTFont(name, os.path.join(REPORT_FONTS_DIR, filename)))
+    except (OSError, TTFError) as e:
+        logger.warning("Шрифты отчёта не загружены (%s), кириллица в PDF не отобразится: %s", REPORT_FONTS_DIR, e)
+        return "Helvetica", "Helvetica-Bold"
+    # Семейство нужно разметке <b> в Paragraph
+    registerFontFamily(
+        "DejaVuSans", normal="DejaVuSans", bold="DejaVuSans-Bold", italic="DejaVuSans", boldItalic="DejaVuSans-Bold"
+    )
+    return "DejaVuSans", "DejaVuSans-Bold"
+
+
+FONT_REGULAR, FONT_BOLD = _register_fonts()
+
+# Стили создаются один раз на процесс и переиспользуются всеми отчётами
+_STYLES = getSampleStyleSheet()
+for _style in _STYLES.byName.values():
+    if hasattr(_style, "fontName"):
+        _style.fontName = FONT_BOLD if _style.fontName.endswith("-Bold") else FONT_REGULAR
+_TEXT_COLOR = colors.HexColor('#262626')
+
+TITLE_STYLE = ParagraphStyle(
+    'CustomTitle',
+    parent=_STYLES['Heading1'],
+    fontSize=20,
+    textColor=_TEXT_COLOR,
+    spaceAfter=20,
+    alignment=TA_CENTER,
+    fontName=FONT_BOLD
+)
+SUBTITLE_STYLE = ParagraphStyle(
+    'Subtitle', parent=_STYLES['Normal'],
+    fontSize=11, alignment=TA_CENTER,
+    textColor=colors.HexColor('#333333'),
+    spaceAfter=24
+)
+HEADING_STYLE = ParagraphStyle(
+    'SectionHeading',
+    parent=_STYLES['Heading2'],
+    fontSize=14,
+    textColor=_TEXT_COLOR,
+    spaceAfter=12,
+    spaceBefore=16,
+    fontName=FONT_BOLD
+)
+NORMAL_STYLE = ParagraphStyle(
+    'NormalText',
+    parent=_STYLES['Normal'],
+    fontSize=10,
+    textColor=_TEXT_COLOR,
+    spaceAfter=8,
+    leading=14
+)
+STATUS_STYLE = ParagraphStyle('Status', parent=NORMAL_STYLE, alignment=TA_CENTER, fontSize=11)
+FOOTER_STYLE = ParagraphStyle(
+    'Footer',
+    parent=_STYLES['Normal'],
+    fontSize=8,
+    textColor=colors.HexColor('#666666'),
+    alignment=TA_CENTER
+)
+
+
+def _probability_style(name: str, color: str) -> ParagraphStyle:
+    return ParagraphStyle(
+        name,
+        parent=_STYLES['Normal'],
+        fontSize=16,
+        textColor=colors.HexColor(color),
+        spaceAfter=8,
+        alignment=TA_CENTER,
+        fontName=FONT_BOLD
+    )
+
+
+# (верхняя граница вероятности, уровень, стиль)
+PROBABILITY_LEVELS = [
+    (30, "Низкая", _probability_style('ProbabilityLow', '#22c55e')),  # green
+    (70, "Средняя", _probability_style('ProbabilityMedium', '#f59e0b')),  # orange
+    (None, "Высокая", _probability_style('ProbabilityHigh', '#ef4444')),  # red
+]
+
+INFO_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), _TEXT_COLOR),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.HexColor('#E9E9E9')),
+    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+    ('FONTNAME', (0, 0), (-1, -1), FONT_REGULAR),
+    ('FONTNAME', (0, 0), (-1, 0), FONT_BOLD),
+    ('FONTSIZE', (0, 0), (-1, 0), 10),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 10),
+    ('TOPPADDING', (0, 0), (-1, 0), 10),
+    ('BACKGROUND', (0, 1), (-1, -1), colors.HexColor('#E9E9E9')),
+    ('GRID', (0, 0), (-1, -1), 1, _TEXT_COLOR),
+    ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+    ('FONTSIZE', (0, 1), (-1, -1), 9),
+    ('LEFTPADDING', (0, 0), (-1, -1), 8),
+    ('RIGHTPADDING', (0, 0), (-1, -1), 8),
+    ('TOPPADDING', (0, 1), (-1, -1), 6),
+    ('BOTTOMPADDING', (0, 1), (-1, -1), 6),
+])
+
+META_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#f3f4f6')),
+    ('TEXTCOLOR', (0, 0), (-1, 0), _TEXT_COLOR),
+    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+    ('FONTNAME', (0, 0), (-1, -1), FONT_REGULAR),
+    ('FONTNAME', (0, 0), (-1, 0), FONT_BOLD),
+    ('FONTSIZE', (0, 0), (-1, 0), 9),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
+    ('TOPPADDING', (0, 0), (-1, 0), 8),
+    ('BACKGROUND', (0, 1), (-1, -1), colors.HexColor('#E9E9E9')),
+    ('GRID', (0, 0), (-1, -1), 0.5, colors.HexColor('#d1d5db')),
+    ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+    ('FONTSIZE', (0, 1), (-1, -1), 8),
+    ('LEFTPADDING', (0, 0), (-1, -1), 6),
+    ('RIGHTPADDING', (0, 0), (-1, -1), 6),
+    ('TOPPADDING', (0, 1), (-1, -1), 5),
+    ('BOTTOMPADDING', (0, 1), (-1, -1), 5),
+])
+
+
+def _escape(s) -> str:
+    if s is None:
+        return ""
+    s = str(s)
+    return s.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def _format_value(value, max_chars: int = 150) -> str:
+    if value is None or value == "":
+        return "N/A"
+    text = str(value)
+    return text if len(text) <= max_chars else text[:max_chars - 3] + "..."
+
+
+def _long_tables(header: List[Any], rows: List[List[Any]], col_widths: List[float], style: TableStyle) -> List[LongTable]:
+    """Таблица с повтором заголовка на каждой странице, длинная — несколькими частями"""
+    tables = []
+    for start in range(0, max(len(rows), 1), _TABLE_CHUNK_ROWS):
+        table = LongTable([header] + rows[start:start + _TABLE_CHUNK_ROWS], colWidths=col_widths, repeatRows=1)
+        table.setStyle(style)
+        tables.append(table)
+    return tables
+
+
+def _image_metadata_rows(metadata: Dict[str, Any]) -> Tuple[List[List[str]], int]:
+    """
+    Строки таблицы метаданных изображения (группа, поле, значение) из сгруппированных
+    метаданных ExifTool/PIL, не больше REPORT_MAX_METADATA_ROWS.
+
+    Returns:
+        (строки, сколько полей не поместилось)
+    """
+    grouped = ((metadata or {}).get("exif") or {}).get("_grouped_metadata") or {}
+    rows: List[List[str]] = []
+    total = 0
+    for group, fields in grouped.items():
+        for field in fields or []:
+            if not isinstance(field, (list, tuple)) or len(field) != 2:
+                continue
+            total += 1
+            if len(rows) < REPORT_MAX_METADATA_ROWS:
+                rows.append([
+                    _format_value(group, 24), _format_value(field[0], 40), _format_value(field[1], _CELL_MAX_CHARS)
+                ])
+    return rows, total - len(rows)
+
 
 class ReportGenerator:
     """Генератор отчетов в различных форматах"""
@@ -59,92 +279,57 @@ class ReportGenerator:
     
     def generate_json_report(self, report_data: Dict[str, Any]) -> str:
         """Генерация JSON отчета"""
-        filename = f"report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+        filename = f"report_{uuid.uuid4().hex}.json"
         filepath = os.path.join(self.reports_dir, filename)
         
         with open(filepath, 'w', encoding='utf-8') as f:
             json.dump(report_data, f, ensure_ascii=False, indent=2)
         
         return filepath
+
+    def save_report_data(self, report_data: Dict[str, Any]) -> str:
+        """
+        Сохранение данных отчёта без рендеринга PDF (он строится по ним при первом запросе).
+
+        Returns:
+            имя будущего PDF-отчёта (для report_url)
+        """
+        return get_report_store().save(report_data)
     
-    def generate_pdf_report(self, report_data: Dict[str, Any], original_file: Optional[str] = None) -> str:
-        """Генерация PDF отчета с визуальными индикаторами"""
-        filename = f"report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
-        filepath = os.path.join(self.reports_dir, filename)
+    def generate_pdf_report(
+        self,
+        report_data: Dict[str, Any],
+        original_file: Optional[str] = None,
+        filepath: Optional[str] = None,
+    ) -> str:
+        """Генерация PDF отчета с визуальными индикаторами (filepath — куда записать файл)"""
+        if filepath is None:
+            filename = f"report_{uuid.uuid4().hex}.pdf"
+            filepath = os.path.join(self.reports_dir, filename)
         
         doc = SimpleDocTemplate(filepath, pagesize=A4, 
                                leftMargin=0.75*inch, rightMargin=0.75*inch,
-                               topMargin=0.75*inch, bottomMargin=0.75*inch)
+                               topMargin=0.75*inch, bottomMargin=0.75*inch,
+                               initialFontName=FONT_REGULAR)
         story = []
-        styles = getSampleStyleSheet()
-        
-        # Стили
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=20,
-            textColor=colors.HexColor('#262626'),
-            spaceAfter=20,
-            alignment=TA_CENTER,
-            fontName='Helvetica-Bold'
-        )
-        
-        heading_style = ParagraphStyle(
-            'SectionHeading',
-            parent=styles['Heading2'],
-            fontSize=14,
-            textColor=colors.HexColor('#262626'),
-            spaceAfter=12,
-            spaceBefore=16,
-            fontName='Helvetica-Bold'
-        )
-        
-        normal_style = ParagraphStyle(
-            'NormalText',
-            parent=styles['Normal'],
-            fontSize=10,
-            textColor=colors.HexColor('#262626'),
-            spaceAfter=8,
-            leading=14
-        )
+        normal_style = NORMAL_STYLE
+        heading_style = HEADING_STYLE
         
         # Заголовок
-        story.append(Paragraph("АНАЛИЗ МЕТАДАННЫХ", title_style))
-        story.append(Paragraph("Проверка документов Word и PowerPoint (DOCX, PPTX)", 
-                              ParagraphStyle('Subtitle', parent=styles['Normal'], 
-                                           fontSize=11, alignment=TA_CENTER, 
-                                           textColor=colors.HexColor('#333333'),
-                                           spaceAfter=24)))
+        story.append(Paragraph("АНАЛИЗ МЕТАДАННЫХ", TITLE_STYLE))
+        story.append(Paragraph("Проверка документов Word и PowerPoint (DOCX, PPTX)", SUBTITLE_STYLE))
         story.append(Spacer(1, 0.1*inch))
         
         # Вероятность ИИ-вмешательства
         ai_indicators = report_data.get("ai_indicators", {})
         ai_prob = ai_indicators.get("ai_probability", 0)
         
-        if ai_prob < 30:
-            ai_color = colors.HexColor('#22c55e')  # green
-            ai_status = "Низкая"
-        elif ai_prob < 70:
-            ai_color = colors.HexColor('#f59e0b')  # orange
-            ai_status = "Средняя"
-        else:
-            ai_color = colors.HexColor('#ef4444')  # red
-            ai_status = "Высокая"
-        
-        prob_style = ParagraphStyle(
-            'Probability',
-            parent=styles['Normal'],
-            fontSize=16,
-            textColor=ai_color,
-            spaceAfter=8,
-            alignment=TA_CENTER,
-            fontName='Helvetica-Bold'
-        )
+        for limit, ai_status, prob_style in PROBABILITY_LEVELS:
+            if limit is None or ai_prob < limit:
+                break
         
         story.append(Paragraph(f"<b>Вероятность ИИ-вмешательства: {ai_prob}%</b>", prob_style))
-        story.append(Paragraph(f"<b>Уровень:</b> {ai_status}", 
-                              ParagraphStyle('Status', parent=normal_style, 
-                                           alignment=TA_CENTER, fontSize=11)))
+        story.append(Paragraph(f"<b>Уровень:</b> {ai_status}", STATUS_STYLE))
         story.append(Spacer(1, 0.2*inch))
         
         # Информация о файле
@@ -154,7 +339,6 @@ class ReportGenerator:
         file_info = report_data.get("file_info", {})
         
         info_data = [
-            ["Параметр", "Значение"],
             ["Тип файла", report_data.get("file_type", "N/A").upper()],
             ["Название файла", file_info.get("name", "Не указано")],
             ["Размер файла", file_info.get("size_formatted", "Не указано") if file_info.get("size") else "Не указано"],
@@ -163,25 +347,7 @@ class ReportGenerator:
             ["Источник", summary.get("source") or "Неизвестно"],
         ]
         
-        info_table = Table(info_data, colWidths=[2.2*inch, 4.3*inch])
-        info_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#262626')),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.HexColor('#E9E9E9')),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 10),
-            ('TOPPADDING', (0, 0), (-1, 0), 10),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.HexColor('#E9E9E9')),
-            ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#262626')),
-            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-            ('FONTSIZE', (0, 1), (-1, -1), 9),
-            ('LEFTPADDING', (0, 0), (-1, -1), 8),
-            ('RIGHTPADDING', (0, 0), (-1, -1), 8),
-            ('TOPPADDING', (0, 1), (-1, -1), 6),
-            ('BOTTOMPADDING', (0, 1), (-1, -1), 6),
-        ]))
-        story.append(info_table)
+        story.extend(_long_tables(["Параметр", "Значение"], info_data, [2.2*inch, 4.3*inch], INFO_TABLE_STYLE))
         story.append(Spacer(1, 0.3*inch))
         
         # По фактам из метаданных
@@ -217,17 +383,10 @@ class ReportGenerator:
         story.append(Paragraph("<b>ДЕТАЛЬНЫЕ МЕТАДАННЫЕ</b>", heading_style))
         
         metadata = report_data.get("metadata", {})
-        self._add_document_metadata(story, metadata, styles, normal_style, heading_style)
+        self._add_document_metadata(story, metadata, normal_style, heading_style)
         
         # Футер
         story.append(Spacer(1, 0.3*inch))
-        footer_style = ParagraphStyle(
-            'Footer',
-            parent=styles['Normal'],
-            fontSize=8,
-            textColor=colors.HexColor('#666666'),
-            alignment=TA_CENTER
-        )
         generated_at = report_data.get('generated_at', '')
         if generated_at:
             try:
@@ -240,44 +399,20 @@ class ReportGenerator:
         
         story.append(Paragraph(
             f"Отчет сгенерирован: {formatted_date}",
-            footer_style
+            FOOTER_STYLE
         ))
         
         doc.build(story)
         return filepath
     
-    def _add_document_metadata(self, story, metadata, styles, normal_style, heading_style):
-        """Добавление метаданных DOCX/PPTX и списка изображений в отчёт."""
-        def _escape(s):
-            if s is None:
-                return ""
-            s = str(s)
-            return s.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
-
-        def _format_value(value):
-            if value is None or value == "":
-                return "N/A"
-            text = str(value)
-            return text if len(text) <= 150 else text[:147] + "..."
-
-        table_style = TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#f3f4f6')),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.HexColor('#262626')),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 9),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
-            ('TOPPADDING', (0, 0), (-1, 0), 8),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.HexColor('#E9E9E9')),
-            ('GRID', (0, 0), (-1, -1), 0.5, colors.HexColor('#d1d5db')),
-            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-            ('FONTSIZE', (0, 1), (-1, -1), 8),
-            ('LEFTPADDING', (0, 0), (-1, -1), 6),
-            ('RIGHTPADDING', (0, 0), (-1, -1), 6),
-            ('TOPPADDING', (0, 1), (-1, -1), 5),
-            ('BOTTOMPADDING', (0, 1), (-1, -1), 5),
-        ])
+    def _add_document_metadata(self, story, metadata, normal_style, heading_style):
+        """
+        Добавление метаданных DOCX/PPTX и списка изображений в отчёт.
 
+        Подробные разделы выводятся для первых REPORT_MAX_IMAGE_SECTIONS изображений
+        (метаданные — не больше REPORT_MAX_METADATA_ROWS строк), остальные изображения
+        сводятся в одну таблицу: объём отчёта растет линейно с числом изображений.
+        """
         document_type = metadata.get("document_type", "word")
         document_label = "PowerPoint" if document_type == "powerpoint" else "Word"
         document_meta = metadata.get("document_metadata", {}) or {}
@@ -288,7 +423,7 @@ class ReportGenerator:
         story.append(Paragraph(f"<b>Документ:</b> {document_label}", normal_style))
         story.append(Spacer(1, 0.1*inch))
 
-        meta_rows = [["Параметр", "Значение"]]
+        meta_rows = []
         meta_fields = [
             ("Автор", document_meta.get("creator")),
             ("Последний редактор", document_meta.get("last_modified_by")),
@@ -309,11 +444,9 @@ class ReportGenerator:
             if value is not None and str(value).strip():
                 meta_rows.append([label, _format_value(value)])
 
-        if len(meta_rows) > 1:
+        if meta_rows:
             story.append(Paragraph("<b>Свойства документа</b>", heading_style))
-            meta_table = Table(meta_rows, colWidths=[2.2*inch, 4.3*inch])
-            meta_table.setStyle(table_style)
-            story.append(meta_table)
+            story.extend(_long_tables(["Параметр", "Значение"], meta_rows, [2.2*inch, 4.3*inch], META_TABLE_STYLE))
             story.append(Spacer(1, 0.2*inch))
 
         story.append(Paragraph(
@@ -322,9 +455,9 @@ class ReportGenerator:
         ))
         story.append(Spacer(1, 0.15*inch))
 
-        for i, img in enumerate(images):
+        for i, img in enumerate(images[:REPORT_MAX_IMAGE_SECTIONS]):
             fname = _escape(img.get("filename", f"image_{i+1}"))
-            source_path = _escape(img.get("archive_path", ""))
+            source_path = img.get("archive_path", "")
             ai_ind = img.get("ai_indicators", {})
             prob = ai_ind.get("ai_probability", 0)
 
@@ -339,6 +472,177 @@ class ReportGenerator:
                     "Обнаруженное ПО: " + _escape(", ".join(ai_ind["software_detected"])),
                     normal_style
                 ))
-            for anom in ai_ind.get("anomalies", []):
+            anomalies = ai_ind.get("anomalies", [])
+            for anom in anomalies[:REPORT_MAX_IMAGE_ANOMALIES]:
                 story.append(Paragraph("• " + _escape(anom), normal_style))
+            if len(anomalies) > REPORT_MAX_IMAGE_ANOMALIES:
+                story.append(Paragraph(
+                    f"… и ещё {len(anomalies) - REPORT_MAX_IMAGE_ANOMALIES} признаков", normal_style
+                ))
+
+            rows, omitted = _image_metadata_rows(img.get("metadata"))
+            if rows:
+                story.append(Spacer(1, 0.05*inch))
+                story.extend(_long_tables(
+                    ["Группа", "Поле", "Значение"], rows, [1.1*inch, 1.8*inch, 3.6*inch], META_TABLE_STYLE
+                ))
+                if omitted:
+                    story.append(Paragraph(
+                        f"Не показано полей метаданных: {omitted} (полный список — в JSON-ответе)", normal_style
+                    ))
             story.append(Spacer(1, 0.12*inch))
+
+        rest = images[REPORT_MAX_IMAGE_SECTIONS:]
+        if rest:
+            story.append(Paragraph(
+                f"<b>Остальные изображения ({len(rest)})</b>", heading_style
+            ))
+            rows = []
+            for i, img in enumerate(rest, start=REPORT_MAX_IMAGE_SECTIONS + 1):
+                ai_ind = img.get("ai_indicators", {})
+                findings = list(ai_ind.get("software_detected") or []) + list(ai_ind.get("anomalies") or [])
+                rows.append([
+                    str(i),
+                    _format_value(img.get("filename", f"image_{i}"), 40),
+                    f"{ai_ind.get('ai_probability', 0)}%",
+                    _format_value("; ".join(findings) or "—", _SUMMARY_CELL_MAX_CHARS),
+                ])
+            story.extend(_long_tables(
+                ["№", "Файл", "ИИ", "Признаки"], rows, [0.5*inch, 2.0*inch, 0.6*inch, 3.4*inch], META_TABLE_STYLE
+            ))
+
+
+def rendered_report(report_filename: str) -> Optional[str]:
+    """Путь к уже отрисованному PDF или None"""
+    return get_report_store().rendered(report_filename)
+
+
+def report_exists(report_filename: str) -> bool:
+    """Отчёт уже отрисован или его можно отрисовать по сохранённым данным"""
+    return get_report_store().exists(report_filename)
+
+
+# Имя отчёта -> блокировка: один и тот же PDF не рендерится параллельно в одном процессе
+_render_locks: Dict[str, threading.Lock] = {}
+_render_locks_guard = threading.Lock()
+
+
+def render_report(report_filename: str) -> Optional[str]:
+    """
+    PDF-отчёт по сохранённым данным. Уже отрисованный файл отдается с диска;
+    новый пишется во временный файл и переименовывается, поэтому читатели
+    (и другие процессы) не видят недописанный PDF.
+
+    Returns:
+        путь к PDF или None, если отчёта нет
+    """
+    store = get_report_store()
+    pdf_path = store.rendered(report_filename)
+    if pdf_path is not None:
+        return pdf_path
+    with _render_locks_guard:
+        lock = _render_locks.setdefault(report_filename, threading.Lock())
+    try:
+        with lock:
+            pdf_path = store.rendered(report_filename)
+            if pdf_path is not None:
+                return pdf_path
+            report_data = store.load(report_filename)
+            if report_data is None:
+                return None
+            tmp_path = store.pdf_tmp_path(report_filename)
+            try:
+                ReportGenerator().generate_pdf_report(report_data, filepath=tmp_path)
+                pdf_path = store.commit_pdf(report_filename, tmp_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            logger.info("PDF-отчёт отрисован: %s", report_filename)
+            return pdf_path
+    finally:
+        with _render_locks_guard:
+            if _render_locks.get(report_filename) is lock:
+                del _render_locks[report_filename]
+
+
+def _init_render_worker() -> None:
+    """
+    Подготовка процесса рендеринга при запуске: стили уже созданы при импорте модуля,
+    пробный отчёт в памяти загружает метрики шрифтов и модули reportlab, которые
+    иначе подгружаются при первом настоящем отчёте.
+    """
+    try:
+        ReportGenerator().generate_pdf_report(_WARMUP_REPORT, filepath=io.BytesIO())
+    except Exception as e:
+        logger.warning("Прогрев процесса рендеринга отчётов не удался: %s", e)
+
+
+_WARMUP_REPORT: Dict[str, Any] = {
+    "file_type": "document",
+    "summary": {"source": "Прогрев"},
+    "metadata": {"images": [{"filename": "image.png", "metadata": {"exif": {"_grouped_metadata": {"File": [["Format", "PNG"]]}}}}]},
+    "ai_indicators": {"anomalies": ["Прогрев"]},
+    "file_info": {},
+}
+
+# Пул рендеринга PDF: reportlab — чистый Python, в отдельных процессах он не отнимает GIL у запросов
+report_executor = BoundedExecutor(
+    REPORT_RENDER_EXECUTOR, REPORT_RENDER_WORKERS, REPORT_RENDER_MAX_PENDING,
+    name="report", initializer=_init_render_worker,
+)
+
+# Имя отчёта -> рендеринг в пуле: параллельные запросы одного отчёта ждут один рендеринг
+_inflight: Dict[str, "asyncio.Future[Optional[str]]"] = {}
+
+
+async def _render_in_pool(report_filename: str) -> Optional[str]:
+    try:
+        return await report_executor.run(render_report, report_filename, timeout=REPORT_RENDER_TIMEOUT)
+    except ExecutorRestartedError as e:
+        # Пул остановлен из-за зависшего рендеринга другого отчета: один повтор в новом пуле.
+        # Свой таймаут (ExecutorTimeoutError) и упавший процесс (BrokenExecutor) не повторяются:
+        # повтор ждал бы еще REPORT_RENDER_TIMEOUT и мог бы остановить и новый пул
+        logger.warning("Рендеринг отчёта %s прерван (%s), повтор", report_filename, e)
+        return await report_executor.run(render_report, report_filename, timeout=REPORT_RENDER_TIMEOUT)
+
+
+async def render_report_async(report_filename: str) -> Optional[str]:
+    """
+    render_report в пуле report_executor с таймаутом REPORT_RENDER_TIMEOUT.
+
+    Raises:
+        ExecutorBusyError: пул рендеринга заполнен
+        ExecutorTimeoutError: рендеринг не уложился в таймаут
+        BrokenExecutor: процесс пула упал или пул остановлен и при повторе
+    """
+    pdf_path = rendered_report(report_filename)
+    if pdf_path is not None:
+        return pdf_path
+    task = _inflight.get(report_filename)
+    if task is None:
+        task = asyncio.ensure_future(_render_in_pool(report_filename))
+        _inflight[report_filename] = task
+        # Завершившийся (в т.ч. с ошибкой) рендеринг не отдается следующим запросам
+        task.add_done_callback(
+            lambda done: _inflight.pop(report_filename) if _inflight.get(report_filename) is done else None
+        )
+    # Отключение одного клиента не отменяет рендеринг для остальных
+    return await asyncio.shield(task)
+
+
+def _prerendered(report_filename: str, future: Future) -> None:
+    if not future.cancelled() and future.exception() is not None:
+        # Отчёт попробует отрисоваться ещё раз при запросе
+        logger.warning("Фоновый рендеринг отчёта %s не удался: %s", report_filename, future.exception())
+
+
+def schedule_render(report_filename: str) -> None:
+    """Фоновый рендеринг PDF (при REPORT_PRERENDER); без него отчёт рендерится при первом запросе"""
+    if not REPORT_PRERENDER:
+        return
+    try:
+        future = report_executor.submit(render_report, report_filename)
+    except ExecutorBusyError:
+        logger.info("Пул рендеринга занят, отчёт %s отрисуется при запросе", report_filename)
+        return
+    future.add_done_callback(lambda done: _prerendered(report_filename, done))
@@ -0,0 +1,309 @@
+"""
+Хранилище отчётов: данные отчёта (JSON) и отрисованные по ним PDF.
+
+- имена отчётов — report_<uuid4>.pdf, поэтому одновременные запросы не
+  перезаписывают чужие файлы;
+- индекс отчётов (время создания, последнего обращения, размеры файлов) лежит
+  в SQLite-базе в том же каталоге;
+- отчёты старше REPORT_TTL удаляются, при превышении REPORT_STORE_MAX_MB —
+  самые давно запрошенные; этим занимается фоновый поток-уборщик.
+
+Каталог может использоваться несколькими процессами uvicorn одновременно:
+файлы пишутся во временный файл и переименовываются (читатель не видит
+недописанный отчёт), индекс — SQLite в режиме WAL, вытеснение выполняется
+в транзакции BEGIN IMMEDIATE, поэтому процессы не удаляют одно и то же дважды.
+"""
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Каталог отчётов (общий для всех процессов сервиса)
+REPORTS_DIR = os.environ.get("REPORTS_DIR", "").strip() or os.path.join(tempfile.gettempdir(), "deepfake_reports")
+# Сколько секунд хранится отчёт после создания
+REPORT_TTL = max(60, int(os.environ.get("REPORT_TTL", "86400")))
+# Объём каталога отчётов, МБ; сверх этого удаляются самые давно запрошенные отчёты
+REPORT_STORE_MAX_BYTES = max(1, int(os.environ.get("REPORT_STORE_MAX_MB", "1024"))) * 1024 * 1024
+# Период фоновой уборки каталога отчётов, сек
+REPORT_JANITOR_INTERVAL = max(1, int(os.environ.get("REPORT_JANITOR_INTERVAL", "300")))
+
+_INDEX_NAME = "reports.sqlite3"
+_PREFIX = "report_"
+# Временные файлы старше этого считаются брошенными (процесс упал при записи)
+_STALE_TMP_AGE = 3600
+# Обновление времени обращения не чаще раза в столько секунд (чтение отчёта не пишет в базу каждый раз)
+_TOUCH_INTERVAL = 60
+
+
+def _remove(path: str) -> int:
+    """Удаление файла; возвращает освобождённый объём"""
+    try:
+        size = os.path.getsize(path)
+        os.remove(path)
+        return size
+    except FileNotFoundError:
+        return 0
+
+
+class ReportStore:
+    """Каталог отчётов с индексом в SQLite, TTL и ограничением объёма."""
+
+    def __init__(
+        self,
+        directory: str = REPORTS_DIR,
+        ttl: int = REPORT_TTL,
+        max_bytes: int = REPORT_STORE_MAX_BYTES,
+        janitor_interval: int = REPORT_JANITOR_INTERVAL,
+    ):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.janitor_interval = janitor_interval
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            os.path.join(directory, _INDEX_NAME), check_same_thread=False, timeout=30, isolation_level=None
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS reports ("
+            " name TEXT PRIMARY KEY, created REAL NOT NULL, accessed REAL NOT NULL,"
+            " data_size INTEGER NOT NULL, pdf_size INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS reports_created ON reports (created)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS reports_accessed ON reports (accessed)")
+        self._janitor: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    # --- имена и пути ---
+
+    @staticmethod
+    def valid_name(name: str) -> bool:
+        """Имя отчёта вида report_<32 hex>.pdf (и ничего, что выходит за каталог)"""
+        stem, ext = os.path.splitext(name)
+        key = stem[len(_PREFIX):]
+        return ext == ".pdf" and stem.startswith(_PREFIX) and len(key) == 32 and all(
+            c in "0123456789abcdef" for c in key
+        )
+
+    def pdf_path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def data_path(self, name: str) -> str:
+        return os.path.join(self.directory, f"{os.path.splitext(name)[0]}.json")
+
+    def _tmp_path(self, path: str) -> str:
+        return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    # --- запись и чтение ---
+
+    def save(self, report_data: Dict[str, Any]) -> str:
+        """
+        Сохранение данных отчёта.
+
+        Returns:
+            имя PDF-отчёта (report_<uuid>.pdf); сам PDF рендерится позже
+        """
+        name = f"{_PREFIX}{uuid.uuid4().hex}.pdf"
+        data_path = self.data_path(name)
+        tmp_path = self._tmp_path(data_path)
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(report_data, f, ensure_ascii=False, default=str)
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, data_path)
+        except BaseException:
+            _remove(tmp_path)
+            raise
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO reports (name, created, accessed, data_size) VALUES (?, ?, ?, ?)",
+                (name, now, now, size),
+            )
+        return name
+
+    def _row(self, name: str) -> Optional[Tuple[float, float]]:
+        with self._lock:
+            return self._db.execute("SELECT created, accessed FROM reports WHERE name = ?", (name,)).fetchone()
+
+    def _touch(self, name: str, accessed: float) -> None:
+        now = time.time()
+        if now - accessed < _TOUCH_INTERVAL:
+            return
+        try:
+            with self._lock:
+                self._db.execute("UPDATE reports SET accessed = ? WHERE name = ?", (now, name))
+        except sqlite3.Error as e:
+            logger.debug("Время обращения к отчёту %s не обновлено: %s", name, e)
+
+    def _live(self, name: str) -> Optional[Tuple[float, float]]:
+        """Строка индекса неистёкшего отчёта"""
+        if not self.valid_name(name):
+            return None
+        row = self._row(name)
+        if row is None or time.time() - row[0] > self.ttl:
+            return None
+        return row
+
+    def exists(self, name: str) -> bool:
+        """Отчёт есть в хранилище (отрисован или может быть отрисован)"""
+        return self._live(name) is not None and (
+            os.path.exists(self.pdf_path(name)) or os.path.exists(self.data_path(name))
+        )
+
+    def rendered(self, name: str) -> Optional[str]:
+        """Путь к уже отрисованному PDF или None"""
+        row = self._live(name)
+        if row is None or not os.path.exists(self.pdf_path(name)):
+            return None
+        self._touch(name, row[1])
+        return self.pdf_path(name)
+
+    def load(self, name: str) -> Optional[Dict[str, Any]]:
+        """Данные отчёта или None, если отчёта нет"""
+        if self._live(name) is None:
+            return None
+        try:
+            with open(self.data_path(name), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def pdf_tmp_path(self, name: str) -> str:
+        """Временный файл, куда рендерится PDF перед commit_pdf"""
+        return self._tmp_path(self.pdf_path(name))
+
+    def commit_pdf(self, name: str, tmp_path: str) -> Optional[str]:
+        """
+        Перенос отрисованного PDF на место. Если отчёт тем временем удалён
+        уборщиком, файл удаляется.
+
+        Returns:
+            путь к PDF или None
+        """
+        pdf_path = self.pdf_path(name)
+        size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, pdf_path)
+        with self._lock:
+            updated = self._db.execute(
+                "UPDATE reports SET pdf_size = ?, accessed = ? WHERE name = ?", (size, time.time(), name)
+            ).rowcount
+        if not updated:
+            _remove(pdf_path)
+            return None
+        return pdf_path
+
+    # --- уборка ---
+
+    def evict(self) -> int:
+        """
+        Удаление истёкших отчётов, затем самых давно запрошенных сверх max_bytes,
+        а также файлов, которых нет в индексе (брошенные временные файлы, старые имена).
+
+        Returns:
+            число удалённых отчётов
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                names: List[str] = [
+                    name for (name,) in self._db.execute(
+                        "SELECT name FROM reports WHERE created < ?", (now - self.ttl,)
+                    )
+                ]
+                total = self._db.execute(
+                    "SELECT COALESCE(SUM(data_size + pdf_size), 0) FROM reports WHERE created >= ?",
+                    (now - self.ttl,),
+                ).fetchone()[0]
+                if total > self.max_bytes:
+                    for name, size in self._db.execute(
+                        "SELECT name, data_size + pdf_size FROM reports WHERE created >= ? ORDER BY accessed",
+                        (now - self.ttl,),
+                    ):
+                        if total <= self.max_bytes:
+                            break
+                        names.append(name)
+                        total -= size
+                self._db.executemany("DELETE FROM reports WHERE name = ?", [(name,) for name in names])
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            known = {name for (name,) in self._db.execute("SELECT name FROM reports")}
+        # Файлы удаляются после фиксации индекса: отчёт пропадает из индекса раньше, чем с диска
+        for name in names:
+            _remove(self.pdf_path(name))
+            _remove(self.data_path(name))
+        self._remove_orphans(known, now)
+        if names:
+            logger.info("Хранилище отчётов: удалено %d отчётов", len(names))
+        return len(names)
+
+    def _remove_orphans(self, known: set, now: float) -> None:
+        for entry in os.scandir(self.directory):
+            if not entry.is_file() or entry.name.startswith(_INDEX_NAME):
+                continue
+            if entry.name.endswith(".tmp"):
+                orphan = now - entry.stat().st_mtime > _STALE_TMP_AGE
+            else:
+                name = f"{os.path.splitext(entry.name)[0]}.pdf"
+                # Данные сохраняются до записи в индекс: свежий файл без строки — ещё не проиндексирован
+                orphan = name not in known and now - entry.stat().st_mtime > _TOUCH_INTERVAL
+            if orphan:
+                _remove(entry.path)
+
+    def _janitor_loop(self) -> None:
+        while not self._stop.wait(self.janitor_interval):
+            try:
+                self.evict()
+            except (OSError, sqlite3.Error) as e:
+                logger.warning("Уборка каталога отчётов не удалась: %s", e)
+
+    def start_janitor(self) -> None:
+        """Фоновая уборка каждые janitor_interval секунд (первая — сразу)"""
+        with self._lock:
+            if self._janitor is not None:
+                return
+            self._stop.clear()
+            self._janitor = threading.Thread(target=self._janitor_loop, name="report-janitor", daemon=True)
+        try:
+            self.evict()
+        except (OSError, sqlite3.Error) as e:
+            logger.warning("Уборка каталога отчётов не удалась: %s", e)
+        self._janitor.start()
+
+    def stop_janitor(self) -> None:
+        with self._lock:
+            janitor, self._janitor = self._janitor, None
+        if janitor is not None:
+            self._stop.set()
+            janitor.join(timeout=5)
+
+
+_report_store: Optional[ReportStore] = None
+_report_store_pid: Optional[int] = None
+_report_store_lock = threading.Lock()
+
+
+def get_report_store() -> ReportStore:
+    """
+    Общее для процесса хранилище отчётов (создается при первом обращении).
+    Процесс пула, созданный через fork, получает собственное хранилище: соединение
+    SQLite и блокировки родителя в нем не используются.
+    """
+    global _report_store, _report_store_pid
+    if _report_store is None or _report_store_pid != os.getpid():
+        with _report_store_lock:
+            if _report_store is None or _report_store_pid != os.getpid():
+                _report_store = ReportStore()
+                _report_store_pid = os.getpid()
+    return _report_store
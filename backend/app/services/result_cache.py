@@ -0,0 +1,248 @@
+"""
+Кэши результатов анализа по хешу содержимого.
+
+ImageResultCache — результаты анализа встроенных изображений.
+
+Одни и те же логотипы, шаблоны и стоковые картинки встречаются в тысячах
+документов, поэтому результат ImageAnalyzer.analyze + AIDetector.detect_ai_signs
+сохраняется по SHA-256 байтов изображения:
+- в памяти (LRU с ограничением по числу записей и объёму);
+- опционально на диске (SQLite), с вытеснением самых давно использованных записей.
+
+Ключ включает версию правил детектора: после изменения правил старые записи
+не используются, а на диске удаляются при открытии базы.
+
+DocumentResultCache — готовые ответы /api/analyze/document для повторно
+загруженных документов (в памяти, с TTL).
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from app.services.ai_detector import RULESET_VERSION
+
+logger = logging.getLogger(__name__)
+
+# Версия формата результата ImageAnalyzer; повышается при изменении структуры metadata
+ANALYZER_RESULT_VERSION = "6"
+
+IMAGE_CACHE_MAX_ENTRIES = max(0, int(os.environ.get("IMAGE_CACHE_MAX_ENTRIES", "2048")))
+IMAGE_CACHE_MAX_BYTES = max(0, int(os.environ.get("IMAGE_CACHE_MAX_MB", "64"))) * 1024 * 1024
+# Путь к SQLite-базе дискового уровня; пусто — дисковый уровень отключен
+IMAGE_CACHE_DB = os.environ.get("IMAGE_CACHE_DB", "").strip()
+IMAGE_CACHE_DB_MAX_BYTES = max(0, int(os.environ.get("IMAGE_CACHE_DB_MAX_MB", "512"))) * 1024 * 1024
+
+DOCUMENT_CACHE_TTL = max(0, int(os.environ.get("DOCUMENT_CACHE_TTL", "3600")))
+DOCUMENT_CACHE_MAX_ENTRIES = max(0, int(os.environ.get("DOCUMENT_CACHE_MAX_ENTRIES", "256")))
+DOCUMENT_CACHE_MAX_BYTES = max(0, int(os.environ.get("DOCUMENT_CACHE_MAX_MB", "128"))) * 1024 * 1024
+
+
+class ImageResultCache:
+    """Двухуровневый кэш (память + SQLite) результатов анализа изображений."""
+
+    def __init__(
+        self,
+        version: Optional[str] = None,
+        max_entries: int = IMAGE_CACHE_MAX_ENTRIES,
+        max_bytes: int = IMAGE_CACHE_MAX_BYTES,
+        db_path: Optional[str] = IMAGE_CACHE_DB or None,
+        db_max_bytes: int = IMAGE_CACHE_DB_MAX_BYTES,
+    ):
+        self.version = version or f"{ANALYZER_RESULT_VERSION}:{RULESET_VERSION}"
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.db_max_bytes = db_max_bytes
+        self._lock = threading.Lock()
+        # Значения хранятся сериализованными: каждый get() отдает независимую копию
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_bytes = 0
+        self._db: Optional[sqlite3.Connection] = None
+        if db_path:
+            self._open_db(db_path)
+
+    def _open_db(self, db_path: str) -> None:
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+            db = sqlite3.connect(db_path, check_same_thread=False, timeout=10)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS image_results ("
+                " digest TEXT PRIMARY KEY, version TEXT NOT NULL, value BLOB NOT NULL,"
+                " size INTEGER NOT NULL, accessed REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS image_results_accessed ON image_results (accessed)")
+            removed = db.execute("DELETE FROM image_results WHERE version != ?", (self.version,)).rowcount
+            db.commit()
+            if removed:
+                logger.info("Кэш изображений: удалено %d записей устаревшей версии правил", removed)
+            self._db = db
+        except sqlite3.Error as e:
+            logger.warning("Дисковый кэш изображений недоступен (%s): %s", db_path, e)
+
+    def _memory_put(self, digest: str, value: bytes) -> None:
+        if not self.max_entries or len(value) > self.max_bytes:
+            return
+        old = self._memory.pop(digest, None)
+        if old is not None:
+            self._memory_bytes -= len(old)
+        self._memory[digest] = value
+        self._memory_bytes += len(value)
+        while self._memory and (len(self._memory) > self.max_entries or self._memory_bytes > self.max_bytes):
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def get(self, digest: str) -> Optional[Tuple[Dict[str, Any], Dict[str, Any]]]:
+        """
+        Returns:
+            (metadata, ai_indicators) или None, если записи нет
+        """
+        with self._lock:
+            value = self._memory.get(digest)
+            if value is not None:
+                self._memory.move_to_end(digest)
+            elif self._db is not None:
+                try:
+                    row = self._db.execute(
+                        "SELECT value FROM image_results WHERE digest = ? AND version = ?", (digest, self.version)
+                    ).fetchone()
+                    if row is not None:
+                        value = bytes(row[0])
+                        self._db.execute("UPDATE image_results SET accessed = ? WHERE digest = ?", (time.time(), digest))
+                        self._db.commit()
+                        self._memory_put(digest, value)
+                except sqlite3.Error as e:
+                    logger.warning("Ошибка чтения дискового кэша изображений: %s", e)
+        if value is None:
+            return None
+        entry = json.loads(value)
+        return entry["metadata"], entry["ai_indicators"]
+
+    def put(self, digest: str, metadata: Dict[str, Any], ai_indicators: Dict[str, Any]) -> None:
+        value = json.dumps(
+            {"metadata": metadata, "ai_indicators": ai_indicators}, ensure_ascii=False, default=str
+        ).encode("utf-8")
+        with self._lock:
+            self._memory_put(digest, value)
+            if self._db is None or len(value) > self.db_max_bytes:
+                return
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO image_results (digest, version, value, size, accessed) VALUES (?, ?, ?, ?, ?)",
+                    (digest, self.version, value, len(value), time.time()),
+                )
+                self._evict_db()
+                self._db.commit()
+            except sqlite3.Error as e:
+                logger.warning("Ошибка записи в дисковый кэш изображений: %s", e)
+
+    def _evict_db(self) -> None:
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM image_results").fetchone()[0]
+        if total <= self.db_max_bytes:
+            return
+        # Удаляем самые давно использованные записи, пока не уложимся в лимит
+        freed = 0
+        to_delete = []
+        for digest, size in self._db.execute("SELECT digest, size FROM image_results ORDER BY accessed"):
+            if total - freed <= self.db_max_bytes:
+                break
+            to_delete.append((digest,))
+            freed += size
+        self._db.executemany("DELETE FROM image_results WHERE digest = ?", to_delete)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+            if self._db is not None:
+                self._db.execute("DELETE FROM image_results")
+                self._db.commit()
+
+
+class DocumentResultCache:
+    """
+    Кэш готовых ответов анализа документа по SHA-256 загруженного файла.
+
+    Хранит ответ API и имя PDF-отчёта; запись живет ttl секунд,
+    при превышении числа записей или объёма вытесняются самые давние.
+    """
+
+    def __init__(
+        self,
+        ttl: int = DOCUMENT_CACHE_TTL,
+        max_entries: int = DOCUMENT_CACHE_MAX_ENTRIES,
+        max_bytes: int = DOCUMENT_CACHE_MAX_BYTES,
+        version: Optional[str] = None,
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.version = version or f"{ANALYZER_RESULT_VERSION}:{RULESET_VERSION}"
+        self._lock = threading.Lock()
+        # digest -> (время записи, сериализованный ответ, имя отчёта)
+        self._entries: "OrderedDict[str, Tuple[float, bytes, str]]" = OrderedDict()
+        self._bytes = 0
+
+    def _key(self, digest: str) -> str:
+        return f"{self.version}:{digest}"
+
+    def _drop(self, key: str) -> None:
+        _, value, _ = self._entries.pop(key)
+        self._bytes -= len(value)
+
+    def get(self, digest: str) -> Optional[Tuple[Dict[str, Any], str]]:
+        """
+        Returns:
+            (ответ анализа, имя PDF-отчёта) или None
+        """
+        key = self._key(digest)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            created, value, report_filename = entry
+            if time.time() - created > self.ttl:
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+        return json.loads(value), report_filename
+
+    def put(self, digest: str, response: Dict[str, Any], report_filename: str) -> None:
+        if not self.max_entries or not self.ttl:
+            return
+        value = json.dumps(response, ensure_ascii=False, default=str).encode("utf-8")
+        if len(value) > self.max_bytes:
+            return
+        key = self._key(digest)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.time(), value, report_filename)
+            self._bytes += len(value)
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                self._drop(next(iter(self._entries)))
+
+    def invalidate(self, digest: str) -> None:
+        with self._lock:
+            if self._key(digest) in self._entries:
+                self._drop(self._key(digest))
+
+
+document_result_cache = DocumentResultCache()
+
+_image_result_cache: Optional[ImageResultCache] = None
+_image_result_cache_lock = threading.Lock()
+
+
+def get_image_result_cache() -> ImageResultCache:
+    """Общий для процесса кэш изображений (создается при первом обращении)"""
+    global _image_result_cache
+    if _image_result_cache is None:
+        with _image_result_cache_lock:
+            if _image_result_cache is None:
+                _image_result_cache = ImageResultCache()
+    return _image_result_cache
@@ -0,0 +1,408 @@
+"""
+Декларативные правила эвристик AIDetector.
+
+Правила описываются в JSON-файле (или YAML, если установлен PyYAML) и при
+загрузке один раз компилируются в плоский план: каждое условие разбирается
+в (номер ячейки вектора признаков, оператор из таблицы, константу) и
+превращается в замыкание. Из текста правил код не генерируется, поэтому
+собственный набор правил (AI_RULESET_PATH) не может выполнить произвольный
+Python. Во время анализа признаки изображения раскладываются в вектор
+(список) и план выполняется без разбора правил и построения словарей весов.
+Шаги score для многих изображений сразу (score_many) выполняются по
+столбцам матрицы признаков NumPy: одно сравнение на столбец для всех строк.
+
+Формат набора правил:
+
+    {
+      "version": "3",
+      "heuristics": ["square_image", ...],
+      "detect": [
+        {"id": ..., "when": ["heuristics_enabled", "!has_gps", "iso < 50"],
+         "heuristic": "no_gps", "anomaly": "Необычно низкий ISO: {iso}"},
+        ...
+      ],
+      "derived": [{"name": "has_strong_indicators", "any": [...]}],
+      "score": [{"when": [...], "add": 25}, {"when": [...], "at_most": 45}, ...]
+    }
+
+Условие — имя признака (истинность), "!имя" (ложность) или сравнение
+"имя op число" (op: <, <=, >, >=, ==, !=). Действия правил detect: heuristic
+(установить эвристику), anomaly (шаблон str.format по признакам),
+anomalies_from (добавить аномалии из списка-признака; skip_overlapping —
+пропуская пересекающиеся с уже найденными), unless_anomaly_contains (не
+добавлять аномалию, если уже найдена аномалия с одной из подстрок). Шаги score
+выполняются по порядку: add, at_least, at_most, return (итог без
+дальнейших шагов).
+
+Версия набора правил (вместе с хешем содержимого) входит в ключ кэша
+результатов: после изменения правил закэшированные результаты не используются.
+"""
+import hashlib
+import json
+import operator
+import os
+import re
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - зависит от окружения
+    np = None
+
+DEFAULT_RULESET_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "rules", "ai_heuristics.json")
+# Путь к собственному набору правил (JSON или YAML); пусто — встроенный набор
+AI_RULESET_PATH = os.environ.get("AI_RULESET_PATH", "").strip() or DEFAULT_RULESET_PATH
+
+_CONDITION_RE = re.compile(
+    r"^\s*(?P<negate>!)?\s*(?P<name>[A-Za-z_][A-Za-z0-9_]*)\s*"
+    r"(?:(?P<op><=|>=|==|!=|<|>)\s*(?P<value>-?\d+(?:\.\d+)?))?\s*$"
+)
+# Операторы сравнения условий; работают и с числами, и со столбцами NumPy
+_OPERATORS: Dict[str, Callable[[Any, Any], Any]] = {
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+# Действия шагов score: новое значение оценки по текущему и значению шага (return — итог)
+_SCORE_ACTIONS: Dict[str, Optional[Callable[[Any, Any], Any]]] = {
+    "add": operator.add,
+    "at_least": max,
+    "at_most": min,
+    "return": None,
+}
+# Действия над столбцом оценок NumPy
+_COLUMN_SCORE_ACTIONS: Dict[str, Callable[[Any, Any], Any]] = {
+    "add": operator.add,
+    "at_least": lambda column, value: np.maximum(column, value),
+    "at_most": lambda column, value: np.minimum(column, value),
+}
+
+# Разобранное условие: (ячейка вектора, оператор или None — истинность, константа, отрицание)
+Condition = Tuple[int, Optional[str], Any, bool]
+# Проверка условий правила над вектором признаков одного изображения
+RowPredicate = Callable[[List[Any]], bool]
+# Действие правила detect: action(вектор, признаки, эвристики, аномалии)
+DetectAction = Callable[[List[Any], Dict[str, Any], Dict[str, bool], List[str]], None]
+
+
+class RulesetError(ValueError):
+    """Некорректный набор правил."""
+
+
+def _mentions(anomalies: List[str], texts: Tuple[str, ...]) -> bool:
+    """Есть ли среди найденных аномалий упоминание одной из подстрок"""
+    return any(text in existing.lower() for existing in anomalies for text in texts)
+
+
+def _extend_anomalies(anomalies: List[str], items: Optional[Iterable[str]], skip_overlapping: bool) -> None:
+    for item in items or ():
+        if skip_overlapping:
+            item_lower = item.lower()
+            if any(item_lower in a.lower() or a.lower() in item_lower for a in anomalies):
+                continue
+        anomalies.append(item)
+
+
+def _row_condition(condition: Condition) -> RowPredicate:
+    slot, op, value, negate = condition
+    if op is None:
+        if negate:
+            return lambda v: not v[slot]
+        return lambda v: bool(v[slot])
+    compare = _OPERATORS[op]
+    return lambda v: v[slot] is not None and compare(v[slot], value)
+
+
+def _row_predicate(conditions: List[Condition], any_of: bool = False) -> RowPredicate:
+    """Замыкание, проверяющее все (any_of — хотя бы одно) условия"""
+    checks = tuple(_row_condition(condition) for condition in conditions)
+    if not checks:
+        return lambda v: not any_of
+    if len(checks) == 1:
+        return checks[0]
+    if any_of:
+        return lambda v: any(check(v) for check in checks)
+
+    def check_all(v: List[Any]) -> bool:
+        for check in checks:
+            if not check(v):
+                return False
+        return True
+
+    return check_all
+
+
+def _column_predicate(conditions: List[Condition], any_of: bool = False) -> Callable[[Any], Any]:
+    """
+    Проверка условий над матрицей признаков NumPy (строка — изображение): маска строк.
+    Отсутствующий признак (None) хранится как NaN: он ложен и не проходит ни одно сравнение.
+    """
+
+    def mask(matrix: Any) -> Any:
+        result = np.full(matrix.shape[0], not any_of)
+        for slot, op, value, negate in conditions:
+            column = matrix[:, slot]
+            if op is None:
+                passed = (column != 0) & ~np.isnan(column)
+                if negate:
+                    passed = ~passed
+            else:
+                passed = _OPERATORS[op](column, value)
+            result = (result | passed) if any_of else (result & passed)
+        return result
+
+    return mask
+
+
+class CompiledRuleset:
+    """
+    Набор правил, скомпилированный в плоский план над вектором признаков.
+
+    Условия превращаются в замыкания над ячейками списка-вектора (v[3], not v[5],
+    v[12] is not None and v[12] < 50), правила detect — в список
+    (проверка, действия), шаги score — в список (проверка, действие, значение).
+    """
+
+    def __init__(self, spec: Dict[str, Any], features: Sequence[str], score_features: Sequence[str], digest: str = ""):
+        if not isinstance(spec, dict) or "version" not in spec:
+            raise RulesetError("В наборе правил нет поля version")
+        self.declared_version = str(spec["version"])
+        # Версия для ключей кэша: объявленная версия + хеш содержимого файла
+        self.version = f"{self.declared_version}:{digest[:12]}" if digest else self.declared_version
+        self.heuristics: Tuple[str, ...] = tuple(spec.get("heuristics", ()))
+
+        # Вектор этапа detect: признаки изображения, затем эвристики (заполняются по ходу плана)
+        self._detect_names = list(features)
+        detect_slots = self._slots(self._detect_names + list(self.heuristics))
+        self._detect_plan = [self._compile_detect_rule(rule, detect_slots) for rule in spec.get("detect", ())]
+        self._detect_padding = [False] * len(self.heuristics)
+
+        # Вектор этапа score: признаки итога, эвристики, затем производные признаки
+        derived = list(spec.get("derived", ()))
+        derived_names = [self._required(item, "name") for item in derived]
+        self._score_names = list(score_features) + list(self.heuristics)
+        score_slots = self._slots(self._score_names + derived_names)
+        self._derived_plan = [
+            (score_slots[name], *self._compile_derived(item, score_slots)) for name, item in zip(derived_names, derived)
+        ]
+        self._score_plan = [self._compile_score_step(step, score_slots) for step in spec.get("score", ())]
+        self._score_padding = [None] * len(derived_names)
+        # Те же производные признаки и шаги в виде замыканий для оценки одного изображения
+        self._row_derived = [(slot, _row_predicate(conditions, any_of)) for slot, conditions, any_of in self._derived_plan]
+        self._row_steps = [
+            (_row_predicate(conditions), _SCORE_ACTIONS[action], value) for conditions, action, value in self._score_plan
+        ]
+
+    @staticmethod
+    def _slots(names: List[str]) -> Dict[str, int]:
+        slots: Dict[str, int] = {}
+        for name in names:
+            if name in slots:
+                raise RulesetError(f"Имя признака повторяется: {name}")
+            slots[name] = len(slots)
+        return slots
+
+    @staticmethod
+    def _required(item: Dict[str, Any], key: str) -> Any:
+        if key not in item:
+            raise RulesetError(f"В правиле {item!r} нет поля {key}")
+        return item[key]
+
+    @staticmethod
+    def _parse_condition(condition: str, slots: Dict[str, int]) -> Condition:
+        match = _CONDITION_RE.match(str(condition))
+        if match is None:
+            raise RulesetError(f"Некорректное условие: {condition!r}")
+        name = match.group("name")
+        if name not in slots:
+            raise RulesetError(f"Неизвестный признак в условии {condition!r}")
+        if not match.group("op"):
+            return slots[name], None, None, bool(match.group("negate"))
+        if match.group("negate"):
+            raise RulesetError(f"Отрицание сравнения не поддерживается: {condition!r}")
+        value = match.group("value")
+        return slots[name], match.group("op"), float(value) if "." in value else int(value), False
+
+    def _parse_conditions(self, conditions: Iterable[str], slots: Dict[str, int]) -> List[Condition]:
+        return [self._parse_condition(condition, slots) for condition in conditions]
+
+    def _compile_detect_rule(self, rule: Dict[str, Any], slots: Dict[str, int]) -> Tuple[RowPredicate, List[DetectAction]]:
+        actions: List[DetectAction] = []
+        heuristic = rule.get("heuristic")
+        if heuristic is not None:
+            if heuristic not in self.heuristics:
+                raise RulesetError(f"Эвристика {heuristic!r} не объявлена в heuristics")
+            heuristic_slot = slots[heuristic]
+
+            def set_heuristic(v: List[Any], features: Dict[str, Any], heuristics: Dict[str, bool], anomalies: List[str]) -> None:
+                heuristics[heuristic] = True
+                v[heuristic_slot] = True
+
+            actions.append(set_heuristic)
+
+        anomaly_actions: List[DetectAction] = []
+        anomaly = rule.get("anomaly")
+        if anomaly is not None:
+            if "{" in anomaly:
+                anomaly_actions.append(lambda v, features, heuristics, anomalies: anomalies.append(anomaly.format(**features)))
+            else:
+                anomaly_actions.append(lambda v, features, heuristics, anomalies: anomalies.append(anomaly))
+        source = rule.get("anomalies_from")
+        if source is not None:
+            if source not in slots:
+                raise RulesetError(f"Неизвестный признак в anomalies_from: {source!r}")
+            source_slot = slots[source]
+            skip_overlapping = bool(rule.get("skip_overlapping"))
+            anomaly_actions.append(
+                lambda v, features, heuristics, anomalies: _extend_anomalies(anomalies, v[source_slot], skip_overlapping)
+            )
+
+        # Подстроки (в нижнем регистре), при наличии которых в уже найденных аномалиях правило не добавляет свою
+        unless = tuple(str(text).lower() for text in rule.get("unless_anomaly_contains", ()))
+        if unless and anomaly_actions:
+            guarded = tuple(anomaly_actions)
+
+            def unless_mentioned(v: List[Any], features: Dict[str, Any], heuristics: Dict[str, bool], anomalies: List[str]) -> None:
+                if not _mentions(anomalies, unless):
+                    for action in guarded:
+                        action(v, features, heuristics, anomalies)
+
+            anomaly_actions = [unless_mentioned]
+        actions.extend(anomaly_actions)
+        return _row_predicate(self._parse_conditions(rule.get("when", ()), slots)), actions
+
+    def _compile_derived(self, item: Dict[str, Any], slots: Dict[str, int]) -> Tuple[List[Condition], bool]:
+        if ("all" in item) == ("any" in item):
+            raise RulesetError(f"Производный признак {item.get('name')!r}: нужно ровно одно из all/any")
+        if "all" in item:
+            return self._parse_conditions(item["all"], slots), False
+        return self._parse_conditions(item["any"], slots), True
+
+    def _compile_score_step(self, step: Dict[str, Any], slots: Dict[str, int]) -> Tuple[List[Condition], str, Any]:
+        actions = [action for action in _SCORE_ACTIONS if action in step]
+        if len(actions) != 1:
+            raise RulesetError(f"Шаг оценки {step!r}: нужно ровно одно действие из {', '.join(_SCORE_ACTIONS)}")
+        action = actions[0]
+        value = step[action]
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise RulesetError(f"Шаг оценки {step!r}: значение должно быть числом")
+        return self._parse_conditions(step.get("when", ()), slots), action, value
+
+    def detect(self, features: Dict[str, Any]) -> Tuple[Dict[str, bool], List[str]]:
+        """
+        Выполнение правил detect.
+
+        Returns:
+            (сработавшие эвристики, аномалии в порядке правил)
+        """
+        vector = [features.get(name) for name in self._detect_names]
+        vector.extend(self._detect_padding)
+        heuristics: Dict[str, bool] = {}
+        anomalies: List[str] = []
+        for when, actions in self._detect_plan:
+            if when(vector):
+                for action in actions:
+                    action(vector, features, heuristics, anomalies)
+        return heuristics, anomalies
+
+    def _score_vector(self, features: Dict[str, Any]) -> List[Any]:
+        vector = [features.get(name) for name in self._score_names]
+        vector.extend(self._score_padding)
+        return vector
+
+    def score(self, features: Dict[str, Any]) -> int:
+        """Вероятность (0–100) по признакам одного изображения"""
+        vector = self._score_vector(features)
+        for slot, predicate in self._row_derived:
+            vector[slot] = predicate(vector)
+        s = 0
+        for when, action, value in self._row_steps:
+            if when(vector):
+                if action is None:
+                    return int(value)
+                s = action(s, value)
+        return int(s)
+
+    def score_many(self, rows: Sequence[Dict[str, Any]]) -> List[int]:
+        """
+        Вероятности для многих изображений одним проходом по шагам score: каждое условие
+        проверяется сразу для всего столбца признаков. Без NumPy (или с нечисловыми
+        признаками) изображения оцениваются по одному; результат тот же, что у score.
+        """
+        if np is None or len(rows) < 2:
+            return [self.score(features) for features in rows]
+        try:
+            matrix = np.array(
+                [[np.nan if value is None else value for value in self._score_vector(features)] for features in rows],
+                dtype=np.float64,
+            )
+        except (TypeError, ValueError):
+            return [self.score(features) for features in rows]
+
+        for slot, conditions, any_of in self._derived_plan:
+            matrix[:, slot] = _column_predicate(conditions, any_of)(matrix)
+        scores = np.zeros(len(rows))
+        returned = np.zeros(len(rows), dtype=bool)
+        for conditions, action, value in self._score_plan:
+            mask = _column_predicate(conditions)(matrix) & ~returned
+            if not mask.any():
+                continue
+            if action == "return":
+                scores[mask] = int(value)
+                returned |= mask
+            else:
+                scores[mask] = _COLUMN_SCORE_ACTIONS[action](scores[mask], value)
+        # int() отбрасывает дробную часть, как и у score
+        return [int(score) for score in scores]
+
+
+def _read_spec(path: str) -> Tuple[Dict[str, Any], str]:
+    with open(path, "rb") as f:
+        raw = f.read()
+    digest = hashlib.sha256(raw).hexdigest()
+    if path.lower().endswith((".yaml", ".yml")):
+        try:
+            import yaml
+        except ImportError:
+            raise RulesetError("Для набора правил в формате YAML нужен PyYAML (pip install pyyaml)")
+        spec = yaml.safe_load(raw)
+    else:
+        spec = json.loads(raw.decode("utf-8"))
+    return spec, digest
+
+
+def load_ruleset(
+    path: str,
+    features: Sequence[str],
+    score_features: Sequence[str],
+) -> CompiledRuleset:
+    """Загрузка и компиляция набора правил из JSON/YAML-файла"""
+    try:
+        spec, digest = _read_spec(path)
+    except RulesetError:
+        raise
+    except Exception as e:
+        raise RulesetError(f"Не удалось прочитать набор правил {path}: {e!s}")
+    return CompiledRuleset(spec, features, score_features, digest=digest)
+
+
+_rulesets: Dict[Tuple[str, Tuple[str, ...], Tuple[str, ...]], CompiledRuleset] = {}
+_rulesets_lock = threading.Lock()
+
+
+def get_ruleset(
+    features: Sequence[str],
+    score_features: Sequence[str],
+    path: Optional[str] = None,
+) -> CompiledRuleset:
+    """Набор правил, скомпилированный один раз на процесс"""
+    key = (path or AI_RULESET_PATH, tuple(features), tuple(score_features))
+    with _rulesets_lock:
+        ruleset = _rulesets.get(key)
+        if ruleset is None:
+            ruleset = _rulesets[key] = load_ruleset(key[0], features, score_features)
+    return ruleset
@@ -0,0 +1,190 @@
+"""
+Выполнение блокирующей работы (анализ документа, ExifTool, генерация PDF) вне event loop.
+
+Пул ограничен: одновременно выполняется не больше max_workers задач, ещё
+max_pending ждут в очереди. Когда очередь заполнена, новая задача сразу
+получает ExecutorBusyError — API отвечает 503, а не копит запросы в памяти.
+
+Задача пула процессов, не уложившаяся в timeout, завершается вместе с пулом
+(процессы останавливаются, пул пересоздается при следующей задаче). Остальные
+задачи остановленного пула завершаются ошибкой ExecutorRestartedError — их
+можно повторить в новом пуле. Пул, сломанный упавшим процессом, тоже
+пересоздается при следующей задаче, но его задачи получают BrokenExecutor:
+какая из них уронила процесс, неизвестно, и повтор может уронить новый пул.
+"""
+import asyncio
+import os
+import threading
+import logging
+from concurrent.futures import BrokenExecutor, Executor, Future, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Тип пула: "thread" (по умолчанию) или "process"
+ANALYSIS_EXECUTOR = os.environ.get("ANALYSIS_EXECUTOR", "thread").strip().lower()
+# Сколько документов анализируется одновременно
+ANALYSIS_MAX_WORKERS = max(1, int(os.environ.get("ANALYSIS_MAX_WORKERS", "2")))
+# Сколько документов может ждать в очереди сверх выполняемых
+ANALYSIS_MAX_PENDING = max(0, int(os.environ.get("ANALYSIS_MAX_PENDING", "8")))
+
+
+class ExecutorBusyError(RuntimeError):
+    """Очередь пула заполнена, задача не принята."""
+
+
+class ExecutorTimeoutError(RuntimeError):
+    """Задача не уложилась в отведённое время."""
+
+
+class ExecutorRestartedError(BrokenExecutor):
+    """Пул остановлен из-за чужой задачи, не уложившейся во время; задачу можно повторить."""
+
+
+class BoundedExecutor:
+    """Пул потоков или процессов с ограничением числа принятых задач."""
+
+    def __init__(
+        self,
+        kind: str = ANALYSIS_EXECUTOR,
+        max_workers: int = ANALYSIS_MAX_WORKERS,
+        max_pending: int = ANALYSIS_MAX_PENDING,
+        name: str = "analysis",
+        initializer: Optional[Callable[[], None]] = None,
+    ):
+        """
+        Args:
+            name: имя пула (префикс потоков, журнал)
+            initializer: вызывается в каждом рабочем потоке/процессе при его запуске
+        """
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Неизвестный тип пула: {kind} (ожидался thread или process)")
+        self.kind = kind
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.name = name
+        self.initializer = initializer
+        self._executor: Optional[Executor] = None
+        self._lock = threading.Lock()
+        self._accepted = 0
+        # Сколько раз пул останавливался из-за зависшей задачи
+        self._restarts = 0
+
+    @property
+    def accepted(self) -> int:
+        """Число выполняемых и ожидающих задач"""
+        return self._accepted
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers, initializer=self.initializer)
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix=self.name, initializer=self.initializer
+                )
+            logger.info(
+                "Создан пул %s: %s, workers=%d, очередь=%d", self.name, self.kind, self.max_workers, self.max_pending
+            )
+        return self._executor
+
+    def _release(self, _future) -> None:
+        with self._lock:
+            self._accepted -= 1
+
+    def submit(self, func: Callable[..., Any], *args: Any) -> Future:
+        """
+        Постановка func(*args) в пул без ожидания результата.
+
+        Для пула процессов func и аргументы должны сериализоваться pickle.
+
+        Raises:
+            ExecutorBusyError: в пуле нет места
+        """
+        with self._lock:
+            executor = self._get_executor()
+            if self._accepted >= self.max_workers + self.max_pending:
+                raise ExecutorBusyError("Сервис перегружен, повторите запрос позже")
+            self._accepted += 1
+        try:
+            try:
+                future = executor.submit(func, *args)
+            except BrokenExecutor as e:
+                # Процесс пула упал (например, по памяти): сломанный пул заменяется новым
+                logger.warning("Пул %s сломан (%s), создается новый", self.name, e)
+                self._discard(executor)
+                with self._lock:
+                    executor = self._get_executor()
+                future = executor.submit(func, *args)
+        except Exception:
+            self._release(None)
+            raise
+        # Слот освобождается по завершении задачи, а не ожидания: отменённый клиентом запрос
+        # продолжает выполняться и должен учитываться в лимите
+        future.add_done_callback(self._release)
+        return future
+
+    async def run(self, func: Callable[..., Any], *args: Any, timeout: Optional[float] = None) -> Any:
+        """
+        Выполнение func(*args) в пуле.
+
+        Raises:
+            ExecutorBusyError: в пуле нет места
+            ExecutorTimeoutError: задача не завершилась за timeout секунд (пул процессов
+                при этом перезапускается, поток пула дорабатывает задачу в фоне)
+            ExecutorRestartedError: пул остановлен из-за чужой зависшей задачи (при ожидании с timeout)
+            BrokenExecutor: процесс пула упал (возможно, на этой задаче)
+        """
+        future = self.submit(func, *args)
+        restarts = self._restarts
+        if timeout is None:
+            return await asyncio.wrap_future(future)
+        waiter = asyncio.wrap_future(future)
+        try:
+            return await asyncio.wait_for(asyncio.shield(waiter), timeout)
+        except BrokenExecutor as e:
+            # Процессы остановлены из-за чужого таймаута (свой — ветка TimeoutError ниже)
+            if self._restarts != restarts:
+                raise ExecutorRestartedError(f"Пул {self.name} перезапущен из-за зависшей задачи") from e
+            raise
+        except asyncio.TimeoutError:
+            # Результат брошенной задачи (в т.ч. ошибка остановленного пула) больше никому не нужен
+            waiter.add_done_callback(lambda done: done.cancelled() or done.exception())
+            logger.warning("Задача пула %s не завершилась за %s сек", self.name, timeout)
+            if self.kind == "process":
+                self._terminate()
+            raise ExecutorTimeoutError(f"Задача не завершилась за {timeout} сек")
+        except asyncio.CancelledError:
+            # Ожидание защищено shield: отмененная задача пула — это задача остановленного пула
+            if future.cancelled():
+                raise ExecutorRestartedError(f"Пул {self.name} остановлен, задача отменена")
+            raise
+
+    def _terminate(self) -> None:
+        """Остановка процессов пула (зависшая задача); задачи пула завершаются ошибкой"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+            if executor is not None:
+                self._restarts += 1
+        if executor is None:
+            return
+        # У ProcessPoolExecutor нет публичного способа прервать выполняющуюся задачу
+        for process in list((getattr(executor, "_processes", None) or {}).values()):
+            process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _discard(self, executor: Executor) -> None:
+        """Замена сломанного пула: следующая задача создаст новый"""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+analysis_executor = BoundedExecutor()
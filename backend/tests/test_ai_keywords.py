@@ -0,0 +1,65 @@
+"""Поиск упоминаний ИИ-инструментов по границам слов."""
+import random
+import re
+
+import pytest
+
+from app.services.ai_keywords import AI_SOFTWARE_KEYWORDS, KeywordMatcher, get_ai_keyword_matcher
+
+
+def naive_find(text):
+    """Эталон: отдельное регулярное выражение на каждое слово"""
+    return {
+        keyword for keyword in AI_SOFTWARE_KEYWORDS
+        if re.search(r"(?<!\w)" + re.escape(keyword) + r"(?!\w)", text.lower())
+    }
+
+
+@pytest.fixture(scope="module")
+def matcher():
+    return get_ai_keyword_matcher()
+
+
+@pytest.mark.parametrize("text", [
+    "Organization chart",
+    "Sorange Ltd",
+    "Pikachu",
+    "regenerated thumbnail",
+    "Leonardo_da_Vinci",
+    "gan2",
+])
+def test_no_match_inside_words(matcher, text):
+    assert matcher.find(text) == []
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("GAN output", ["gan"]),
+    ("Made with Sora.", ["sora"]),
+    ("Stable Diffusion XL", ["stable diffusion", "diffusion"]),
+    ("Generated by DALL·E 3", ["generated by", "generated", "dall·e"]),
+    ("midjourney; Midjourney v6", ["midjourney"]),
+    ("(runway) / pika", ["runway", "pika"]),
+    ("Adobe Photoshop 25.0", []),
+])
+def test_matches_on_word_boundaries(matcher, text, expected):
+    assert matcher.find(text) == expected
+
+
+def test_matches_naive_search():
+    words = ["photo", "ai", "art", "generated", "by", "stable", "diffusion", "organ", "gan", "sora", "dall-e",
+             "comfy", "ui", "open", "openai", "novel", "x", "-", ",", "machine", "learning", "vae", "s"]
+    rng = random.Random(0)
+    matcher = KeywordMatcher(AI_SOFTWARE_KEYWORDS)
+    for _ in range(2000):
+        text = " ".join(rng.choice(words) for _ in range(rng.randint(1, 8)))
+        text = text.replace(" - ", "-") if rng.random() < 0.3 else text
+        assert set(matcher.find(text)) == naive_find(text), text
+
+
+def test_scan_reports_fields(matcher):
+    fields = [("Software", "ComfyUI"), ("Artist", "Jane"), ("Description", "AI art, generated")]
+    assert matcher.scan(fields) == [
+        {"keyword": "comfyui", "field": "Software"},
+        {"keyword": "ai art", "field": "Description"},
+        {"keyword": "generated", "field": "Description"},
+    ]
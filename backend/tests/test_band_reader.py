@@ -0,0 +1,103 @@
+"""Потоковое чтение PNG и TIFF полосами против полного декодирования PIL."""
+import io
+import struct
+import tracemalloc
+import zlib
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from app.services.band_reader import open_band_reader
+
+# Маленький предел полосы: изображение читается десятками полос
+BAND_BYTES = 16 * 1024
+
+
+def sample_image(mode, size=(173, 211)):
+    """Шум вперемешку с градиентом: кодировщик PNG выбирает для строк разные фильтры"""
+    rng = np.random.default_rng(0)
+    width, height = size
+    gradient = (np.arange(width)[None, :] + np.arange(height)[:, None]) % 256
+    gray = np.where(rng.random((height, width)) < 0.5, gradient, rng.integers(0, 256, (height, width)))
+    if mode == "I;16":
+        return Image.fromarray((gray * 257).astype(np.uint16))
+    channels = {"L": 1, "P": 1, "LA": 2, "RGB": 3, "RGBA": 4}[mode]
+    pixels = np.stack([np.roll(gray, 7 * i, axis=1) for i in range(channels)], axis=2).astype(np.uint8)
+    image = Image.fromarray(pixels[:, :, 0] if channels == 1 else pixels)
+    return image.convert("P") if mode == "P" else image
+
+
+def encode(image, fmt, **params):
+    buf = io.BytesIO()
+    image.save(buf, fmt, **params)
+    return buf.getvalue()
+
+
+def assert_same_pixels(data):
+    full = Image.open(io.BytesIO(data))
+    full.load()
+    if full.mode == "P":
+        full = full.convert("RGB")
+    reader = open_band_reader(data, BAND_BYTES)
+    assert reader is not None
+    next_row = 0
+    with reader:
+        for top, band in reader.bands():
+            assert top == next_row and band.width == full.width
+            expected = full.crop((0, top, full.width, top + band.height))
+            assert np.array_equal(np.asarray(band.convert(full.mode)), np.asarray(expected))
+            next_row = top + band.height
+    assert top > 0 and next_row == full.height
+
+
+def interlaced(png):
+    """PNG с флагом чересстрочности в IHDR (PIL такие не записывает)"""
+    data = bytearray(png)
+    data[28] = 1
+    data[29:33] = struct.pack(">I", zlib.crc32(data[12:29]))
+    return bytes(data)
+
+
+@pytest.mark.parametrize("mode", ["L", "LA", "RGB", "RGBA", "P"])
+def test_png(mode):
+    assert_same_pixels(encode(sample_image(mode), "PNG"))
+
+
+@pytest.mark.parametrize("compression", [None, "tiff_lzw", "tiff_deflate", "packbits"])
+@pytest.mark.parametrize("tile", [None, (16, 16)], ids=["strips", "tiles"])
+def test_tiff(compression, tile):
+    # Strip и тайлы меньше предела полосы: полоса собирается из нескольких фрагментов
+    params = {"compression": compression, "strip_size": 4096}
+    if tile is not None:
+        params["tile"] = tile
+    assert_same_pixels(encode(sample_image("RGB"), "TIFF", **params))
+
+
+def test_uncompressed_tiff_strip_is_split_by_rows():
+    assert_same_pixels(encode(sample_image("RGB"), "TIFF", strip_size=10 ** 7))
+
+
+@pytest.mark.parametrize("fmt", ["PNG", "TIFF"])
+def test_buffer_is_read_without_copy(fmt):
+    data = bytearray(encode(sample_image("RGB", (1024, 1024)), fmt))
+    tracemalloc.start()
+    try:
+        reader = open_band_reader(memoryview(data), BAND_BYTES)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    with reader:
+        assert reader.size == (1024, 1024)
+    assert peak < len(data) // 4
+    assert_same_pixels(memoryview(data))
+
+
+@pytest.mark.parametrize("data", [
+    interlaced(encode(sample_image("RGB"), "PNG")),
+    encode(sample_image("I;16"), "PNG"),
+    encode(sample_image("RGB"), "JPEG"),
+    b"not an image",
+], ids=["interlaced-png", "16-bit-png", "jpeg", "garbage"])
+def test_unsupported_images_are_not_streamed(data):
+    assert open_band_reader(data, BAND_BYTES) is None
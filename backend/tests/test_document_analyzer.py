@@ -0,0 +1,57 @@
+"""Сводный результат анализа документа."""
+import io
+import zipfile
+
+from PIL import Image
+
+from app.services.document_analyzer import DocumentAnalyzer
+from tests.test_document_archive import make_docx
+
+
+def jpeg_with_software(software, color):
+    exif = Image.Exif()
+    exif[0x0131] = software
+    buf = io.BytesIO()
+    Image.new("RGB", (64, 48), color).save(buf, "JPEG", exif=exif.tobytes())
+    return buf.getvalue()
+
+
+def png_square():
+    buf = io.BytesIO()
+    Image.new("RGB", (1024, 1024), (200, 200, 200)).save(buf, "PNG")
+    return buf.getvalue()
+
+
+def test_software_detected_keeps_archive_order():
+    document = make_docx({
+        "image1.jpg": (jpeg_with_software("Midjourney v6", (255, 0, 0)), zipfile.ZIP_STORED),
+        "image2.jpg": (jpeg_with_software("DALL-E 3 openai", (0, 255, 0)), zipfile.ZIP_STORED),
+        "image3.jpg": (jpeg_with_software("Midjourney", (0, 0, 255)), zipfile.ZIP_STORED),
+    })
+    analyzer = DocumentAnalyzer(use_cache=False, use_hash_index=False, pixel_analysis=False)
+    result = analyzer.analyze_document(document)
+
+    per_image = [image["ai_indicators"]["software_detected"] for image in result["images"]]
+    assert per_image[:2] == [["Midjourney v6", "Midjourney"], ["DALL-E 3 openai", "Dall-E", "Openai"]]
+    assert result["aggregated"]["software_detected"] == [
+        "Midjourney v6", "Midjourney", "DALL-E 3 openai", "Dall-E", "Openai",
+    ]
+
+
+def test_batch_scoring_matches_streaming():
+    document = make_docx({
+        "image1.jpg": (jpeg_with_software("Midjourney v6", (255, 0, 0)), zipfile.ZIP_STORED),
+        "image2.png": (png_square(), zipfile.ZIP_DEFLATED),
+        "image3.jpg": (jpeg_with_software("Adobe Photoshop", (0, 0, 255)), zipfile.ZIP_DEFLATED),
+    })
+    analyzer = DocumentAnalyzer(use_cache=False, use_hash_index=False, pixel_analysis=False)
+    streamed = {}
+    batch = analyzer.analyze_document(document)
+    stream = analyzer.analyze_document(document, on_image=lambda index, image: streamed.setdefault(index, image))
+
+    def verdicts(result):
+        return [image["ai_indicators"] for image in result["images"]]
+
+    assert verdicts(batch) == verdicts(stream) == [streamed[index]["ai_indicators"] for index in range(3)]
+    assert [indicators["ai_probability"] for indicators in verdicts(batch)] != [0, 0, 0]
+    assert batch["aggregated"] == stream["aggregated"]
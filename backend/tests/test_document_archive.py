@@ -0,0 +1,163 @@
+"""Индекс архива документа, чтение членов архива и дедупликация изображений."""
+import hashlib
+import io
+import os
+import struct
+import tracemalloc
+import zipfile
+
+import pytest
+
+from app.services import document_analyzer
+from app.services.document_analyzer import ArchiveIndex, DocumentAnalyzer
+
+DOCUMENT_XML = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body/></w:document>'
+)
+
+
+def make_docx(media, extra=None):
+    """DOCX в памяти: media — {имя в word/media: (содержимое, способ сжатия)}"""
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        zf.writestr("[Content_Types].xml", "<Types/>")
+        zf.writestr("word/document.xml", DOCUMENT_XML)
+        for name, (data, compress_type) in media.items():
+            zf.writestr(f"word/media/{name}", data, compress_type=compress_type)
+        for name, data in (extra or {}).items():
+            zf.writestr(name, data)
+    return buf.getvalue()
+
+
+def understate_size(document, member, size):
+    """Занижение размера члена архива в центральном каталоге"""
+    data = bytearray(document)
+    name = member.encode()
+    pos = data.find(b"PK\x01\x02")
+    while pos >= 0:
+        name_length = struct.unpack("<H", data[pos + 28:pos + 30])[0]
+        if data[pos + 46:pos + 46 + name_length] == name:
+            struct.pack_into("<I", data, pos + 24, size)
+        pos = data.find(b"PK\x01\x02", pos + 4)
+    return bytes(data)
+
+
+@pytest.fixture
+def analyzer():
+    return DocumentAnalyzer(use_cache=False, use_hash_index=False, pixel_analysis=False, extract_workers=1)
+
+
+def extract(analyzer, document, source=True):
+    with zipfile.ZipFile(io.BytesIO(document)) as zf:
+        members = DocumentAnalyzer._image_members(ArchiveIndex(zf), DocumentAnalyzer.DOCX_MEDIA_PREFIX)
+        batches = analyzer._extract_images(zf, members, document if source else None)
+        return [image for batch in batches for image in batch]
+
+
+def test_archive_index_lookup():
+    document = make_docx({"Image1.PNG": (b"png", zipfile.ZIP_STORED)}, extra={"docProps/core.xml": "<core/>"})
+    with zipfile.ZipFile(io.BytesIO(document)) as zf:
+        index = ArchiveIndex(zf)
+    assert index.top_dirs == {"word", "docprops"}
+    assert index.get("DOCPROPS\\Core.xml").path == "docProps/core.xml"
+    assert index.get("word/missing.xml") is None
+    member = index.get("word/media/image1.png")
+    assert (member.filename, member.extension, member.size) == ("Image1.PNG", ".png", 3)
+    assert [m.path for m in index.with_prefix("word/")] == ["word/document.xml", "word/media/Image1.PNG"]
+
+
+@pytest.mark.parametrize("source", [True, False], ids=["mapped", "zipfile"])
+def test_identical_images_are_deduplicated(analyzer, source):
+    first, second = os.urandom(4096), os.urandom(4096)
+    document = make_docx({
+        "image1.png": (first, zipfile.ZIP_DEFLATED),
+        "image2.png": (second, zipfile.ZIP_STORED),
+        "image3.png": (first, zipfile.ZIP_STORED),
+        "notes.txt": (b"not an image", zipfile.ZIP_STORED),
+    })
+    images = extract(analyzer, document, source)
+
+    assert [image["filename"] for image in images] == ["image1.png", "image2.png", "image3.png"]
+    assert [bytes(image["data"]) for image in images] == [first, second, first]
+    assert "duplicate_of" not in images[0] and "duplicate_of" not in images[1]
+    assert images[2]["duplicate_of"] == "word/media/image1.png"
+    assert images[2]["data"] is images[0]["data"]
+    assert images[2]["sha256"] == images[0]["sha256"] != images[1]["sha256"]
+
+
+def test_stored_member_is_read_without_copy(analyzer):
+    data = os.urandom(1024)
+    images = extract(analyzer, make_docx({"image1.png": (data, zipfile.ZIP_STORED)}))
+    assert isinstance(images[0]["data"], memoryview)
+    assert bytes(images[0]["data"]) == data
+
+
+def test_parallel_extraction_matches_sequential():
+    media = {f"image{i}.png": (os.urandom(300 * 1024), zipfile.ZIP_DEFLATED) for i in range(8)}
+    document = make_docx(media)
+    parallel = DocumentAnalyzer(use_cache=False, use_hash_index=False, pixel_analysis=False, extract_workers=4)
+    images = extract(parallel, document)
+    assert [bytes(image["data"]) for image in images] == [data for data, _ in media.values()]
+
+
+@pytest.mark.parametrize("source", [True, False], ids=["mapped", "zipfile"])
+def test_understated_member_size_is_rejected(analyzer, source):
+    # 64 МБ нулей, в каталоге — 16 байт: распаковка должна остановиться на заявленном размере
+    document = make_docx({"image1.png": (bytes(64 * 1024 * 1024), zipfile.ZIP_DEFLATED)})
+    document = understate_size(document, "word/media/image1.png", 16)
+    tracemalloc.start()
+    try:
+        with pytest.raises(ValueError, match="DOCX/PPTX"):
+            extract(analyzer, document, source)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert peak < 8 * 1024 * 1024
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_images_are_read_in_batches_within_inflight_budget(monkeypatch, workers):
+    # 12 МБ изображений при пределе 4 МБ: в памяти не больше одной порции
+    monkeypatch.setattr(document_analyzer, "ZIP_INFLIGHT_BYTES", 4 * 1024 * 1024)
+    media = {f"image{i}.png": (os.urandom(1024 * 1024), zipfile.ZIP_DEFLATED) for i in range(12)}
+    document = make_docx(media)
+    analyzer = DocumentAnalyzer(use_cache=False, use_hash_index=False, pixel_analysis=False, extract_workers=workers)
+    digests = []
+    with zipfile.ZipFile(io.BytesIO(document)) as zf:
+        members = DocumentAnalyzer._image_members(ArchiveIndex(zf), DocumentAnalyzer.DOCX_MEDIA_PREFIX)
+        tracemalloc.start()
+        try:
+            for batch in analyzer._extract_images(zf, members, document):
+                assert sum(image["size"] for image in batch) <= document_analyzer.ZIP_INFLIGHT_BYTES
+                for image in batch:
+                    digests.append(hashlib.sha256(image.pop("data")).hexdigest())
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    assert digests == [hashlib.sha256(data).hexdigest() for data, _ in media.values()]
+    # Сверх предела — только буферы распаковки (части по 64 КБ в каждом потоке)
+    assert peak <= document_analyzer.ZIP_INFLIGHT_BYTES + 512 * 1024
+
+
+def test_document_is_analyzed_batch_by_batch(monkeypatch):
+    monkeypatch.setattr(document_analyzer, "ZIP_INFLIGHT_BYTES", 64 * 1024)
+    media = {f"image{i}.png": (os.urandom(24 * 1024), zipfile.ZIP_DEFLATED) for i in range(6)}
+    media["image6.png"] = media["image0.png"]
+    analyzer = DocumentAnalyzer(use_cache=False, use_hash_index=False, pixel_analysis=False)
+    analyze_many = analyzer.image_analyzer.analyze_many
+    batches = []
+
+    def recording_analyze_many(paths, contents, **kwargs):
+        batches.append(sum(len(data) for data in contents))
+        return analyze_many(paths, contents=contents, **kwargs)
+
+    monkeypatch.setattr(analyzer.image_analyzer, "analyze_many", recording_analyze_many)
+    progress = []
+    result = analyzer.analyze_document(make_docx(media), progress=lambda done, total: progress.append((done, total)))
+
+    assert len(batches) == 3 and max(batches) <= document_analyzer.ZIP_INFLIGHT_BYTES
+    assert [image["archive_path"] for image in result["images"]] == [f"word/media/image{i}.png" for i in range(7)]
+    assert result["images"][6]["timing"]["duplicate_of"] == "word/media/image0.png"
+    assert all("data" not in image for image in result["images"])
+    assert progress[0] == (0, 7) and progress[-1] == (7, 7)
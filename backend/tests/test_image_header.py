@@ -0,0 +1,98 @@
+"""Быстрый разбор заголовков: совпадение с PIL и отказ от Image.open там, где он не нужен."""
+import io
+
+import pytest
+from PIL import Image, PngImagePlugin
+
+from app.services.image_analyzer import ImageAnalyzer
+from app.services.image_header import parse_image_header
+
+
+def png(mode, **params):
+    info = PngImagePlugin.PngInfo()
+    info.add_text("Software", "Midjourney v6")
+    info.add_text("Comment", "prompt " * 40, zip=True)
+    info.add_itxt("XML:com.adobe.xmp", '<x:xmpmeta xmlns:x="adobe:ns:meta/"/>')
+    info.add_itxt("Description", "описание", lang="ru", tkey="Описание", zip=True)
+    buf = io.BytesIO()
+    Image.new(mode, (33, 17)).save(buf, "PNG", pnginfo=info, **params)
+    return buf.getvalue()
+
+
+def jpeg(mode, **params):
+    exif = Image.Exif()
+    exif[0x0131] = "Adobe Photoshop"
+    exif[0x011A] = 7200 / 100
+    exif[0x0128] = 3
+    buf = io.BytesIO()
+    Image.new(mode, (40, 30)).save(buf, "JPEG", exif=exif.tobytes(), **params)
+    return buf.getvalue()
+
+
+IMAGES = {
+    "png-1": png("1", transparency=1),
+    "png-L": png("L", transparency=0, dpi=(150, 150)),
+    "png-I16": png("I;16"),
+    "png-P": png("P", transparency=0, optimize=True),
+    "png-RGB": png("RGB", transparency=(1, 2, 3), icc_profile=b"\0" * 3000),
+    "png-LA": png("LA"),
+    "png-RGBA": png("RGBA", exif=b"Exif\x00\x00II*\x00\x08\x00\x00\x00\x00\x00"),
+    "jpeg-L": jpeg("L", comment=b"comment"),
+    "jpeg-RGB": jpeg("RGB", progressive=True, xmp=b"<x:xmpmeta/>"),
+    "jpeg-RGB-dpi": jpeg("RGB", dpi=(300, 300), icc_profile=b"\0" * 70000),
+    "jpeg-CMYK": jpeg("CMYK"),
+}
+
+
+def pil_header(data):
+    with Image.open(io.BytesIO(data)) as img:
+        return {"format": img.format, "width": img.width, "height": img.height, "mode": img.mode, "info": dict(img.info)}
+
+
+@pytest.mark.parametrize("name", IMAGES)
+def test_header_matches_pil(name):
+    header = parse_image_header(IMAGES[name])
+    expected = pil_header(IMAGES[name])
+    assert header == expected
+    # Порядок ключей img.info виден в результате (info_* в XMP)
+    assert list(header["info"]) == list(expected["info"])
+
+
+def test_header_without_info_when_pil_parses_differently():
+    data = IMAGES["png-RGB"]
+    # Неверная контрольная сумма чанка: PIL отвергает файл целиком
+    broken = bytearray(data)
+    broken[data.index(b"tEXt") + 6] ^= 0xFF
+    header = parse_image_header(bytes(broken))
+    assert header["width"] == 33 and "info" not in header
+    # 12-битный JPEG PIL не открывает
+    twelve_bit = bytearray(IMAGES["jpeg-L"])
+    twelve_bit[twelve_bit.index(b"\xff\xc0") + 4] = 12
+    assert "info" not in parse_image_header(bytes(twelve_bit))
+
+
+def analyze(data, use_header=True):
+    """Результаты извлечения XMP и EXIF (fallback без ExifTool) и запись с заголовками"""
+    analyzer = ImageAnalyzer()
+    record = analyzer._build_image_record("image", exiftool_data={"_exiftool_error": "ExifTool недоступен"}, data=data)
+    if not use_header:
+        record["header"] = None
+    return analyzer.extract_xmp_data("image", record), analyzer.extract_exif_data("image", record), record
+
+
+@pytest.mark.parametrize("name", [name for name in IMAGES if name.startswith("jpeg")])
+def test_jpeg_metadata_is_read_without_pil(name):
+    xmp, exif, record = analyze(IMAGES[name])
+    assert not record["pil"].loaded
+    assert (xmp, exif) == analyze(IMAGES[name], use_header=False)[:2]
+
+
+@pytest.mark.parametrize("name", [name for name in IMAGES if name.startswith("png")])
+def test_png_xmp_is_read_without_pil(name):
+    analyzer = ImageAnalyzer()
+    record = analyzer._build_image_record("image", exiftool_data={}, data=IMAGES[name])
+    xmp = analyzer.extract_xmp_data("image", record)
+    assert not record["pil"].loaded
+    assert xmp["info_Software"] == "Midjourney v6"
+    # Текстовые чанки PNG для fallback EXIF читает только PIL
+    assert analyze(IMAGES[name])[:2] == analyze(IMAGES[name], use_header=False)[:2]
@@ -0,0 +1,100 @@
+"""Фоновые задачи: общий пул анализа, завершение и срок хранения."""
+import threading
+
+import pytest
+
+from app.services import job_manager as job_manager_module
+from app.services.job_manager import JOB_DONE, JOB_FAILED, JOB_RUNNING, JobManager
+from app.services.task_executor import BoundedExecutor, ExecutorBusyError
+
+
+@pytest.fixture(autouse=True)
+def fake_time(monkeypatch, clock):
+    monkeypatch.setattr(job_manager_module, "time", clock)
+
+
+@pytest.fixture
+def executor():
+    executor = BoundedExecutor(kind="thread", max_workers=1, max_pending=0, name="test-jobs")
+    yield executor
+    executor.shutdown()
+
+
+def run(manager, func, *args, finalize=lambda analyzed: (analyzed, "report.pdf"), on_finish=None):
+    """Задача, поставленная в пул, и событие ее завершения"""
+    job = manager.create("document.docx")
+    finished = threading.Event()
+    job.subscribe(lambda event, payload: event in (JOB_DONE, JOB_FAILED) and finished.set())
+    manager.submit(job, func, *args, finalize=finalize, on_finish=on_finish)
+    return job, finished
+
+
+def test_jobs_share_the_analysis_executor_limit(executor):
+    manager = JobManager(executor, ttl=60)
+    release = threading.Event()
+    job, finished = run(manager, lambda job: release.wait(5) and {"n": 1})
+
+    rejected = manager.create("second.docx")
+    with pytest.raises(ExecutorBusyError):
+        manager.submit(rejected, lambda job: {}, finalize=lambda analyzed: (analyzed, "report.pdf"))
+    assert manager.get(rejected.id) is None
+    # Синхронный анализ стоит в той же очереди
+    with pytest.raises(ExecutorBusyError):
+        executor.submit(lambda: None)
+
+    release.set()
+    assert finished.wait(5)
+    assert job.status == JOB_DONE and job.result == {"n": 1}
+    assert executor.accepted == 0
+
+
+def test_finished_job_is_kept_ttl_after_finish(executor, clock):
+    manager = JobManager(executor, ttl=60)
+    progress = threading.Event()
+    release = threading.Event()
+
+    def slow(job):
+        progress.set()
+        release.wait(5)
+        return {}
+
+    statuses = []
+    job, finished = run(manager, slow)
+    job.subscribe(lambda event, payload: statuses.append((event, job.finished_at)))
+    assert progress.wait(5) and job.status == JOB_RUNNING
+    # Анализ дольше срока хранения: отсчет идет от завершения, а не от запуска
+    clock.advance(120)
+    release.set()
+    assert finished.wait(5)
+    assert statuses == [(JOB_DONE, clock.now)]
+
+    clock.advance(59)
+    assert manager.get(job.id) is job
+    clock.advance(2)
+    assert manager.get(job.id) is None
+
+
+def test_failed_job(executor):
+    manager = JobManager(executor, ttl=60)
+    released = []
+
+    def invalid(job):
+        raise ValueError("Файл не является корректным документом DOCX/PPTX")
+
+    job, finished = run(manager, invalid, on_finish=lambda: released.append(True))
+    assert finished.wait(5)
+    assert job.status == JOB_FAILED and job.error_status == 400
+    assert job.finished_at is not None and released == [True]
+
+    job, finished = run(manager, lambda job: {}, finalize=lambda analyzed: 1 / 0)
+    assert finished.wait(5)
+    assert job.status == JOB_FAILED and job.error_status == 500
+
+
+def test_complete_cached_job(executor, clock):
+    manager = JobManager(executor, ttl=60)
+    job = manager.create("document.docx")
+    manager.complete(job, {"n": 1}, "report.pdf")
+    assert job.status == JOB_DONE and job.finished_at == clock.now
+    assert (job.result, job.report_filename) == ({"n": 1}, "report.pdf")
+    assert executor.accepted == 0
@@ -0,0 +1,104 @@
+"""Хранилище отчётов: TTL, вытеснение по объёму, уборка брошенных файлов."""
+import os
+
+import pytest
+
+from app.services import report_store
+from app.services.report_store import ReportStore
+
+REPORT = {"summary": {"source": "тест"}, "metadata": {"images": []}}
+
+
+@pytest.fixture(autouse=True)
+def fake_time(monkeypatch, clock):
+    monkeypatch.setattr(report_store, "time", clock)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ReportStore(str(tmp_path), ttl=3600, max_bytes=1 << 20)
+
+
+def render(store, name, size=100):
+    """PDF отчёта, записанный так же, как это делает рендеринг"""
+    tmp_path = store.pdf_tmp_path(name)
+    with open(tmp_path, "wb") as f:
+        f.write(b"%PDF-" + b"0" * (size - 5))
+    return store.commit_pdf(name, tmp_path)
+
+
+def test_save_load_render(store):
+    name = store.save(REPORT)
+    assert ReportStore.valid_name(name)
+    assert store.exists(name) and store.rendered(name) is None
+    assert store.load(name) == REPORT
+    assert render(store, name) == store.pdf_path(name)
+    assert store.rendered(name) == store.pdf_path(name)
+    assert store.save(REPORT) != name
+
+
+@pytest.mark.parametrize("name", ["../reports.sqlite3", "report_x.pdf", "report_" + "0" * 32 + ".json"])
+def test_invalid_names(store, name):
+    assert not store.exists(name)
+    assert store.load(name) is None
+
+
+def test_ttl(store, clock):
+    name = store.save(REPORT)
+    render(store, name)
+    clock.advance(3601)
+    assert not store.exists(name) and store.rendered(name) is None
+    assert store.evict() == 1
+    assert not os.path.exists(store.pdf_path(name)) and not os.path.exists(store.data_path(name))
+
+
+def test_evicts_least_recently_accessed(tmp_path, clock):
+    # Три отчёта по 250 байт PDF и данные к ним не помещаются в 800 байт
+    store = ReportStore(str(tmp_path), ttl=3600, max_bytes=800)
+    names = []
+    for _ in range(3):
+        names.append(store.save(REPORT))
+        render(store, names[-1], size=250)
+        clock.advance(100)
+    # После обращения к первому отчёту самый давно запрошенный — второй
+    assert store.rendered(names[0]) is not None
+    assert store.evict() == 1
+    assert not store.exists(names[1])
+    assert store.exists(names[0]) and store.exists(names[2])
+
+
+def test_eviction_is_shared_between_processes(tmp_path, clock):
+    # Два экземпляра на одном каталоге — как два процесса uvicorn
+    first = ReportStore(str(tmp_path), ttl=3600)
+    second = ReportStore(str(tmp_path), ttl=3600)
+    name = first.save(REPORT)
+    assert second.load(name) == REPORT
+    clock.advance(3601)
+    assert second.evict() == 1
+    assert first.evict() == 0
+    assert first.load(name) is None
+
+
+def test_render_of_evicted_report_is_discarded(store, clock):
+    name = store.save(REPORT)
+    clock.advance(3601)
+    store.evict()
+    assert render(store, name) is None
+    assert not os.path.exists(store.pdf_path(name))
+
+
+def test_orphans_are_removed(store, clock):
+    live = store.save(REPORT)
+    orphan = os.path.join(store.directory, "report_" + "f" * 32 + ".pdf")
+    stale_tmp = store.pdf_tmp_path(live)
+    for path in (orphan, stale_tmp):
+        with open(path, "wb") as f:
+            f.write(b"%PDF-")
+    # Свежие файлы без строки индекса могут быть еще не проиндексированы
+    store.evict()
+    assert os.path.exists(orphan) and os.path.exists(stale_tmp)
+    for path in (orphan, stale_tmp):
+        os.utime(path, (clock.now - 7200, clock.now - 7200))
+    store.evict()
+    assert not os.path.exists(orphan) and not os.path.exists(stale_tmp)
+    assert store.load(live) == REPORT
@@ -0,0 +1,84 @@
+"""Вытеснение записей из кэшей результатов изображений и документов."""
+import json
+
+import pytest
+
+from app.services import result_cache
+from app.services.result_cache import DocumentResultCache, ImageResultCache
+
+
+@pytest.fixture(autouse=True)
+def fake_time(monkeypatch, clock):
+    monkeypatch.setattr(result_cache, "time", clock)
+
+
+def put(cache, digest, payload="x"):
+    cache.put(digest, {"payload": payload}, {"ai_probability": 0})
+
+
+def entry_size(payload):
+    """Размер сериализованной записи, как ее считает кэш"""
+    return len(json.dumps({"metadata": {"payload": payload}, "ai_indicators": {"ai_probability": 0}}).encode())
+
+
+def test_memory_lru_by_entries():
+    cache = ImageResultCache(version="t", max_entries=2, max_bytes=1 << 20, db_path=None)
+    put(cache, "a")
+    put(cache, "b")
+    assert cache.get("a") is not None  # "a" становится самой свежей
+    put(cache, "c")
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+
+
+def test_memory_lru_by_bytes():
+    cache = ImageResultCache(version="t", max_entries=100, max_bytes=3 * entry_size("x" * 80), db_path=None)
+    for digest in "abc":
+        put(cache, digest, payload="x" * 80)
+    put(cache, "d", payload="x" * 80)
+    assert cache.get("a") is None
+    assert all(cache.get(digest) is not None for digest in "bcd")
+    # Запись больше всего кэша не сохраняется и не вытесняет остальные
+    put(cache, "huge", payload="x" * 1000)
+    assert cache.get("huge") is None
+    assert all(cache.get(digest) is not None for digest in "bcd")
+
+
+def test_get_returns_independent_copies():
+    cache = ImageResultCache(version="t", db_path=None)
+    put(cache, "a")
+    metadata, _ = cache.get("a")
+    metadata["payload"] = "changed"
+    assert cache.get("a")[0] == {"payload": "x"}
+
+
+def test_disk_eviction_by_last_access(tmp_path, clock):
+    db_path = str(tmp_path / "cache.sqlite3")
+    cache = ImageResultCache(version="t", max_entries=0, db_path=db_path, db_max_bytes=3 * entry_size("x" * 30))
+    for digest in "abc":
+        put(cache, digest, payload="x" * 30)
+        clock.advance(1)
+    assert cache.get("a") is not None  # обращение обновляет время: первым вытесняется "b"
+    clock.advance(1)
+    put(cache, "d", payload="x" * 30)
+    assert cache.get("b") is None
+    assert all(cache.get(digest) is not None for digest in "acd")
+
+
+def test_disk_cache_survives_restart_and_drops_old_version(tmp_path):
+    db_path = str(tmp_path / "cache.sqlite3")
+    put(ImageResultCache(version="1", db_path=db_path), "a")
+    assert ImageResultCache(version="1", db_path=db_path).get("a") is not None
+    assert ImageResultCache(version="2", db_path=db_path).get("a") is None
+    assert ImageResultCache(version="1", db_path=db_path).get("a") is None
+
+
+def test_document_cache_ttl_and_lru(clock):
+    cache = DocumentResultCache(ttl=60, max_entries=2, max_bytes=1 << 20, version="t")
+    cache.put("a", {"n": 1}, "report_a.pdf")
+    cache.put("b", {"n": 2}, "report_b.pdf")
+    assert cache.get("a") == ({"n": 1}, "report_a.pdf")
+    cache.put("c", {"n": 3}, "report_c.pdf")
+    assert cache.get("b") is None
+    clock.advance(61)
+    assert cache.get("a") is None and cache.get("c") is None
@@ -0,0 +1,203 @@
+"""
+Декларативные правила AIDetector против эвристик, которые раньше были записаны
+в коде детектора: ожидаемые значения получены прежней реализацией.
+"""
+import json
+import random
+
+import pytest
+
+from app.services import rule_engine
+from app.services.ai_detector import AIDetector, IMAGE_FEATURES, SCORE_FEATURES
+from app.services.rule_engine import RulesetError, load_ruleset
+
+# Метаданные изображения -> (эвристики, аномалии, вероятность, уверенность) прежнего детектора
+CASES = {
+    "camera_jpeg": (
+        {
+            "exif": {"iso": 100, "date_time": "2024:01:01 12:00:00", "make": "Canon"},
+            "image_characteristics": {"file_format": "jpeg", "supports_exif": True, "has_gps": True,
+                                      "has_camera_info": True, "has_shooting_params": True},
+        },
+        {}, [], 0, "low",
+    ),
+    "stripped_square_jpeg": (
+        {
+            "exif": {},
+            "image_characteristics": {"file_format": "jpeg", "supports_exif": True, "is_square": True,
+                                      "is_standard_ai_size": True},
+            "metadata_integrity": {"metadata_removed": True},
+        },
+        {"missing_metadata": True, "square_image": True, "standard_ai_size": True, "no_gps": True,
+         "no_camera_info": True, "no_shooting_params": True, "multiple_ai_indicators": True},
+        [
+            "Метаданные удалены или отсутствуют",
+            "Квадратное изображение (типично для ИИ-генераторов)",
+            "Стандартный размер для ИИ-генератора",
+            "Множественные признаки ИИ: квадратное JPEG без метаданных",
+            "Отсутствуют GPS координаты",
+            "Отсутствует информация о камере",
+            "Отсутствуют параметры съемки (ISO, выдержка и т.д.)",
+        ],
+        45, "medium",
+    ),
+    "jpeg_without_exif_fields": (
+        {
+            "exif": {"iso": 25},
+            "image_characteristics": {"file_format": "jpeg", "supports_exif": True},
+        },
+        {"no_gps": True, "no_camera_info": True, "no_shooting_params": True, "unusual_iso": True,
+         "no_datetime": True, "multiple_ai_indicators": True},
+        [
+            "Необычно низкий ISO: 25",
+            "Отсутствует дата и время съемки",
+            "Полное отсутствие EXIF (GPS, камера, параметры съемки) — подозрительно для JPEG",
+        ],
+        45, "medium",
+    ),
+    "ai_size_png": (
+        {
+            "exif": {},
+            "image_characteristics": {"file_format": "png", "supports_exif": False, "is_square": True,
+                                      "is_standard_ai_size": True,
+                                      "suspicious_features": ["Квадратное изображение", "Нет EXIF"]},
+        },
+        {"square_image": True, "standard_ai_size": True, "multiple_ai_indicators": True},
+        [
+            "Квадратное изображение (типично для ИИ-генераторов)",
+            "Стандартный размер для ИИ-генератора",
+            "Нет EXIF",
+            "PNG с признаками ИИ-генерации (квадратное, стандартный размер)",
+        ],
+        45, "medium",
+    ),
+    "contradictions": (
+        {
+            "exif": {"iso": "auto", "date_time": "2024:01:01 12:00:00"},
+            "image_characteristics": {"file_format": "jpeg", "supports_exif": True, "has_gps": True,
+                                      "has_camera_info": True},
+            "metadata_integrity": {"contradictions": ["Дата изменения раньше даты съемки"]},
+        },
+        {"metadata_contradictions": True, "no_shooting_params": True},
+        ["Дата изменения раньше даты съемки", "Отсутствуют параметры съемки (ISO, выдержка и т.д.)"],
+        43, "medium",
+    ),
+    "ai_software": (
+        {
+            "exif": {"software": "Midjourney"},
+            "image_characteristics": {"file_format": "webp", "supports_exif": True, "has_camera_info": True},
+            "ai_software_detected": ["Midjourney"],
+        },
+        {"no_gps": True, "no_shooting_params": True, "no_datetime": True},
+        [
+            "Отсутствует дата и время съемки",
+            "Отсутствуют GPS координаты",
+            "Отсутствуют параметры съемки (ISO, выдержка и т.д.)",
+        ],
+        100, "high",
+    ),
+    "c2pa_agent": (
+        {
+            "exif": {"_c2pa_metadata": {"c2pa_software_agent": "GPT-4o", "c2pa_actions": "c2pa.created"},
+                     "_c2pa_manifest_types": ["c2pa.created"]},
+            "image_characteristics": {"file_format": "png", "supports_exif": False, "is_square": True},
+        },
+        {}, [], 100, "high",
+    ),
+    "c2pa_signature_only": (
+        {
+            "exif": {"_c2pa_metadata": {"c2pa_validation_success": "claimSignature.validated"}},
+            "image_characteristics": {"file_format": "jpeg", "supports_exif": True},
+        },
+        {}, [], 90, "high",
+    ),
+}
+
+
+@pytest.fixture(scope="module")
+def detector():
+    return AIDetector()
+
+
+@pytest.mark.parametrize("name", list(CASES))
+def test_matches_previous_heuristics(detector, name):
+    metadata, heuristics, anomalies, probability, confidence = CASES[name]
+    result = detector.detect_ai_signs(metadata)
+    assert result["heuristics"] == heuristics
+    assert result["anomalies"] == anomalies
+    assert result["ai_probability"] == probability
+    assert result["confidence"] == confidence
+
+
+def test_custom_ruleset(tmp_path):
+    path = tmp_path / "rules.json"
+    path.write_text(json.dumps({
+        "version": "test",
+        "heuristics": ["square_image"],
+        "detect": [
+            {"id": "square", "when": ["is_square", "iso < 50"], "heuristic": "square_image",
+             "anomaly": "Квадрат, ISO {iso}"},
+        ],
+        "score": [{"when": ["square_image"], "add": 30}, {"when": [], "at_most": 20}],
+    }), encoding="utf-8")
+    ruleset = load_ruleset(str(path), IMAGE_FEATURES, SCORE_FEATURES)
+
+    heuristics, anomalies = ruleset.detect({"is_square": True, "iso": 25})
+    assert heuristics == {"square_image": True}
+    assert anomalies == ["Квадрат, ISO 25"]
+    assert ruleset.detect({"is_square": True, "iso": 100}) == ({}, [])
+    assert ruleset.score({"square_image": True}) == 20
+
+
+@pytest.mark.parametrize("condition", ["iso <", "iso ~ 5", "unknown_feature"])
+def test_invalid_condition_rejected(tmp_path, condition):
+    path = tmp_path / "rules.json"
+    path.write_text(json.dumps({
+        "version": "test",
+        "detect": [{"id": "bad", "when": [condition], "heuristic": "square_image"}],
+    }), encoding="utf-8")
+    with pytest.raises(RulesetError):
+        load_ruleset(str(path), IMAGE_FEATURES, SCORE_FEATURES)
+
+
+def test_score_many_matches_score(detector, monkeypatch):
+    rng = random.Random(0)
+    rows = []
+    for metadata, *_ in CASES.values():
+        indicators = detector.detect_ai_signs(metadata, score=False)
+        indicators["_metadata_ref"] = metadata
+        rows.append(detector._score_features(indicators))
+    for _ in range(500):
+        row = {name: rng.random() < 0.3 for name in detector.ruleset.heuristics if rng.random() < 0.8}
+        row.update({
+            "has_evidence": rng.random() < 0.1,
+            "evidence_count": rng.randint(0, 4),
+            "evidence_ai_source": rng.random() < 0.5,
+            "has_software": rng.random() < 0.2,
+            "supports_exif": rng.choice([True, False, None]),
+            "anomaly_count": rng.randint(0, 7),
+        })
+        rows.append(row)
+    expected = [detector.ruleset.score(row) for row in rows]
+    assert detector.ruleset.score_many(rows) == expected
+    monkeypatch.setattr(rule_engine, "np", None)
+    assert detector.ruleset.score_many(rows) == expected
+
+
+def test_score_ai_signs_matches_detect_ai_signs(detector):
+    metadata_list = [metadata for metadata, *_ in CASES.values()]
+    results = [detector.detect_ai_signs(metadata, score=False) for metadata in metadata_list]
+    detector.score_ai_signs(results, metadata_list)
+    assert results == [detector.detect_ai_signs(metadata) for metadata in metadata_list]
+
+
+@pytest.mark.parametrize("rule", [
+    {"id": "code", "when": ["__import__('os').system('true')"]},
+    {"id": "code", "when": ["iso < 1 or True"]},
+    {"id": "code", "when": ["iso < 1e3"]},
+])
+def test_rule_text_is_not_code(tmp_path, rule):
+    path = tmp_path / "rules.json"
+    path.write_text(json.dumps({"version": "test", "detect": [rule]}), encoding="utf-8")
+    with pytest.raises(RulesetError):
+        load_ruleset(str(path), IMAGE_FEATURES, SCORE_FEATURES)
@@ -0,0 +1,85 @@
+"""Пул задач: таймаут, перезапуск пула процессов и повтор рендеринга отчёта."""
+import asyncio
+import os
+import time
+from concurrent.futures import BrokenExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from app.services import report_generator
+from app.services.task_executor import BoundedExecutor, ExecutorRestartedError, ExecutorTimeoutError
+
+
+def sleep(seconds):
+    time.sleep(seconds)
+    return seconds
+
+
+def crash():
+    os._exit(1)
+
+
+@pytest.fixture
+def executor():
+    executor = BoundedExecutor(kind="process", max_workers=2, max_pending=0, name="test-render")
+    yield executor
+    executor.shutdown()
+
+
+def test_hung_task_restarts_the_pool(executor):
+    async def scenario():
+        hung = asyncio.ensure_future(executor.run(sleep, 30, timeout=0.5))
+        victim = asyncio.ensure_future(executor.run(sleep, 5, timeout=10))
+        results = await asyncio.gather(hung, victim, return_exceptions=True)
+        return results, await executor.run(sleep, 0, timeout=10)
+
+    started = time.monotonic()
+    (hung, victim), after = asyncio.run(scenario())
+    assert isinstance(hung, ExecutorTimeoutError)
+    # Задача, остановленная вместе с чужой зависшей, повторяема
+    assert isinstance(victim, ExecutorRestartedError)
+    # Новый пул создан, процессы старого не дожидаются
+    assert after == 0 and time.monotonic() - started < 5
+
+
+def test_crashed_process_is_not_a_restart(executor):
+    async def scenario():
+        with pytest.raises(BrokenExecutor) as error:
+            await executor.run(crash, timeout=10)
+        return error.value, await executor.run(sleep, 0, timeout=10)
+
+    error, after = asyncio.run(scenario())
+    assert not isinstance(error, ExecutorRestartedError)
+    assert after == 0
+
+
+class ScriptedExecutor:
+    """Пул рендеринга, который отвечает заданными результатами по очереди"""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    async def run(self, func, *args, timeout=None):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+@pytest.mark.parametrize("error, retried", [
+    (ExecutorRestartedError("пул перезапущен"), True),
+    (ExecutorTimeoutError("таймаут"), False),
+    (BrokenProcessPool("процесс упал"), False),
+], ids=["restarted", "own-timeout", "crash"])
+def test_report_is_rerendered_only_after_restart(monkeypatch, error, retried):
+    executor = ScriptedExecutor(error, "report.pdf")
+    monkeypatch.setattr(report_generator, "report_executor", executor)
+    if retried:
+        assert asyncio.run(report_generator._render_in_pool("report")) == "report.pdf"
+    else:
+        with pytest.raises(type(error)):
+            asyncio.run(report_generator._render_in_pool("report"))
+    assert executor.calls == (2 if retried else 1)